@@ -0,0 +1,174 @@
+//! Benchmarks of the decode hot paths on synthetic frames and DBC definitions (see blf2mdf::synthetic).
+//! Throughput is reported per frame (or per signal value for the per-signal groups), so
+//! criterion's time per element is the nanoseconds per frame or signal.
+//!
+//! Run with `cargo bench`, or `cargo bench -- extract_signal_raw` for a single group.
+
+use std::collections::HashMap;
+use std::hint::black_box;
+use std::io::{self, Cursor};
+
+use can_dbc::{ByteOrder, Message, Signal, ValueType, DBC};
+use criterion::{criterion_group, criterion_main, BatchSize, Criterion, Throughput};
+
+use blf2mdf::blf_reader::BlfReader;
+use blf2mdf::data_store::DataStore;
+use blf2mdf::decode::{decode_message, extract_signal_raw, process_signal, MessagePlan};
+use blf2mdf::synthetic;
+
+const FRAMES: u64 = 10_000;
+
+/// One message of every synthetic layout (Intel, Motorola, multiplexed and 64 bit signals)
+fn load_dbc() -> DBC {
+    let source = synthetic::dbc_source(0, synthetic::LAYOUTS.len());
+    DBC::from_slice(source.as_bytes()).expect("Synthetic DBC doesn't parse")
+}
+
+fn message_frames(message_idx: usize) -> Vec<[u8; 8]> {
+    let mut rng = synthetic::Rng::new(message_idx as u64);
+    (0..FRAMES).map(|frame_idx| synthetic::frame_data(message_idx, frame_idx, &mut rng)).collect()
+}
+
+/// Benchmark name of a signal: its layout name without the message prefix, e.g. IntelS12
+fn signal_id(signal: &Signal) -> String {
+    signal.name().rsplit_once('_').map_or(signal.name().clone(), |(_, name)| name.to_string())
+}
+
+fn signal_bus_map(dbc: &DBC) -> HashMap<String, u32> {
+    dbc.messages()
+        .iter()
+        .flat_map(|msg: &Message| msg.signals())
+        .map(|sig| (sig.name().clone(), 0))
+        .collect()
+}
+
+fn message_plan(dbc: &DBC, msg: &Message, signal_bus_map: &HashMap<String, u32>, data_store: &mut DataStore) -> MessagePlan {
+    MessagePlan::new(0, msg, dbc, std::slice::from_ref(dbc), signal_bus_map, data_store)
+        .expect("Synthetic message doesn't compile")
+}
+
+fn bench_extract_signal_raw(c: &mut Criterion) {
+    let dbc = load_dbc();
+    let mut group = c.benchmark_group("extract_signal_raw");
+    group.throughput(Throughput::Elements(FRAMES));
+
+    for (message_idx, msg) in dbc.messages().iter().enumerate() {
+        let frames = message_frames(message_idx);
+        for signal in msg.signals() {
+            let start_bit = *signal.start_bit() as i64;
+            let bit_count = *signal.signal_size() as i64;
+            let is_big_endian = *signal.byte_order() == ByteOrder::BigEndian;
+
+            group.bench_function(signal_id(signal), |b| b.iter(|| {
+                for data in &frames {
+                    black_box(extract_signal_raw(black_box(data), start_bit, bit_count, is_big_endian));
+                }
+            }));
+        }
+    }
+    group.finish();
+}
+
+fn bench_process_signal(c: &mut Criterion) {
+    let dbc = load_dbc();
+    let mut group = c.benchmark_group("process_signal");
+    group.throughput(Throughput::Elements(FRAMES));
+
+    for (message_idx, msg) in dbc.messages().iter().enumerate() {
+        let frames = message_frames(message_idx);
+        for signal in msg.signals() {
+            let start_bit = *signal.start_bit() as i64;
+            let bit_count = *signal.signal_size() as i64;
+            let is_big_endian = *signal.byte_order() == ByteOrder::BigEndian;
+            let is_signed = *signal.value_type() == ValueType::Signed;
+            let factor = *signal.factor();
+            let offset = *signal.offset();
+            let store_as_float = (factor.fract() != 0.0) || (offset.fract() != 0.0);
+
+            let mut registered = DataStore::new();
+            let id = registered.register(signal.name(), None);
+
+            group.bench_function(signal_id(signal), |b| b.iter_batched(
+                || registered.clone(),
+                |mut data_store| {
+                    for (frame_idx, data) in frames.iter().enumerate() {
+                        process_signal(
+                            data, start_bit, bit_count, is_big_endian, is_signed, store_as_float,
+                            factor, offset, id, frame_idx as f64, &mut data_store);
+                    }
+                    data_store
+                },
+                BatchSize::LargeInput,
+            ));
+        }
+    }
+    group.finish();
+}
+
+fn bench_decode_message(c: &mut Criterion) {
+    let dbc = load_dbc();
+    let signal_bus_map = signal_bus_map(&dbc);
+    let mut group = c.benchmark_group("decode_message");
+    group.throughput(Throughput::Elements(FRAMES));
+
+    for (message_idx, msg) in dbc.messages().iter().enumerate() {
+        let frames = message_frames(message_idx);
+        let mut registered = DataStore::new();
+        let plan = message_plan(&dbc, msg, &signal_bus_map, &mut registered);
+        group.bench_function(synthetic::message_layout(message_idx), |b| b.iter_batched(
+            || registered.clone(),
+            |mut data_store| {
+                for (frame_idx, data) in frames.iter().enumerate() {
+                    decode_message(data, frame_idx as f64, &plan, &mut data_store);
+                }
+                data_store
+            },
+            BatchSize::LargeInput,
+        ));
+    }
+    group.finish();
+}
+
+fn bench_parse_container_data(c: &mut Criterion) {
+    let container = synthetic::container_data(synthetic::LAYOUTS.len(), FRAMES, 0);
+    let mut group = c.benchmark_group("parse_container_data");
+    group.throughput(Throughput::Elements(FRAMES));
+
+    group.bench_function("can_message", |b| b.iter_batched(
+        || BlfReader::from_reader(Cursor::new(synthetic::file_header(0, 0, 0))).unwrap(),
+        |mut reader| reader.parse_container_data(black_box(&container)).unwrap(),
+        BatchSize::SmallInput,
+    ));
+    group.finish();
+}
+
+fn bench_write_to_stream(c: &mut Criterion) {
+    let dbc = load_dbc();
+    let signal_bus_map = signal_bus_map(&dbc);
+
+    // Decode all frames once, the plans register the signals with their message like in process_file
+    let mut data_store = DataStore::new();
+    for (message_idx, msg) in dbc.messages().iter().enumerate() {
+        let plan = message_plan(&dbc, msg, &signal_bus_map, &mut data_store);
+        for (frame_idx, data) in message_frames(message_idx).iter().enumerate() {
+            decode_message(data, frame_idx as f64, &plan, &mut data_store);
+        }
+    }
+    let mut stream = Vec::new();
+    data_store.write_to_stream(&mut stream).unwrap();
+
+    let mut group = c.benchmark_group("write_to_stream");
+    group.throughput(Throughput::Bytes(stream.len() as u64));
+    group.bench_function("all_layouts", |b| b.iter(|| data_store.write_to_stream(io::sink()).unwrap()));
+    group.finish();
+}
+
+criterion_group!(
+    benches,
+    bench_extract_signal_raw,
+    bench_process_signal,
+    bench_decode_message,
+    bench_parse_container_data,
+    bench_write_to_stream
+);
+criterion_main!(benches);
@@ -0,0 +1,173 @@
+"""
+Benchmark of the write_mdf.py stream loader on synthetic BLF2MDF streams.
+
+Reports MB/s and samples/s for every stage:
+- parse: reading the stream into arrays (loader time without the two stages below)
+- repair: timestamp repair (make_monotonic)
+- complete: value table completion (complete_value_table)
+- append: appending the groups to an in-memory asammdf MDF
+Samples are counted per signal value, the shared timestamps of a group are not counted.
+
+The numbers can be stored as a baseline and later runs are compared against it:
+
+    python script/bench_loader.py --save-baseline
+    python script/bench_loader.py --max-regression 0.2
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import synthetic_stream
+import write_mdf
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(SCRIPT_DIR, 'bench_loader_baseline.json')
+
+STAGES = ('parse', 'repair', 'complete', 'append')
+
+
+class StageTimer:
+    """
+    Wraps loader functions to add up the time spent in them.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+        return timed
+
+
+def run_once(stream, mapped):
+    """
+    Load and append the stream once and return the seconds per stage.
+    """
+    timer = StageTimer()
+    make_monotonic = write_mdf.make_monotonic
+    complete_value_table = write_mdf.complete_value_table
+    write_mdf.make_monotonic = timer.wrap('repair', make_monotonic)
+    write_mdf.complete_value_table = timer.wrap('complete', complete_value_table)
+    try:
+        if mapped:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.blf2mdf')
+                with open(path, 'wb') as file:
+                    file.write(stream)
+                groups, load_seconds = load_all(write_mdf.load_from_file(path))
+        else:
+            groups, load_seconds = load_all(write_mdf.load_stream(io.BufferedReader(io.BytesIO(stream))))
+    finally:
+        write_mdf.make_monotonic = make_monotonic
+        write_mdf.complete_value_table = complete_value_table
+    timer.seconds['parse'] = load_seconds - timer.seconds['repair'] - timer.seconds['complete']
+
+    mdf = write_mdf.asammdf.MDF()
+    start = time.perf_counter()
+    for group_name, group_comment, timestamps, group_signals in groups:
+        mdf.append(write_mdf.make_signals(timestamps, group_signals), acq_name=group_name, comment=group_comment)
+    timer.seconds['append'] = time.perf_counter() - start
+    mdf.close()
+
+    return timer.seconds
+
+
+def load_all(groups):
+    start = time.perf_counter()
+    groups = list(groups)
+    return groups, time.perf_counter() - start
+
+
+def benchmark(options, repeat, mapped):
+    """
+    Run the benchmark and return the result with the best time of every stage.
+    """
+    stream = synthetic_stream.generate_stream(**options)
+    sample_count = options['messages'] * options['samples'] * options['signals_per_message']
+
+    runs = [run_once(stream, mapped) for _ in range(repeat)]
+    stages = {}
+    for stage in STAGES:
+        seconds = min(run[stage] for run in runs)
+        stages[stage] = {
+            'seconds': seconds,
+            'mb_per_s': len(stream) / 1e6 / seconds if seconds > 0 else float('inf'),
+            'samples_per_s': sample_count / seconds if seconds > 0 else float('inf'),
+        }
+
+    return {
+        'options': {**options, 'type_mix': list(options['type_mix']), 'mapped': mapped},
+        'stream_bytes': len(stream),
+        'samples': sample_count,
+        'machine': f"{platform.machine()} {platform.processor() or platform.system()}, Python {platform.python_version()}",
+        'stages': stages,
+    }
+
+
+def print_result(result, baseline=None):
+    """
+    Print the stages, with the change against the baseline if there is one.
+    Returns the largest slowdown against the baseline (0 without baseline).
+    """
+    print(f"{result['stream_bytes'] / 1e6:.1f} MB stream, {result['samples']} samples")
+    worst = 0.0
+    for stage in STAGES:
+        numbers = result['stages'][stage]
+        line = (f"  {stage:<9} {numbers['seconds'] * 1000:9.1f} ms {numbers['mb_per_s']:10.1f} MB/s "
+                f"{numbers['samples_per_s'] / 1e6:9.2f} M samples/s")
+        if baseline:
+            baseline_seconds = baseline['stages'][stage]['seconds']
+            if baseline_seconds > 0:
+                change = numbers['seconds'] / baseline_seconds - 1
+                worst = max(worst, change)
+                line += f"  {change:+7.1%} vs baseline"
+        print(line)
+    return worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the write_mdf.py stream loader")
+    synthetic_stream.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the best one counts (default: 3)")
+    parser.add_argument('--mapped', action='store_true', help="load the stream from a memory mapped file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help="exit with an error if a stage is slower than the baseline by more than this share")
+    parser.set_defaults(samples=100_000, types='1,2,3,4', value_table_size=16, non_monotonic_rate=0.001)
+    args = parser.parse_args()
+
+    write_mdf.wait_writer_imports()
+    result = benchmark(synthetic_stream.stream_options(args), args.repeat, args.mapped)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['options'] != result['options']:
+            print("Baseline was measured with other options, not comparing")
+            baseline = None
+        else:
+            print(f"Baseline: {baseline['machine']}")
+
+    worst = print_result(result, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=4)
+            file.write('\n')
+        print(f"Saved baseline to {args.baseline}")
+    elif args.max_regression is not None and worst > args.max_regression:
+        print(f"Regression of {worst:.1%} exceeds {args.max_regression:.1%}")
+        sys.exit(1)
@@ -0,0 +1,88 @@
+"""
+Start-up benchmark for write_mdf.py.
+
+Runs the writer the same way the Rust application does (python -c <script> <output.mf4>) and measures
+the time from spawning the interpreter until the writer reads the first byte of its stdin,
+and until the whole (small) stream is written to the MF4 file.
+
+The first read is detected by filling the stdin pipe completely before the writer starts reading,
+the pipe becomes writable again as soon as the writer reads from it. Linux only (F_GETPIPE_SZ).
+"""
+
+import argparse
+import fcntl
+import os
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_stream
+
+F_GETPIPE_SZ = 1032
+
+
+def run_once(script_code, writer_args, stream, output_file):
+    """
+    Return the seconds until the first stdin read and until the writer exited.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', script_code, output_file, *writer_args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    pipe = process.stdin.fileno()
+    capacity = fcntl.fcntl(pipe, F_GETPIPE_SZ)
+    if len(stream) <= capacity:
+        raise ValueError(f"Stream of {len(stream)} bytes doesn't fill the pipe ({capacity} bytes)")
+
+    # Fill the pipe, it only becomes writable again once the writer reads from it
+    os.set_blocking(pipe, False)
+    written = 0
+    while written < capacity:
+        written += os.write(pipe, stream[written:capacity])
+    select.select([], [pipe], [])
+    first_read = time.perf_counter() - start
+
+    os.set_blocking(pipe, True)
+    process.stdin.write(stream[written:])
+    process.stdin.close()
+    if process.wait():
+        raise RuntimeError(f"Writer exited with {process.returncode}")
+    total = time.perf_counter() - start
+    return first_read, total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the start-up latency of write_mdf.py")
+    parser.add_argument('--script', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_mdf.py'),
+                        help="writer script to benchmark (default: write_mdf.py next to this file)")
+    parser.add_argument('--runs', type=int, default=10, help="number of runs (default: 10)")
+    parser.add_argument('--samples', type=int, default=100_000, help="samples of the streamed signal (default: 100000)")
+    parser.add_argument('writer_args', nargs=argparse.REMAINDER, help="extra writer arguments, e.g. -- --stream")
+    args = parser.parse_args()
+    writer_args = [arg for arg in args.writer_args if arg != '--']
+
+    with open(args.script, encoding='utf-8') as file:
+        script_code = file.read()
+    stream = synthetic_stream.generate_stream(messages=1, signals_per_message=1, samples=args.samples,
+                                              type_mix=(synthetic_stream.TYPE_F64,))
+
+    first_reads = []
+    totals = []
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'startup.mf4')
+        for _ in range(args.runs):
+            first_read, total = run_once(script_code, writer_args, stream, output_file)
+            first_reads.append(first_read)
+            totals.append(total)
+
+    print(f"{args.script} ({args.runs} runs, {len(stream) / 1e6:.1f} MB stream)")
+    print(f"  interpreter to first byte: median {statistics.median(first_reads) * 1000:7.1f} ms, "
+          f"min {min(first_reads) * 1000:7.1f} ms")
+    print(f"  interpreter to exit:       median {statistics.median(totals) * 1000:7.1f} ms, "
+          f"min {min(totals) * 1000:7.1f} ms")
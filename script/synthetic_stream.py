@@ -0,0 +1,127 @@
+"""
+Generator for synthetic BLF2MDF v5 streams, as written by DataStore::write_to_stream.
+
+Used by the benchmarks, and on its own to write a stream file that write_mdf.py can read with --input:
+
+    python script/synthetic_stream.py stream.blf2mdf --messages 20 --samples 100000
+    python script/write_mdf.py stream.mf4 --input stream.blf2mdf
+"""
+
+import argparse
+import struct
+
+import numpy as np
+
+STREAM_MAGIC = b"BLF2MDF\x05"
+
+# Type markers of the value columns
+TYPE_I64 = 1
+TYPE_U64 = 2
+TYPE_F64 = 3
+TYPE_STRING = 4
+
+
+def text(value):
+    data = value.encode('utf-8')
+    return struct.pack('<H', len(data)) + data
+
+
+def make_timestamps(rng, sample_count, non_monotonic_rate):
+    """
+    Increasing timestamps with roughly 10 ms cycle time, a share of them jumps back below their predecessor.
+    """
+    timestamps = np.cumsum(rng.uniform(0.005, 0.015, sample_count))
+    jumps = np.flatnonzero(rng.random(sample_count) < non_monotonic_rate)
+    jumps = jumps[jumps > 0]
+    timestamps[jumps] = timestamps[jumps - 1] - rng.uniform(0.0, 0.01, len(jumps))
+    return timestamps.astype('<f8')
+
+
+def make_values(rng, type_marker, sample_count, value_table_size):
+    """
+    Encoded value column of one signal. Integer signals with a value table use about twice as many
+    distinct values as there are table entries, so half of the values are unknown to the table.
+    """
+    if type_marker in (TYPE_I64, TYPE_U64):
+        high = 2 * value_table_size if value_table_size else 1000
+        low = -high // 2 if type_marker == TYPE_I64 else 0
+        dtype = '<i8' if type_marker == TYPE_I64 else '<u8'
+        return rng.integers(low, low + high, sample_count).astype(dtype).tobytes()
+    if type_marker == TYPE_F64:
+        return rng.normal(0.0, 100.0, sample_count).astype('<f8').tobytes()
+    if type_marker == TYPE_STRING:
+        strings = [f"value {number}".encode('utf-8') for number in rng.integers(0, 1000, sample_count)]
+        lengths = np.array([len(string) for string in strings], dtype='<u2')
+        return lengths.tobytes() + b''.join(strings)
+    raise ValueError(f"Unknown type marker {type_marker}")
+
+
+def generate_stream(messages=10, signals_per_message=8, samples=10_000, type_mix=(TYPE_I64, TYPE_U64, TYPE_F64),
+                    value_table_size=0, non_monotonic_rate=0.0, seed=0):
+    """
+    Build a stream with one group per message. The signals of a message cycle through type_mix,
+    integer signals get a value table with value_table_size entries.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [STREAM_MAGIC, struct.pack('<I', messages)]
+    for message_idx in range(messages):
+        parts.append(struct.pack('<BI', message_idx % 2, 0x100 + message_idx))
+        parts.append(text(f"Message_{message_idx}"))
+        parts.append(struct.pack('<I', samples))
+        parts.append(make_timestamps(rng, samples, non_monotonic_rate).tobytes())
+
+        parts.append(struct.pack('<H', signals_per_message))
+        for signal_idx in range(signals_per_message):
+            type_marker = type_mix[signal_idx % len(type_mix)]
+            parts.append(text(f"Message_{message_idx}_Signal_{signal_idx}"))
+            parts.append(text("" if type_marker == TYPE_STRING else "km/h"))
+
+            table_size = value_table_size if type_marker in (TYPE_I64, TYPE_U64) else 0
+            parts.append(struct.pack('<H', table_size))
+            for value in range(table_size):
+                parts.append(struct.pack('<q', value))
+                parts.append(text(f"State {value}"))
+
+            parts.append(bytes([type_marker]))
+            parts.append(make_values(rng, type_marker, samples, value_table_size))
+    return b''.join(parts)
+
+
+def add_arguments(parser):
+    """
+    Add the generator options to an argument parser, see stream_options.
+    """
+    parser.add_argument('--messages', type=int, default=10, help="number of messages (signal groups)")
+    parser.add_argument('--signals', type=int, default=8, help="signals per message")
+    parser.add_argument('--samples', type=int, default=10_000, help="samples per message")
+    parser.add_argument('--types', default='1,2,3', help="comma separated type markers the signals cycle through "
+                        "(1 = i64, 2 = u64, 3 = f64, 4 = string)")
+    parser.add_argument('--value-table-size', type=int, default=0, help="value table entries of integer signals")
+    parser.add_argument('--non-monotonic-rate', type=float, default=0.0,
+                        help="share of timestamps that jump back below their predecessor")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+
+
+def stream_options(args):
+    """
+    generate_stream keyword arguments from parsed add_arguments options.
+    """
+    return {
+        'messages': args.messages,
+        'signals_per_message': args.signals,
+        'samples': args.samples,
+        'type_mix': tuple(int(marker) for marker in args.types.split(',')),
+        'value_table_size': args.value_table_size,
+        'non_monotonic_rate': args.non_monotonic_rate,
+        'seed': args.seed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic BLF2MDF stream file")
+    parser.add_argument('output_file', help="path of the stream file to write")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.output_file, 'wb') as file:
+        file.write(generate_stream(**stream_options(args)))
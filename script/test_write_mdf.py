@@ -0,0 +1,147 @@
+"""
+Tests of the stream loader in write_mdf.py, run with `python -m unittest discover script`.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import write_mdf
+from synthetic_stream import generate_stream, TYPE_I64, TYPE_U64, TYPE_F64
+
+
+def make_monotonic_reference(timestamps):
+    """
+    Sample by sample timestamp repair of the original loader.
+    """
+    repaired = []
+    last_timestep = None
+    for timestamp in timestamps:
+        if last_timestep is not None and timestamp <= last_timestep:
+            timestamp = last_timestep + 1e-9
+        last_timestep = timestamp
+        repaired.append(timestamp)
+    return np.array(repaired, dtype=np.float64)
+
+
+class MakeMonotonicTest(unittest.TestCase):
+
+    def assert_matches_reference(self, timestamps):
+        expected = make_monotonic_reference(timestamps)
+        actual = write_mdf.make_monotonic(timestamps.copy())
+        # Compare the bits, so -0.0 and 0.0 or a last ulp difference are caught as well
+        np.testing.assert_array_equal(actual.view(np.uint64), expected.view(np.uint64))
+
+    def test_empty_and_single(self):
+        self.assert_matches_reference(np.array([], dtype=np.float64))
+        self.assert_matches_reference(np.array([1.5]))
+
+    def test_sorted_is_unchanged(self):
+        timestamps = np.cumsum(np.random.default_rng(1).uniform(1e-6, 1e-2, 10000))
+        self.assert_matches_reference(timestamps)
+
+    def test_random(self):
+        rng = np.random.default_rng(2)
+        for _ in range(50):
+            count = int(rng.integers(2, 5000))
+            self.assert_matches_reference(rng.uniform(0.0, 10.0, count))
+
+    def test_nearly_sorted(self):
+        rng = np.random.default_rng(3)
+        for _ in range(50):
+            timestamps = np.cumsum(rng.uniform(0.0, 1e-3, 5000))
+            late = rng.choice(len(timestamps), 50, replace=False)
+            timestamps[late] -= rng.uniform(0.0, 1e-2, len(late))
+            self.assert_matches_reference(timestamps)
+
+    def test_ties(self):
+        rng = np.random.default_rng(4)
+        for _ in range(50):
+            # Few distinct values, so most samples repeat their predecessor
+            timestamps = np.sort(rng.integers(0, 20, 5000)).astype(np.float64) * 1e-6
+            self.assert_matches_reference(timestamps)
+            self.assert_matches_reference(rng.integers(0, 5, 5000).astype(np.float64) * 1e-8)
+
+    def test_long_runs_of_ties(self):
+        timestamps = np.repeat(np.array([0.0, 1.0, 1.0 + 1e-7, 2.0]), 20000)
+        self.assert_matches_reference(timestamps)
+
+    def test_large_magnitude(self):
+        # Absolute timestamps, where 1e-9 is below or close to the spacing of the doubles
+        rng = np.random.default_rng(5)
+        for base in [1.7e9, 1e6, 1e7, 3e8]:
+            steps = rng.choice([0.0, 0.0, 1e-9, 1e-6, -1e-6], 20000)
+            self.assert_matches_reference(base + np.cumsum(steps))
+            self.assert_matches_reference(np.full(1000, base))
+
+    def test_descending(self):
+        self.assert_matches_reference(np.linspace(1.0, 0.0, 3000))
+
+    def test_near_ties_cost_about_one_sample_loop(self):
+        # Nanosecond near-ties, where rounding makes the array operations disagree with the rule again and again.
+        # Correcting them used to rescan the whole tail every time, which took minutes here.
+        rng = np.random.default_rng(6)
+        count = 200_000
+        pattern = np.tile([0.0, 1e-9, 0.0, 2e-9], count // 4) + np.repeat(np.arange(count // 4) * 3e-9, 4)
+        jitter = np.arange(count) * 1e-9 + rng.normal(0.0, 1e-9, count)
+        for timestamps in [1.7e9 + pattern, 1.0 + pattern, 1.0 + jitter, 1e6 + jitter]:
+            start = time.perf_counter()
+            expected = make_monotonic_reference(timestamps)
+            reference_time = time.perf_counter() - start
+            start = time.perf_counter()
+            actual = write_mdf.make_monotonic(timestamps.copy())
+            actual_time = time.perf_counter() - start
+            np.testing.assert_array_equal(actual.view(np.uint64), expected.view(np.uint64))
+            self.assertLess(actual_time, 4 * reference_time)
+
+
+class LoadStreamMemoryTest(unittest.TestCase):
+    MESSAGES = 4
+    SIGNALS = 4
+    SAMPLES = 200_000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stream = generate_stream(messages=cls.MESSAGES, signals_per_message=cls.SIGNALS, samples=cls.SAMPLES,
+                                     type_mix=(TYPE_I64, TYPE_U64, TYPE_F64))
+        # Timestamp and value columns of all groups, 8 bytes per sample each
+        cls.column_bytes = cls.MESSAGES * (1 + cls.SIGNALS) * cls.SAMPLES * 8
+
+    def load_peak(self, load):
+        """
+        Load all groups, keeping them alive, and return the peak of the memory allocated meanwhile.
+        """
+        tracemalloc.start()
+        try:
+            groups = list(load())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(groups), self.MESSAGES)
+        self.assertEqual(sum(len(timestamps) for _, _, timestamps, _ in groups), self.MESSAGES * self.SAMPLES)
+        return peak
+
+    def test_read_is_one_copy_per_signal(self):
+        # Every column is read straight into its final array, even a temporary second copy of one column fails
+        peak = self.load_peak(lambda: write_mdf.load_stream(io.BytesIO(self.stream)))
+        self.assertGreaterEqual(peak, self.column_bytes)
+        self.assertLess(peak, self.column_bytes + self.SAMPLES * 8 // 2)
+
+    def test_mapped_read_is_zero_copy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stream.blf2mdf')
+            with open(path, 'wb') as file:
+                file.write(self.stream)
+            peak = self.load_peak(lambda: write_mdf.load_from_file(path))
+        self.assertLess(peak, self.column_bytes * 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
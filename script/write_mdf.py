@@ -1,129 +1,706 @@
 import logging
 logging.getLogger('canmatrix.formats').setLevel(logging.ERROR)
 
-import asammdf
+import argparse
+import json
+import mmap
+import os
 import sys
-import tqdm
+import time
 import numpy as np
 import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from io import BufferedReader
+from itertools import chain
+
+# The writer modules (asammdf pulls in pandas and canmatrix) take most of the start-up time,
+# they are imported by import_writer_modules, in the background while the stream is already read
+asammdf = None
+tqdm = None
+tool = None
+v4b = None
+v4c = None
+conversion_transfer = None
+GLOBAL_OPTIONS = None
+fmt_to_datatype_v4 = None
+
+
+TIMESTAMP_STEP = 1e-9
+# Samples repaired at once with array operations (make_monotonic)
+MONOTONIC_SPAN = 1 << 16
+# Repaired runs up to this length are walked in parallel, longer ones accumulated one by one (make_monotonic)
+MONOTONIC_SHORT_RUN = 32
+
+# Value dtypes of the numeric type markers (1 = i64, 2 = u64, 3 = f64)
+VALUE_DTYPES = {1: '<i8', 2: '<u8', 3: '<f8'}
+
+STREAM_MAGIC = b"BLF2MDF\x05"
+# Manifest sent instead of the stream when it was written to a file (shared memory or kept intermediate)
+MANIFEST_MAGIC = b"BLF2MDFM"
+MANIFEST_REMOVE_FILE = 0x01
+
+
+def import_writer_modules():
+    global asammdf, tqdm, tool, v4b, v4c, conversion_transfer, GLOBAL_OPTIONS, fmt_to_datatype_v4
+    import asammdf
+    import tqdm
+    from asammdf import tool
+    from asammdf.blocks import v4_blocks as v4b
+    from asammdf.blocks import v4_constants as v4c
+    from asammdf.blocks.conversion_utils import conversion_transfer
+    from asammdf.blocks.options import GLOBAL_OPTIONS
+    from asammdf.blocks.utils import fmt_to_datatype_v4
+
+
+writer_imports = None
+
+
+def start_writer_imports():
+    """
+    Start importing the writer modules in a background thread.
+    """
+    global writer_imports
+    if writer_imports is None:
+        writer_imports = ThreadPoolExecutor(max_workers=1).submit(import_writer_modules)
+
+
+def wait_writer_imports():
+    """
+    Wait until the writer modules are imported, raising the import error if there was one.
+    """
+    start_writer_imports()
+    writer_imports.result()
+
+
+def make_monotonic(timestamps):
+    """
+    Ensure strictly increasing timestamps (in place).
+    Every timestamp that is not larger than its (already corrected) predecessor is replaced by
+    predecessor + TIMESTAMP_STEP. The result is bit-identical to applying that rule sample by sample,
+    but computed with array operations instead of a Python loop over every sample.
+    """
+    # Repaired in spans of bounded size, each with array operations and a sequential correction
+    for start in range(1, len(timestamps), MONOTONIC_SPAN):
+        tail = timestamps[start - 1:start + MONOTONIC_SPAN]
+        if not (tail[1:] <= tail[:-1]).any():
+            continue
+
+        # In exact arithmetic the repaired series is a running maximum of (t - i * step) + i * step,
+        # so a sample is kept exactly when it is larger than that maximum up to its predecessor
+        raw = tail.copy()
+        offsets = np.arange(len(tail)) * TIMESTAMP_STEP
+        running_max = np.maximum.accumulate(tail - offsets)
+        kept = np.empty(len(tail), dtype=bool)
+        kept[0] = True
+        kept[1:] = (tail[1:] - offsets[:-1]) > running_max[:-1]
+
+        # Repeated float additions, so every value builds on its already repaired predecessor
+        run_starts = np.flatnonzero(kept[:-1] & ~kept[1:]) + 1
+        kept_idx = np.append(np.flatnonzero(kept), len(tail))
+        run_ends = kept_idx[np.searchsorted(kept_idx, run_starts)]
+        long_runs = run_ends - run_starts > MONOTONIC_SHORT_RUN
+
+        # Walk all short runs in parallel, one position per step
+        level = run_starts[~long_runs]
+        while len(level):
+            tail[level] = tail[level - 1] + TIMESTAMP_STEP
+            level = level[level + 1 < len(tail)] + 1
+            level = level[~kept[level]]
+
+        # Accumulate each long run in one go
+        for run_start, run_end in zip(run_starts[long_runs], run_ends[long_runs]):
+            run = np.full(run_end - run_start + 1, TIMESTAMP_STEP)
+            run[0] = tail[run_start - 1]
+            tail[run_start - 1:run_end] = np.add.accumulate(run)
+
+        # Rounding can misclassify a sample right at the boundary, check against the sequential rule
+        repaired = np.flatnonzero(~kept)
+        valid = np.ones(len(tail), dtype=bool)
+        valid[1:] = tail[1:] > tail[:-1]
+        valid[repaired] = raw[repaired] <= tail[repaired - 1]
+
+        invalid = np.flatnonzero(~valid)
+        if len(invalid) == 0:
+            continue
+
+        # Apply the rule sample by sample from every wrong sample on, until the result meets the array
+        # result again. Every sample is visited at most once, so this costs at most one sample loop.
+        raw_values = raw.tolist()
+        values = tail.tolist()
+        correct_until = 0
+        for first in invalid.tolist():
+            if first < correct_until:
+                continue
+            last_timestamp = values[first - 1]
+            for i in range(first, len(values)):
+                timestamp = raw_values[i]
+                if timestamp <= last_timestamp:
+                    timestamp = last_timestamp + TIMESTAMP_STEP
+                if timestamp == values[i]:
+                    # Equal from here on, the assignment only matters for 0.0 and -0.0
+                    values[i] = timestamp
+                    break
+                values[i] = last_timestamp = timestamp
+            else:
+                break
+            correct_until = i + 1
+        tail[:] = values
+
+    return timestamps
+
+
+def complete_value_table(value_table, values):
+    """
+    Add an "<value> is unknown" entry for every value that is missing in the value table.
+    Samples with a known value are masked out first, so only the distinct unknown values are
+    checked against the table. New entries are added in order of first occurrence.
+    """
+    # Only keys that are exactly representable in the sample dtype can match a sample
+    if values.dtype.kind == 'f':
+        keys = [key for key in value_table if float(key) == key]
+    else:
+        limits = np.iinfo(values.dtype)
+        keys = [key for key in value_table if limits.min <= key <= limits.max]
+    unknown = values[~np.isin(values, np.array(keys, dtype=values.dtype))]
+
+    unique_values, first_index = np.unique(unknown, return_index=True)
+    for value in unique_values[np.argsort(first_index)]:
+        if value not in value_table:
+            value_table[value] = f"{value} is unknown"
+
+    return value_table
+
+
+def read_exact_into(reader, buffer):
+    """
+    Fill the whole buffer from the reader, raising if the stream ends early.
+    """
+    view = memoryview(buffer).cast('B')
+    while len(view):
+        read_count = reader.readinto(view)
+        if not read_count:
+            raise ValueError("Unexpected end of binary stream")
+        view = view[read_count:]
+
+
+class MappedReader:
+    """
+    Reader over a memory mapped stream file. Columns are returned as views of the mapping instead of copies.
+    The mapping is private (copy on write), so the views are writable without changing the file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.position = 0
+
+    def read(self, size):
+        data = self.mapping[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def read_array(self, count, dtype):
+        dtype = np.dtype(dtype)
+        end = self.position + count * dtype.itemsize
+        if end > len(self.mapping):
+            raise ValueError("Unexpected end of binary stream")
+        values = np.frombuffer(self.mapping, dtype=dtype, count=count, offset=self.position)
+        self.position = end
+        return values
+
+
+def read_array(reader, count, dtype):
+    """
+    Read a contiguous column, as a view for mapped streams and with readinto directly into its final array otherwise.
+    """
+    if isinstance(reader, MappedReader):
+        return reader.read_array(count, dtype)
+    values = np.empty(count, dtype=dtype)
+    read_exact_into(reader, values)
+    return values
+
+
+def read_string_values(reader, data_count):
+    """
+    Read a columnar string block into a fixed-width utf-8 bytes ('S') array.
+    The string bytes are read in one go and scattered into the fixed-width rows using the offsets
+    derived from the length column.
+    """
+    lengths = read_array(reader, data_count, '<u2')
+    string_bytes = read_array(reader, int(lengths.sum(dtype=np.int64)), np.uint8)
+
+    width = max(int(lengths.max(initial=0)), 1)
+    values = np.zeros(data_count, dtype=f'S{width}')
+    rows = np.repeat(np.arange(data_count), lengths)
+    starts = np.cumsum(lengths, dtype=np.int64) - lengths
+    columns = np.arange(len(string_bytes)) - np.repeat(starts, lengths)
+    values.view(np.uint8).reshape(data_count, width)[rows, columns] = string_bytes
+
+    return values
+
+
+def read_text(reader):
+    """
+    Read a u16 length prefixed utf-8 string.
+    """
+    text_len = struct.unpack('<H', reader.read(2))[0]
+    return reader.read(text_len).decode('utf-8')
+
+
+def open_stdin():
+    # Use buffered reader for better performance
+    return BufferedReader(sys.stdin.buffer, buffer_size=1024*1024)  # 1MB buffer
 
 
 def load_from_stdin():
+    """
+    Load a single binary stream from stdin, see load_stream.
+    """
+    yield from load_stream(open_stdin())
+
+
+def load_from_file(path):
+    """
+    Load a saved binary stream from a file, which is memory mapped so numeric columns are zero-copy views.
+    """
+    yield from load_stream(MappedReader(path))
+
+
+def load_stream(reader):
     """
     Optimized binary reading with larger buffers and timestamp handling.
-    Supports v1 (no units), v2 (with units), and v3 (with units and value_tables) binary formats.
+    Supports the v5 binary format: one group per source CAN message with a shared timestamp column,
+    followed by the value columns of its signals (with units and value tables).
+    Yields (group_name, group_comment, timestamps, signals) with signals as (name, values, unit, value_table).
+    The reader is left at the first byte after the stream.
+    A manifest is followed to the stream file it points to, which is mapped and removed if requested.
     """
-    # Use buffered reader for better performance
-    reader = BufferedReader(sys.stdin.buffer, buffer_size=1024*1024)  # 1MB buffer
-    
     # Read magic header
     magic = reader.read(8)
-    if not magic == b"BLF2MDF\x03":
+    if magic == MANIFEST_MAGIC:
+        flags = struct.unpack('B', reader.read(1))[0]
+        path = read_text(reader)
+        mapped_reader = MappedReader(path)
+        if flags & MANIFEST_REMOVE_FILE:
+            # The mapping keeps the data alive, the file name is not needed anymore
+            os.remove(path)
+        yield from load_stream(mapped_reader)
+        return
+    if not magic == STREAM_MAGIC:
         raise ValueError("Invalid binary format")
     
-    # Read signal count
-    signal_count = struct.unpack('<I', reader.read(4))[0]
+    # Read group count
+    group_count = struct.unpack('<I', reader.read(4))[0]
     
-    for _ in range(signal_count):
-        # Read signal name
-        name_len = struct.unpack('<H', reader.read(2))[0]
-        signal_name = reader.read(name_len).decode('utf-8')
-        
-        # Read unit (only in v2+ format)
-        unit_len = struct.unpack('<H', reader.read(2))[0]
-        unit = reader.read(unit_len).decode('utf-8')
-        
-        # Read value table (only in v3+ format)
-        value_table = {}
-        value_table_count = struct.unpack('<H', reader.read(2))[0]
-        for _ in range(value_table_count):
-            value = struct.unpack('<q', reader.read(8))[0]  # i64
-            desc_len = struct.unpack('<H', reader.read(2))[0]
-            description = reader.read(desc_len).decode('utf-8')
-            value_table[value] = description
-
-        # Read type marker
-        type_marker = struct.unpack('B', reader.read(1))[0]
-        
-        # Read data count
+    for _ in range(group_count):
+        # Read source message of the group
+        bus, message_id = struct.unpack('<BI', reader.read(5))
+        group_name = read_text(reader)
+        group_comment = f"CAN bus {bus + 1}, message ID 0x{message_id:X}" if bus != 0xFF else ""
+
+        # Read the shared timestamps once for all signals of the group
         data_count = struct.unpack('<I', reader.read(4))[0]
-        
-        last_timestep = None
-        
-        # Read all data at once for this signal for better performance
-        if type_marker in [1, 2, 3]:  # i64, u64, f64 - all have 16 bytes per data point
-            # Read entire signal data in one operation
-            data_bytes = reader.read(data_count * 16)  # 16 bytes per data point
-            
-            # Use numpy for fast unpacking
-            data_array = np.frombuffer(data_bytes, dtype=np.uint8)
-            data_array = data_array.reshape(-1, 16)
-            
-            # Extract timestamps (first 8 bytes of each row)
-            timestamps_raw = data_array[:, :8].view(np.float64).flatten()
-            
-            # Apply timestamp handling (ensure monotonic increasing)
-            timestamps = []
-            for timestamp in timestamps_raw:
-                if last_timestep is not None and timestamp <= last_timestep:
-                    timestamp = last_timestep + 1e-9
-                last_timestep = timestamp
-                timestamps.append(timestamp)
-            
-            timestamps = np.array(timestamps)
-            
-            # Extract values based on type
-            if type_marker == 1:  # i64
-                values = data_array[:, 8:].view(np.int64).flatten()
-            elif type_marker == 2:  # u64
-                values = data_array[:, 8:].view(np.uint64).flatten()
-            elif type_marker == 3:  # f64
-                values = data_array[:, 8:].view(np.float64).flatten()
-
-            # Handle unknown value table values
-            if value_table:
-                for value in values:
-                    if value not in value_table:
-                        value_table[value] = f"{value} is unknown"
-
-            yield signal_name, timestamps, values, unit, value_table
-            
-        elif type_marker == 4:  # string - variable length, can't batch as easily
-            timestamps = []
-            values = []
-            
-            for _ in range(data_count):
-                timestamp = struct.unpack('<d', reader.read(8))[0]
-                if last_timestep is not None and timestamp <= last_timestep:
-                    timestamp = last_timestep + 1e-9
-                last_timestep = timestamp
-                
-                value_len = struct.unpack('<H', reader.read(2))[0]
-                value = reader.read(value_len).decode('utf-8')
-                timestamps.append(timestamp)
-                values.append(value)
-            
-            yield signal_name, np.array(timestamps), np.array(values), unit, value_table
-        
+        timestamps = read_array(reader, data_count, '<f8')
+
+        # Apply timestamp handling (ensure monotonic increasing)
+        timestamps = make_monotonic(timestamps)
+
+        signals = []
+        signal_count = struct.unpack('<H', reader.read(2))[0]
+        for _ in range(signal_count):
+            signal_name = read_text(reader)
+            unit = read_text(reader)
+
+            # Read value table
+            value_table = {}
+            value_table_count = struct.unpack('<H', reader.read(2))[0]
+            for _ in range(value_table_count):
+                value = struct.unpack('<q', reader.read(8))[0]  # i64
+                value_table[value] = read_text(reader)
+
+            # Read type marker and the value column
+            type_marker = struct.unpack('B', reader.read(1))[0]
+            if type_marker in VALUE_DTYPES:  # i64, u64, f64
+                values = read_array(reader, data_count, VALUE_DTYPES[type_marker])
+
+                # Handle unknown value table values
+                if value_table:
+                    complete_value_table(value_table, values)
+
+            elif type_marker == 4:  # string - columnar: all byte lengths, then all utf-8 bytes
+                values = read_string_values(reader, data_count)
+
+            else:
+                # The size of an unknown value column is unknown, so the rest of the stream can't be parsed
+                raise ValueError(f"Unknown type marker {type_marker} for signal {signal_name}")
+
+            signals.append((signal_name, values, unit, value_table))
+
+        yield group_name, group_comment, timestamps, signals
+
+
+def read_jobs(reader):
+    """
+    Read framed worker jobs: a u16 length prefixed utf-8 output path followed by one binary stream.
+    Yields the output paths until the input ends, the stream of each job must be consumed before the next one.
+    """
+    while True:
+        header = reader.read(2)
+        if not header:
+            return
+        if len(header) < 2:
+            raise ValueError("Truncated job header")
+        path_len = struct.unpack('<H', header)[0]
+        yield reader.read(path_len).decode('utf-8')
+
+
+class JobStream:
+    """
+    Signal groups of one worker job. Remembers whether reading the stream itself failed,
+    as opposed to writing the MF4 file, and can read the rest of the stream after a failed write.
+    """
+
+    def __init__(self, reader):
+        self.groups = load_stream(reader)
+        self.failed = False
+
+    def __iter__(self):
+        try:
+            yield from self.groups
+        except BaseException:
+            self.failed = True
+            raise
+
+    def drain(self):
+        """
+        Read the groups the writer didn't take, so the reader is at the next job.
+        """
+        for _ in self:
+            pass
+
+
+def write_status(output, error=None):
+    """
+    Send the outcome of a worker job: a status byte (0 = written, 1 = failed) and a u32 length prefixed utf-8 message.
+    """
+    message = str(error).encode('utf-8') if error is not None else b""
+    output.write(struct.pack('<BI', 0 if error is None else 1, len(message)) + message)
+    output.flush()
+
+
+def read_report(reader):
+    """
+    Read the u32 length prefixed JSON conversion report that ends a job in --report mode.
+    """
+    header = reader.read(4)
+    if len(header) < 4:
+        raise ValueError("Truncated conversion report")
+    report_len = struct.unpack('<I', header)[0]
+    return json.loads(reader.read(report_len).decode('utf-8'))
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far, None where the resource module is missing (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def write_report(output_file, writer_report, converter_report=None):
+    """
+    Write the conversion report of one file to <output>.report.json: the stages of the converter
+    (sent with the job, None when the stream was read from stdin or a file) and of this writer.
+    """
+    report_file = os.path.splitext(output_file)[0] + '.report.json'
+    with open(report_file, 'w', encoding='utf-8') as file:
+        json.dump({'output_file': output_file, 'converter': converter_report, 'writer': writer_report}, file, indent=4)
+        file.write('\n')
+
+
+class MdfStreamWriter:
+    """
+    MF4 writer that writes the data blocks of every appended signal straight to the output file.
+    Only the channel metadata is kept in memory, close() writes it and links it from the header.
+    Data blocks are split and compressed the same way as asammdf's MDF.save does it.
+    With compression_workers > 1 the data blocks are compressed in a thread pool (zlib releases the GIL)
+    and written in submission order, so the file is byte-identical to the single threaded output.
+    """
+
+    def __init__(self, output_file, compression=2, compression_workers=1):
+        wait_writer_imports()
+        self.compression = compression
+        self.fragment_size = GLOBAL_OPTIONS['write_fragment_size']
+        self.groups = []
+        self.output_file = output_file
+        self.file = open(output_file, 'wb')
+
+        # Queue of data blocks that are not written yet, bounded to limit the memory held by fragments
+        self.pending = deque()
+        self.pending_blocks = 0
+        if compression and compression_workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=compression_workers)
+            self.max_pending_blocks = 2 * compression_workers
         else:
-            # Unknown type marker - skip this signal
-            print(f"Warning: Unknown type marker {type_marker} for signal {signal_name}")
-            continue
+            self.executor = None
+            self.max_pending_blocks = 0
 
+        self.identification = v4b.FileIdentificationBlock(version='4.10')
+        self.header = v4b.HeaderBlock()
 
-if __name__ == '__main__':
-    # Get output file path
-    if len(sys.argv) < 2:
-        print("Usage: python write_mdf.py <output.mf4>")
-        sys.exit(1)
-    output_file = sys.argv[1]
+        # The header is written again by close() once all links are known
+        blocks = []
+        self.file.write(bytes(self.identification))
+        self.header.to_blocks(self.file.tell(), blocks)
+        for block in blocks:
+            self.file.write(bytes(block))
 
-    # Create a new MDF file
-    mdf = asammdf.MDF()
+    def append(self, signals, acq_name=None, comment=None):
+        """
+        Write one channel group with a time master channel and one channel per signal.
+        All signals must share the same timestamps.
+        """
+        if isinstance(signals, asammdf.Signal):
+            signals = [signals]
+        timestamps = signals[0].timestamps
+
+        master = v4b.Channel(
+            channel_type=v4c.CHANNEL_TYPE_MASTER,
+            data_type=v4c.DATA_TYPE_REAL_INTEL,
+            sync_type=v4c.SYNC_TYPE_TIME,
+            byte_offset=0,
+            bit_offset=0,
+            bit_count=64,
+        )
+        master.name = 'time'
+        master.unit = 's'
+        channels = [[master, 0]]
+        fields = [('time', timestamps)]
+        offset = 8
+
+        for signal in signals:
+            samples = signal.samples
+            if samples.dtype.kind == 'S':
+                # Strings are variable length signal data, the record only holds the offset
+                channel = v4b.Channel(
+                    channel_type=v4c.CHANNEL_TYPE_VLSD,
+                    data_type=v4c.DATA_TYPE_STRING_UTF_8,
+                    byte_offset=offset,
+                    bit_offset=0,
+                    bit_count=64,
+                    flags=0,
+                )
+            else:
+                data_type, bit_count = fmt_to_datatype_v4(samples.dtype, samples.shape)
+                channel = v4b.Channel(
+                    channel_type=v4c.CHANNEL_TYPE_VALUE,
+                    data_type=data_type,
+                    byte_offset=offset,
+                    bit_offset=0,
+                    bit_count=bit_count,
+                    flags=0,
+                )
+            channel.name = signal.name
+            channel.unit = signal.unit
+            channel.comment = signal.comment
+            channel.conversion = conversion_transfer(signal.conversion, version=4)
+            entry = [channel, 0]
+            channels.append(entry)
+            if samples.dtype.kind == 'S':
+                samples = self._write_signal_data(samples, partial(entry.__setitem__, 1))
+            fields.append((f'{len(fields)}', samples))
+            offset += samples.dtype.itemsize
+
+        data_group = v4b.DataGroup()
+        self._write_records(fields, offset, len(timestamps), partial(setattr, data_group, 'data_block_addr'))
+        channel_group = v4b.ChannelGroup(cycles_nr=len(timestamps), samples_byte_nr=offset)
+        channel_group.acq_name = acq_name
+        channel_group.comment = comment
+        self.groups.append((data_group, channel_group, channels))
+
+    def _write_block(self, block):
+        address = self.file.tell()
+        self.file.write(bytes(block))
+        align = block.block_len % 8
+        if align:
+            self.file.write(b"\0" * (8 - align))
+        return address
+
+    def _make_block(self, fragment, original_type, zip_type, param):
+        if self.compression:
+            return v4b.DataZippedBlock(data=fragment, zip_type=zip_type, param=param, original_type=original_type)
+        return v4b.DataBlock(data=fragment, type=original_type.decode())
+
+    def _write_blocks(self, fragments, block_len, original_type, zip_type, param, set_address):
+        """
+        Queue the fragments as DT/SD or DZ blocks and call set_address with the address to link the data from
+        once they are written. More than one fragment is referenced through a DL block (and a HL block if compressed).
+        """
+        data = {'block_len': block_len, 'zip_type': zip_type, 'addresses': [], 'set_address': set_address}
+        for fragment in fragments:
+            if self.executor:
+                block = self.executor.submit(self._make_block, fragment, original_type, zip_type, param)
+            else:
+                block = self._make_block(fragment, original_type, zip_type, param)
+            self.pending.append((block, data))
+            self.pending_blocks += 1
+            self._flush(self.max_pending_blocks)
+        self.pending.append((None, data))
+        self._flush(self.max_pending_blocks)
+
+    def _flush(self, max_pending_blocks=0):
+        """
+        Write queued blocks in submission order until at most max_pending_blocks are left.
+        """
+        while self.pending and (self.pending_blocks > max_pending_blocks or self.pending[0][0] is None):
+            block, data = self.pending.popleft()
+            if block is not None:
+                if self.executor:
+                    block = block.result()
+                data['addresses'].append(self._write_block(block))
+                self.pending_blocks -= 1
+            else:
+                data['set_address'](self._write_data_list(data['addresses'], data['block_len'], data['zip_type']))
+
+    def _write_data_list(self, addresses, block_len, zip_type):
+        if len(addresses) <= 1:
+            return addresses[0] if addresses else 0
 
-    # Process signals from stdin
-    for signal_name, timestamps, values, unit, value_table in tqdm.tqdm(load_from_stdin()):
+        data_list = v4b.DataList(
+            flags=v4c.FLAG_DL_EQUAL_LENGHT,
+            links_nr=len(addresses) + 1,
+            data_block_nr=len(addresses),
+            data_block_len=block_len,
+        )
+        for i, address in enumerate(addresses):
+            data_list[f'data_block_addr{i}'] = address
+        address = self._write_block(data_list)
+
+        if self.compression:
+            header_list = v4b.HeaderList(flags=v4c.FLAG_DL_EQUAL_LENGHT, zip_type=zip_type, first_dl_addr=address)
+            address = self._write_block(header_list)
+
+        return address
+
+    def _write_records(self, fields, record_size, cycles_nr, set_address):
+        """
+        Interleave the field columns into records fragment by fragment and write them as data blocks.
+        """
+        split_size = max(self.fragment_size // record_size, 1) * record_size
+        rows = split_size // record_size
+        record_dtype = np.dtype([(name, column.dtype) for name, column in fields])
+
+        def fragments():
+            for start in range(0, cycles_nr, rows):
+                stop = min(start + rows, cycles_nr)
+                records = np.empty(stop - start, dtype=record_dtype)
+                for name, column in fields:
+                    records[name] = column[start:stop]
+                yield records.tobytes()
+
+        if self.compression == 1:
+            zip_type, param = v4c.FLAG_DZ_DEFLATE, 0
+        else:
+            zip_type, param = v4c.FLAG_DZ_TRANSPOSED_DEFLATE, record_size
+        self._write_blocks(fragments(), split_size, b"DT", zip_type, param, set_address)
+
+    def _write_signal_data(self, samples, set_address):
+        """
+        Write fixed size string samples as length prefixed signal data and return the record offsets.
+        """
+        item_size = samples.dtype.itemsize
+        signal_data = np.empty(len(samples), dtype=[('size', '<u4'), ('value', samples.dtype)])
+        signal_data['size'] = item_size
+        signal_data['value'] = samples
+        signal_data = memoryview(signal_data.view(np.uint8))
+        offsets = np.arange(len(samples), dtype='<u8') * (item_size + 4)
+
+        fragments = (
+            signal_data[start:start + self.fragment_size]
+            for start in range(0, len(signal_data), self.fragment_size)
+        )
+        self._write_blocks(fragments, self.fragment_size, b"SD", v4c.FLAG_DZ_DEFLATE, 0, set_address)
+        return offsets
+
+    def abort(self):
+        """
+        Stop writing after a failure: drop the queued data blocks and remove the incomplete output file.
+        """
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+        self.pending.clear()
+        self.pending_blocks = 0
+        self.file.close()
+        try:
+            os.remove(self.output_file)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Write all metadata blocks, link them and rewrite the header.
+        """
+        # Write the remaining queued data blocks before the metadata
+        self._flush()
+        if self.executor:
+            self.executor.shutdown()
+
+        address = self.file.tell()
+        blocks = []
+        defined_texts = {"": 0, b"": 0}
+        cc_map = {}
+        si_map = {}
+
+        file_history = v4b.FileHistory()
+        file_history.comment = f"""<FHcomment>
+    <TX>created</TX>
+    <tool_id>{tool.__tool__}</tool_id>
+    <tool_vendor>{tool.__vendor__}</tool_vendor>
+    <tool_version>{tool.__version__}</tool_version>
+</FHcomment>"""
+        address = file_history.to_blocks(address, blocks, defined_texts)
+
+        for data_group, channel_group, channels in self.groups:
+            address = data_group.to_blocks(address, blocks, defined_texts)
+            for channel, signal_data_addr in channels:
+                address = channel.to_blocks(address, blocks, defined_texts, cc_map, si_map)
+                channel.data_block_addr = signal_data_addr
+            for (channel, _), (next_channel, _) in zip(channels, channels[1:]):
+                channel.next_ch_addr = next_channel.address
+            channels[-1][0].next_ch_addr = 0
+
+            channel_group.first_ch_addr = channels[0][0].address
+            channel_group.next_cg_addr = 0
+            address = channel_group.to_blocks(address, blocks, defined_texts, si_map)
+            data_group.first_cg_addr = channel_group.address
+
+        for (data_group, _, _), (next_group, _, _) in zip(self.groups, self.groups[1:]):
+            data_group.next_dg_addr = next_group.address
+        if self.groups:
+            self.groups[-1][0].next_dg_addr = 0
+
+        for block in blocks:
+            self.file.write(bytes(block))
+
+        self.header.first_dg_addr = self.groups[0][0].address if self.groups else 0
+        self.header.file_history_addr = file_history.address
+        self.file.seek(v4c.IDENTIFICATION_BLOCK_SIZE)
+        self.file.write(bytes(self.header))
+        self.file.close()
+
+
+def make_signals(timestamps, group_signals):
+    """
+    Create the asammdf signals of one group, value tables become value to text conversions.
+    """
+    signals = []
+    for signal_name, values, unit, value_table in group_signals:
         conversion = None
         if value_table:
             conversion = {}
@@ -131,16 +708,144 @@ if __name__ == '__main__':
                 conversion[f'val_{idx}'] = v
                 conversion[f'text_{idx}'] = t
 
-        signal = asammdf.Signal(
+        signals.append(asammdf.Signal(
             samples=values,
             timestamps=timestamps,
             name=signal_name,
             unit=unit,
-            conversion=conversion
-        )
-        mdf.append(signal)
+            conversion=conversion,
+            encoding='utf-8' if values.dtype.kind == 'S' else None
+        ))
+    return signals
+
+
+def timed_groups(groups, stats):
+    """
+    Pass the signal groups through, adding the time spent parsing them and their sample count to stats.
+    """
+    groups = iter(groups)
+    while True:
+        start = time.perf_counter()
+        group = next(groups, None)
+        stats['parse'] += time.perf_counter() - start
+        if group is None:
+            return
+        _, _, timestamps, group_signals = group
+        stats['samples'] += len(timestamps) * len(group_signals)
+        yield group
+
+
+def write_mdf(output_file, groups, stream=False, compression_workers=1):
+    """
+    Write the signal groups of one binary stream to an MF4 file.
+    Returns the writer part of the conversion report (see write_report).
+    """
+    start = time.perf_counter()
+    stats = {'parse': 0.0, 'samples': 0}
+    groups = timed_groups(groups, stats)
+
+    # Parse the first group while the writer modules may still be importing
+    first_group = next(groups, None)
+    groups = chain([first_group], groups) if first_group is not None else groups
+    import_start = time.perf_counter()
+    wait_writer_imports()
+    import_wait = time.perf_counter() - import_start
 
-    # Save to MF4 file
-    mdf.save(output_file, overwrite=True, compression=2)
+    # Create a new MDF file
+    if stream:
+        mdf = MdfStreamWriter(output_file, compression=2, compression_workers=compression_workers)
+    else:
+        mdf = asammdf.MDF()
+
+    try:
+        # Process signal groups, one channel group with a single time channel per CAN message
+        for group_name, group_comment, timestamps, group_signals in tqdm.tqdm(groups):
+            mdf.append(make_signals(timestamps, group_signals), acq_name=group_name, comment=group_comment)
+
+        # Save to MF4 file
+        if not stream:
+            mdf.save(output_file, overwrite=True, compression=2)
+    except BaseException:
+        # A worker goes on with the next job, so don't leave threads or open files behind
+        if stream:
+            mdf.abort()
+        else:
+            mdf.close()
+        raise
     mdf.close()
     print(f"Finished writing MDF file to {output_file}")
+
+    # Appending, saving and closing is the time that wasn't spent parsing or waiting for the imports
+    total = time.perf_counter() - start
+    stages = {
+        'parse': stats['parse'],
+        'import_wait': import_wait,
+        'mf4_save': max(total - stats['parse'] - import_wait, 0.0),
+    }
+    return {
+        'samples': stats['samples'],
+        'stages': {stage: {'seconds': seconds} for stage, seconds in stages.items()},
+        'total_seconds': total,
+        'samples_per_s': stats['samples'] / total if total > 0 else 0.0,
+        'mf4_bytes': os.path.getsize(output_file),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a BLF2MDF binary stream from stdin to an MF4 file")
+    parser.add_argument('output_file', nargs='?', help="path of the MF4 file to write")
+    parser.add_argument('--stream', action='store_true',
+                        help="write data blocks to the output file as signals arrive instead of saving an in-memory MDF at the end")
+    parser.add_argument('--compression-workers', type=int, default=1, metavar='N',
+                        help="number of threads compressing data blocks (requires --stream), the output is identical for any N")
+    parser.add_argument('--input', metavar='PATH',
+                        help="read a saved binary stream (e.g. kept with BLF2MDF_KEEP_STREAM=1) from a file instead of stdin")
+    parser.add_argument('--worker', action='store_true',
+                        help="stay alive and write one MF4 file per framed (output path, stream) job on stdin until it is closed")
+    parser.add_argument('--report', action='store_true',
+                        help="write a JSON report with the time of every stage to <output>.report.json, "
+                             "worker jobs end with the converter's report")
+    args = parser.parse_args()
+    if args.compression_workers < 1:
+        parser.error("--compression-workers must be at least 1")
+    if args.compression_workers > 1 and not args.stream:
+        parser.error("--compression-workers requires --stream")
+    if args.worker == (args.output_file is not None):
+        parser.error("exactly one of output_file and --worker is required")
+    if args.worker and args.input:
+        parser.error("--input can't be used with --worker")
+
+    # Start reading the stream right away, the writer modules are only needed for the first append
+    start_writer_imports()
+
+    if args.worker:
+        # Interpreter start-up and imports are paid once for all jobs.
+        # stdout carries the job statuses, everything printed goes to stderr instead.
+        status_output = sys.stdout.buffer
+        sys.stdout = sys.stderr
+        reader = open_stdin()
+        for output_file in read_jobs(reader):
+            job_stream = JobStream(reader)
+            try:
+                writer_report = write_mdf(output_file, job_stream, args.stream, args.compression_workers)
+                error = None
+            except Exception as e:
+                if job_stream.failed:
+                    # The end of a broken stream is unknown, so the following jobs can't be read either
+                    write_status(status_output, e)
+                    raise
+                error = e
+                job_stream.drain()
+            converter_report = read_report(reader) if args.report else None
+            if error is None and args.report:
+                try:
+                    write_report(output_file, writer_report, converter_report)
+                except OSError as e:
+                    print(f"Failed to write the conversion report of {output_file}: {e}", file=sys.stderr)
+            write_status(status_output, error)
+    else:
+        groups = load_from_file(args.input) if args.input else load_from_stdin()
+        writer_report = write_mdf(args.output_file, groups, args.stream, args.compression_workers)
+        if args.report:
+            write_report(args.output_file, writer_report)
@@ -0,0 +1,98 @@
+//! Scheduling of the files of a run over several conversion jobs, within a memory budget.
+
+use std::sync::{Condvar, Mutex};
+
+/// Parse a size in bytes with an optional K, M or G suffix, e.g. 512M. None if it isn't a size or doesn't fit into a u64.
+pub fn parse_size(value: &str) -> Option<u64> {
+    let (number, factor) = match value.chars().last()?.to_ascii_uppercase() {
+        'K' => (&value[..value.len() - 1], 1u64 << 10),
+        'M' => (&value[..value.len() - 1], 1 << 20),
+        'G' => (&value[..value.len() - 1], 1 << 30),
+        _ => (value, 1),
+    };
+    number.parse::<u64>().ok()?.checked_mul(factor)
+}
+
+struct SchedulerState {
+    /// Index and estimated memory of the files not started yet, in order
+    pending: Vec<(usize, u64)>,
+    reserved: u64,
+    running: usize,
+}
+
+/// Hands out the files of a run to the conversion jobs. A file is started once the estimated memory
+/// of all running files stays within the budget with it, the first pending file that fits is taken.
+/// A file that doesn't fit into the budget on its own is started when no other file is running.
+pub struct BatchScheduler {
+    state: Mutex<SchedulerState>,
+    file_finished: Condvar,
+    memory_budget: u64,
+}
+
+/// File handed out by the scheduler, its memory is released when it is dropped
+pub struct ScheduledFile<'a> {
+    scheduler: &'a BatchScheduler,
+    pub index: usize,
+    memory: u64,
+}
+
+impl BatchScheduler {
+    /// `memory_estimates` holds the estimated memory of every file, in the order they should be converted
+    pub fn new(memory_estimates: &[u64], memory_budget: u64) -> Self {
+        Self {
+            state: Mutex::new(SchedulerState {
+                pending: memory_estimates.iter().copied().enumerate().collect(),
+                reserved: 0,
+                running: 0,
+            }),
+            file_finished: Condvar::new(),
+            memory_budget,
+        }
+    }
+
+    /// Next file to convert, waits until one fits into the budget. None once every file was handed out.
+    pub fn next_file(&self) -> Option<ScheduledFile<'_>> {
+        let mut state = self.state.lock().unwrap();
+        loop {
+            if state.pending.is_empty() {
+                return None;
+            }
+            let fits = state.pending
+                .iter()
+                .position(|(_, memory)| state.running == 0 || state.reserved + memory <= self.memory_budget);
+            if let Some(pending_idx) = fits {
+                let (index, memory) = state.pending.remove(pending_idx);
+                state.reserved += memory;
+                state.running += 1;
+                return Some(ScheduledFile { scheduler: self, index, memory });
+            }
+            state = self.file_finished.wait(state).unwrap();
+        }
+    }
+}
+
+impl Drop for ScheduledFile<'_> {
+    fn drop(&mut self) {
+        let mut state = self.scheduler.state.lock().unwrap();
+        state.reserved -= self.memory;
+        state.running -= 1;
+        self.scheduler.file_finished.notify_all();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn parse_size_suffixes_and_overflow() {
+        assert_eq!(parse_size("10"), Some(10));
+        assert_eq!(parse_size("512k"), Some(512 << 10));
+        assert_eq!(parse_size("4G"), Some(4 << 30));
+        assert_eq!(parse_size("x"), None);
+        assert_eq!(parse_size("G"), None);
+        assert_eq!(parse_size("17179869183G"), Some(17179869183 << 30));
+        assert_eq!(parse_size("17179869184G"), None);
+        assert_eq!(parse_size("18446744073709551616"), None);
+    }
+}
@@ -0,0 +1,99 @@
+//! Writes a synthetic BLF file and one matching DBC file per bus for end-to-end load tests.
+//!
+//!     cargo run --release --bin blf_gen -- load_10g.blf --size 10G --busses 4 --messages 32
+
+use std::env;
+use std::fs::{self, File};
+use std::io::BufWriter;
+use std::path::Path;
+use std::process;
+use std::time::Instant;
+
+use blf2mdf::batch::parse_size;
+use blf2mdf::synthetic::{self, BlfOptions};
+
+const USAGE: &str = "Usage: blf_gen <output.blf> [options]
+  --size <bytes>          target file size, with K, M or G suffix (default: 100M)
+  --busses <n>            number of CAN busses (default: 2)
+  --messages <n>          messages per bus (default: 16)
+  --cycle-ms <ms>         cycle time of the fastest message (default: 10)
+  --compression <level>   zlib level 0-9 of the containers, or none (default: 1)
+  --container-size <n>    uncompressed container size, with K or M suffix (default: 128K)
+  --no-split              end containers between objects instead of splitting objects
+  --error-rate <share>    share of frames written as CAN_ERROR_EXT (default: 0)
+  --seed <n>              random seed (default: 0)";
+
+fn parse_args() -> Result<(String, BlfOptions), String> {
+    let mut args = env::args().skip(1);
+    let mut output_file = None;
+    let mut options = BlfOptions::default();
+
+    while let Some(arg) = args.next() {
+        if arg == "--no-split" {
+            options.split_objects = false;
+            continue;
+        }
+        if !arg.starts_with("--") {
+            if output_file.replace(arg).is_some() {
+                return Err("Only one output file can be given".to_string());
+            }
+            continue;
+        }
+
+        let value = args.next().ok_or_else(|| format!("Missing value of {}", arg))?;
+        let invalid = || format!("Invalid value of {}: {}", arg, value);
+        match arg.as_str() {
+            "--size" => options.target_size = parse_size(&value).ok_or_else(invalid)?,
+            "--busses" => options.busses = value.parse().map_err(|_| invalid())?,
+            "--messages" => options.messages = value.parse().map_err(|_| invalid())?,
+            "--cycle-ms" => options.cycle_time_us = value.parse::<u64>().map_err(|_| invalid())? * 1000,
+            "--compression" => options.compression = match value.as_str() {
+                "none" => None,
+                level => Some(level.parse().ok().filter(|level| *level <= 9).ok_or_else(invalid)?),
+            },
+            "--container-size" => options.container_size = parse_size(&value).ok_or_else(invalid)? as usize,
+            "--error-rate" => options.error_frame_rate = value.parse().map_err(|_| invalid())?,
+            "--seed" => options.seed = value.parse().map_err(|_| invalid())?,
+            _ => return Err(format!("Unknown option {}", arg)),
+        }
+    }
+
+    if options.busses == 0 || options.messages == 0 || options.cycle_time_us == 0 || options.container_size == 0 {
+        return Err("Busses, messages, cycle time and container size must be greater than 0".to_string());
+    }
+    let output_file = output_file.ok_or_else(|| "Missing output file".to_string())?;
+    Ok((output_file, options))
+}
+
+fn main() {
+    let (output_file, options) = parse_args().unwrap_or_else(|error| {
+        eprintln!("{}\n\n{}", error, USAGE);
+        process::exit(2);
+    });
+
+    // DBC files next to the BLF file, named after it: <stem>_bus1.dbc, <stem>_bus2.dbc, ...
+    let output_path = Path::new(&output_file);
+    let stem = output_path.file_stem().unwrap().to_string_lossy();
+    for bus in 0..options.busses {
+        let dbc_file = output_path.with_file_name(format!("{}_bus{}.dbc", stem, bus + 1));
+        fs::write(&dbc_file, synthetic::dbc_source(bus, options.messages)).unwrap_or_else(|error| {
+            eprintln!("Failed to write {}: {}", dbc_file.display(), error);
+            process::exit(1);
+        });
+    }
+
+    let start = Instant::now();
+    let summary = File::create(&output_file)
+        .and_then(|file| synthetic::generate_blf(BufWriter::with_capacity(1 << 20, file), &options))
+        .unwrap_or_else(|error| {
+            eprintln!("Failed to write {}: {}", output_file, error);
+            process::exit(1);
+        });
+    let seconds = start.elapsed().as_secs_f64();
+
+    println!("{}: {} frames in {} containers, {:.1} s of bus traffic",
+        output_file, summary.frames, summary.containers, summary.duration_s);
+    println!("{:.1} MB written ({:.1} MB uncompressed) in {:.1} s, {:.1} MB/s",
+        summary.file_size as f64 / 1e6, summary.uncompressed_size as f64 / 1e6, seconds,
+        summary.file_size as f64 / 1e6 / seconds);
+}
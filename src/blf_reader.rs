@@ -1,11 +1,24 @@
+use std::collections::VecDeque;
 use std::fs::File;
 use std::io::{BufReader, Read, Seek, SeekFrom};
+use std::ops::{Deref, Range};
 use std::path::Path;
+use std::sync::mpsc::{self, Receiver, Sender};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::{Duration, Instant};
 use anyhow::{anyhow, Result};
-use flate2::read::ZlibDecoder;
+use flate2::{Decompress, FlushDecompress, Status};
+use memmap2::Mmap;
+#[cfg(unix)]
+use memmap2::{Advice, UncheckedAdvice};
 
+/// Payload capacity of a CanMessage (classic CAN)
+pub const MAX_DATA_LEN: usize = 8;
+
+/// CAN frame as a fixed size record, the payload is stored inline so reading frames doesn't allocate
 #[allow(dead_code)]
-#[derive(Debug, Clone)]
+#[derive(Debug, Clone, Copy)]
 pub struct CanMessage {
     pub timestamp: f64,
     pub arbitration_id: u32,
@@ -15,12 +28,28 @@ pub struct CanMessage {
     pub is_fd: bool,
     pub is_error_frame: bool,
     pub dlc: u8,
-    pub data: Vec<u8>,
+    /// Payload, only the first data_len bytes are valid, see payload()
+    pub data: [u8; MAX_DATA_LEN],
+    pub data_len: u8,
     pub channel: u8,
     pub bitrate_switch: bool,
     pub error_state_indicator: bool,
 }
 
+impl CanMessage {
+    pub fn payload(&self) -> &[u8] {
+        &self.data[..self.data_len as usize]
+    }
+}
+
+/// Inline copy of a payload, truncated to MAX_DATA_LEN bytes
+fn inline_data(data: &[u8]) -> ([u8; MAX_DATA_LEN], u8) {
+    let len = data.len().min(MAX_DATA_LEN);
+    let mut inline = [0u8; MAX_DATA_LEN];
+    inline[..len].copy_from_slice(&data[..len]);
+    (inline, len as u8)
+}
+
 // Constants - matching Python implementation exactly
 const LOG_CONTAINER: u32 = 10;
 const CAN_MESSAGE: u32 = 1;
@@ -42,80 +71,264 @@ const TIME_TEN_MICS: u32 = 0x00000001;
 const TIME_TEN_MICS_FACTOR: f64 = 1e-5;
 const TIME_ONE_NANS_FACTOR: f64 = 1e-9;
 
+/// Totals of the objects read so far, for the conversion report
+#[derive(Debug, Clone, Default)]
+pub struct ReadStats {
+    pub bytes_read: u64,
+    pub containers: u64,
+    pub frames: u64,
+    /// Inflate time of all containers, summed over the decompression threads
+    pub decompress_time: Duration,
+    /// Time the iterating thread spent reading containers and waiting for their decompression
+    pub wait_time: Duration,
+    pub parse_time: Duration,
+}
+
+// Upper bound of the preallocated decompression buffer, the size comes from the file
+const MAX_PREALLOCATED_SIZE: usize = 64 << 20;
+
+// Mapped pages are released in steps of this size once the reader is two steps past them
+const RELEASE_SIZE: usize = 8 << 20;
+
+/// Where the objects of the file are read from
+enum Source<R: Read + Seek> {
+    Stream(BufReader<R>),
+    /// Memory mapped file, `pos` is the offset of the next object and the pages before `released`
+    /// were dropped from the process
+    Mapped { map: Arc<Mmap>, pos: usize, released: usize },
+}
+
+/// Object data that was read into memory, or a range of the mapped file
+enum Buffer {
+    Owned(Vec<u8>),
+    Mapped(Arc<Mmap>),
+}
+
+/// Data of an object or container. Mapped data can be handed to the decompression threads
+/// and parsed without copying it out of the file.
+struct ObjectData {
+    buffer: Buffer,
+    range: Range<usize>,
+}
+
+impl ObjectData {
+    fn owned(data: Vec<u8>) -> Self {
+        let range = 0..data.len();
+        Self { buffer: Buffer::Owned(data), range }
+    }
+
+    /// The data without its first `count` bytes
+    fn skip(mut self, count: usize) -> Self {
+        self.range.start = (self.range.start + count).min(self.range.end);
+        self
+    }
+
+    /// The allocation of data read into memory, so it can be reused. None for mapped data.
+    fn into_buffer(self) -> Option<Vec<u8>> {
+        match self.buffer {
+            Buffer::Owned(data) => Some(data),
+            Buffer::Mapped(_) => None,
+        }
+    }
+}
+
+impl Deref for ObjectData {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        match &self.buffer {
+            Buffer::Owned(data) => &data[self.range.clone()],
+            Buffer::Mapped(map) => &map[self.range.clone()],
+        }
+    }
+}
+
 pub struct BlfReader<R: Read + Seek> {
-    reader: BufReader<R>,
+    source: Source<R>,
     start_timestamp: f64,
+    uncompressed_size: u64,
     tail: Vec<u8>,
-    pos: usize,
+    stats: ReadStats,
+    decompression_threads: usize,
 }
 
 impl BlfReader<File> {
+    /// Open a BLF file. The file is memory mapped, its objects are read in place and
+    /// compressed containers are inflated straight from the map.
     pub fn new<P: AsRef<Path>>(path: P) -> Result<Self> {
         let file = File::open(path)?;
-        Self::from_reader(file)
+        // Safety: the map is only read. As for any mapped file, it must not be truncated while it is converted.
+        let map = unsafe { Mmap::map(&file)? };
+        #[cfg(unix)]
+        let _ = map.advise(Advice::Sequential);
+
+        let header_size = header_size(map.get(..8).ok_or_else(|| anyhow!("Truncated file header"))?)?;
+        let map = Arc::new(map);
+        let full_header = map.get(..header_size).ok_or_else(|| anyhow!("Truncated file header"))?;
+
+        let source = Source::Mapped { map: Arc::clone(&map), pos: header_size, released: 0 };
+        Ok(Self::with_source(source, full_header))
     }
 }
 
 impl<R: Read + Seek> BlfReader<R> {
     pub fn from_reader(reader: R) -> Result<Self> {
         let mut buf_reader = BufReader::new(reader);
-        
+
         // Read file header - first part to get header size
         let mut header_start = [0u8; 8];
         buf_reader.read_exact(&mut header_start)?;
-        
-        // Check signature
-        if &header_start[0..4] != b"LOGG" {
-            return Err(anyhow!("Unexpected file format"));
-        }
-        
-        let header_size = u32::from_le_bytes([header_start[4], header_start[5], header_start[6], header_start[7]]);
-        
+        let header_size = header_size(&header_start)?;
+
         // Read the full header
-        let mut full_header = vec![0u8; header_size as usize];
+        let mut full_header = vec![0u8; header_size];
         buf_reader.seek(SeekFrom::Start(0))?;
         buf_reader.read_exact(&mut full_header)?;
-        
+
+        Ok(Self::with_source(Source::Stream(buf_reader), &full_header))
+    }
+
+    fn with_source(source: Source<R>, full_header: &[u8]) -> Self {
         // Extract start timestamp from header (at offset 56 for SYSTEMTIME)
         let start_timestamp = if full_header.len() >= 72 {
             systemtime_to_timestamp(&full_header[56..72])
         } else {
             0.0
         };
-                
-        Ok(BlfReader {
-            reader: buf_reader,
+        let uncompressed_size = match full_header.get(24..32) {
+            Some(size) => u64::from_le_bytes(size.try_into().unwrap()),
+            None => 0,
+        };
+
+        BlfReader {
+            source,
             start_timestamp,
+            uncompressed_size,
             tail: Vec::new(),
-            pos: 0,
-        })
+            stats: ReadStats { bytes_read: full_header.len() as u64, ..Default::default() },
+            decompression_threads: thread::available_parallelism().map_or(1, |threads| threads.get()),
+        }
+    }
+
+    /// Number of threads inflating containers ahead of parsing (default: available parallelism).
+    /// With 1 the containers are inflated on the iterating thread.
+    pub fn set_decompression_threads(&mut self, threads: usize) {
+        self.decompression_threads = threads.max(1);
     }
     
     pub fn messages(&mut self) -> MessageIterator<'_, R> {
         MessageIterator::new(self)
     }
-    
-    fn parse_container_data(&mut self, data: &[u8]) -> Result<Vec<CanMessage>> {
-        // Combine with tail from previous container
-        let full_data = if !self.tail.is_empty() {
-            let mut combined = self.tail.clone();
-            combined.extend_from_slice(data);
-            self.tail.clear(); // Clear the tail after using it
-            combined
-        } else {
-            data.to_vec()
-        };
-        
+
+    pub fn stats(&self) -> &ReadStats {
+        &self.stats
+    }
+
+    /// Size of the file with all containers inflated, from the file header. 0 if the logger didn't fill it in.
+    pub fn uncompressed_size(&self) -> u64 {
+        self.uncompressed_size
+    }
+
+    /// Read the next object: its type and the data after the 16 byte base header. None at the end of the file.
+    fn read_object(&mut self) -> Result<Option<(u32, ObjectData)>> {
+        match &mut self.source {
+            Source::Stream(reader) => {
+                // Read object header base (16 bytes) - OBJ_HEADER_BASE_STRUCT
+                let mut obj_header_data = [0u8; 16];
+                match reader.read_exact(&mut obj_header_data) {
+                    Ok(_) => {},
+                    Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => {
+                        return Ok(None);
+                    },
+                    Err(e) => return Err(e.into()),
+                }
+                let (obj_size, obj_type) = parse_object_header(&obj_header_data)?;
+
+                // Read the object data (size - 16 bytes we already read)
+                let mut obj_data = vec![0u8; obj_size - 16];
+                reader.read_exact(&mut obj_data)?;
+
+                // Read padding bytes
+                let padding = obj_size % 4;
+                if padding > 0 {
+                    let mut pad_buf = [0u8; 3];
+                    reader.read_exact(&mut pad_buf[..padding])?;
+                }
+                self.stats.bytes_read += (obj_size + padding) as u64;
+                Ok(Some((obj_type, ObjectData::owned(obj_data))))
+            },
+            Source::Mapped { map, pos, released } => {
+                let Some(obj_header_data) = map.get(*pos..*pos + 16) else {
+                    return Ok(None);
+                };
+                let (obj_size, obj_type) = parse_object_header(obj_header_data)?;
+
+                // The object is followed by its padding bytes
+                let end = *pos + obj_size + obj_size % 4;
+                if end > map.len() {
+                    return Err(anyhow!("Object at offset {} exceeds the end of the file", *pos));
+                }
+                let range = *pos + 16..*pos + obj_size;
+                self.stats.bytes_read += (end - *pos) as u64;
+                *pos = end;
+
+                release_pages(map, released, end);
+                Ok(Some((obj_type, ObjectData { buffer: Buffer::Mapped(Arc::clone(map)), range })))
+            },
+        }
+    }
+
+    /// Parse the (decompressed) data of one LOG_CONTAINER into CAN messages.
+    /// Objects that continue in the next container are kept as tail and completed by the next call.
+    pub fn parse_container_data(&mut self, data: &[u8]) -> Result<Vec<CanMessage>> {
         let mut messages = Vec::new();
+        self.parse_container_data_into(data, &mut messages)?;
+        Ok(messages)
+    }
+
+    /// Like parse_container_data, but appends the messages to `messages` so its allocation can be reused
+    pub fn parse_container_data_into(&mut self, data: &[u8], messages: &mut Vec<CanMessage>) -> Result<()> {
+        // Complete the object that continues from the previous containers by copying only its missing
+        // bytes to the tail, the rest of the container is parsed in place
+        let mut data_start = 0;
+        let mut previous = self.tail.len(); // Bytes of the tail from the previous containers
+        while previous > 0 {
+            let missing = stitch_length(&self.tail).saturating_sub(self.tail.len()).max(1);
+            let count = missing.min(data.len() - data_start);
+            if count == 0 {
+                return Ok(()); // Object continues in the next container
+            }
+            self.tail.extend_from_slice(&data[data_start..data_start + count]);
+            data_start += count;
+
+            let end = self.parse_objects(&self.tail, messages);
+            if end >= previous {
+                // Parsing got past the container boundary, continue in the container
+                data_start = end - previous;
+                self.tail.clear();
+                previous = 0;
+            } else {
+                self.tail.drain(..end);
+                previous -= end;
+            }
+        }
+
+        // Keep the incomplete object at the end for the next container
+        let end = data_start + self.parse_objects(&data[data_start..], messages);
+        self.tail.extend_from_slice(&data[end..]);
+        Ok(())
+    }
+
+    /// Parse the complete objects at the start of `data`. Returns the position parsing stopped at,
+    /// the start of an object that continues in the next container.
+    fn parse_objects(&self, data: &[u8], messages: &mut Vec<CanMessage>) -> usize {
         let mut pos = 0;
-        let max_pos = full_data.len();
-        
+        let max_pos = data.len();
+
         // Parse objects within the container - this follows Python's _parse_data method
         while pos + 16 <= max_pos {
-            self.pos = pos;
-            
             // Find next LOBJ signature
-            let lobj_pos = match find_pattern(&full_data[pos..std::cmp::min(pos + 8, max_pos)], b"LOBJ") {
+            let lobj_pos = match find_pattern(&data[pos..std::cmp::min(pos + 8, max_pos)], b"LOBJ") {
                 Some(offset) => pos + offset,
                 None => {
                     if pos + 8 > max_pos {
@@ -133,16 +346,21 @@ impl<R: Read + Seek> BlfReader<R> {
             }
             
             // Parse object header
-            let signature = &full_data[pos..pos + 4];
+            let signature = &data[pos..pos + 4];
             if signature != b"LOBJ" {
                 pos += 1;
                 continue;
             }
             
-            let header_version = u16::from_le_bytes([full_data[pos + 6], full_data[pos + 7]]);
-            let obj_size = u32::from_le_bytes([full_data[pos + 8], full_data[pos + 9], full_data[pos + 10], full_data[pos + 11]]);
-            let obj_type = u32::from_le_bytes([full_data[pos + 12], full_data[pos + 13], full_data[pos + 14], full_data[pos + 15]]);
+            let header_version = u16::from_le_bytes([data[pos + 6], data[pos + 7]]);
+            let obj_size = u32::from_le_bytes([data[pos + 8], data[pos + 9], data[pos + 10], data[pos + 11]]);
+            let obj_type = u32::from_le_bytes([data[pos + 12], data[pos + 13], data[pos + 14], data[pos + 15]]);
             
+            if (obj_size as usize) < 16 {
+                pos += 1; // Invalid object size
+                continue;
+            }
+
             let next_pos = pos + obj_size as usize;
             if next_pos > max_pos {
                 break; // Object continues in next container
@@ -153,11 +371,11 @@ impl<R: Read + Seek> BlfReader<R> {
             // Parse extended header based on version
             let timestamp = match header_version {
                 1 => {
-                    if pos + 16 > max_pos { break; }
-                    let flags = u32::from_le_bytes([full_data[pos], full_data[pos + 1], full_data[pos + 2], full_data[pos + 3]]);
+                    if pos + 16 > next_pos { pos = next_pos; continue; }
+                    let flags = u32::from_le_bytes([data[pos], data[pos + 1], data[pos + 2], data[pos + 3]]);
                     let ts = u64::from_le_bytes([
-                        full_data[pos + 8], full_data[pos + 9], full_data[pos + 10], full_data[pos + 11],
-                        full_data[pos + 12], full_data[pos + 13], full_data[pos + 14], full_data[pos + 15]
+                        data[pos + 8], data[pos + 9], data[pos + 10], data[pos + 11],
+                        data[pos + 12], data[pos + 13], data[pos + 14], data[pos + 15]
                     ]);
                     pos += 16;
                     
@@ -165,11 +383,11 @@ impl<R: Read + Seek> BlfReader<R> {
                     (ts as f64 * factor) + self.start_timestamp
                 },
                 2 => {
-                    if pos + 16 > max_pos { break; }
-                    let flags = u32::from_le_bytes([full_data[pos], full_data[pos + 1], full_data[pos + 2], full_data[pos + 3]]);
+                    if pos + 16 > next_pos { pos = next_pos; continue; }
+                    let flags = u32::from_le_bytes([data[pos], data[pos + 1], data[pos + 2], data[pos + 3]]);
                     let ts = u64::from_le_bytes([
-                        full_data[pos + 8], full_data[pos + 9], full_data[pos + 10], full_data[pos + 11],
-                        full_data[pos + 12], full_data[pos + 13], full_data[pos + 14], full_data[pos + 15]
+                        data[pos + 8], data[pos + 9], data[pos + 10], data[pos + 11],
+                        data[pos + 12], data[pos + 13], data[pos + 14], data[pos + 15]
                     ]);
                     pos += 16;
                     
@@ -183,22 +401,14 @@ impl<R: Read + Seek> BlfReader<R> {
             };
             
             // Parse message data based on type
-            if let Ok(Some(msg)) = self.parse_message_by_type(obj_type, &full_data[pos..next_pos], timestamp) {
+            if let Ok(Some(msg)) = self.parse_message_by_type(obj_type, &data[pos..next_pos], timestamp) {
                 messages.push(msg);
             }
             
             pos = next_pos;
         }
         
-        // Save remaining data for next container - be more precise about what to save
-        let remaining_data = &full_data[self.pos..];
-        if remaining_data.len() > 0 {
-            self.tail = remaining_data.to_vec();
-        } else {
-            self.tail.clear();
-        }
-
-        Ok(messages)
+        pos
     }
     
     fn parse_message_by_type(&self, obj_type: u32, data: &[u8], timestamp: f64) -> Result<Option<CanMessage>> {
@@ -218,7 +428,7 @@ impl<R: Read + Seek> BlfReader<R> {
                 // Python takes data[:dlc] from the 8-byte data field
                 let data_start = 8;
                 let data_end = std::cmp::min(data_start + dlc as usize, std::cmp::min(data_start + 8, data.len()));
-                let msg_data = data[data_start..data_end].to_vec();
+                let (msg_data, data_len) = inline_data(&data[data_start..data_end]);
                 
                 Ok(Some(CanMessage {
                     timestamp,
@@ -230,6 +440,7 @@ impl<R: Read + Seek> BlfReader<R> {
                     is_error_frame: false,
                     dlc,
                     data: msg_data,
+                    data_len,
                     channel: if channel > 0 { (channel - 1) as u8 } else { 0 }, // Python: channel - 1
                     bitrate_switch: false,
                     error_state_indicator: false,
@@ -250,10 +461,10 @@ impl<R: Read + Seek> BlfReader<R> {
                 // Data field starts after all the fixed fields
                 let data_start = 26; // Adjust based on actual struct layout
                 let data_end = std::cmp::min(data_start + dlc as usize, data.len());
-                let msg_data = if data_start < data.len() {
-                    data[data_start..data_end].to_vec()
+                let (msg_data, data_len) = if data_start < data.len() {
+                    inline_data(&data[data_start..data_end])
                 } else {
-                    Vec::new()
+                    ([0u8; MAX_DATA_LEN], 0)
                 };
                 
                 Ok(Some(CanMessage {
@@ -266,6 +477,7 @@ impl<R: Read + Seek> BlfReader<R> {
                     is_error_frame: true,
                     dlc,
                     data: msg_data,
+                    data_len,
                     channel: if channel > 0 { (channel - 1) as u8 } else { 0 },
                     bitrate_switch: false,
                     error_state_indicator: false,
@@ -277,96 +489,219 @@ impl<R: Read + Seek> BlfReader<R> {
     }
 }
 
+type InflateResult = Option<(Vec<u8>, Duration)>;
+
+/// Container data in file order: inflated, being inflated, or the error that ended reading
+enum PendingContainer {
+    Ready(ObjectData),
+    Inflating(Receiver<InflateResult>),
+    Failed(anyhow::Error),
+}
+
+/// zlib data of a LOG_CONTAINER and the buffer to inflate it into
+struct InflateJob {
+    data: ObjectData,
+    uncompressed_size: usize,
+    output: Vec<u8>,
+    result: Sender<InflateResult>,
+}
+
+/// Threads inflating containers, every job sends its result on its own channel so the
+/// iterator receives them in container order
+struct InflatePool {
+    jobs: Option<Sender<InflateJob>>,
+    workers: Vec<JoinHandle<()>>,
+}
+
+impl InflatePool {
+    fn new(threads: usize) -> Self {
+        let (jobs, job_receiver) = mpsc::channel::<InflateJob>();
+        let job_receiver = Arc::new(Mutex::new(job_receiver));
+        let workers = (0..threads)
+            .map(|_| {
+                let job_receiver = Arc::clone(&job_receiver);
+                thread::spawn(move || {
+                    let mut decompress = Decompress::new(true);
+                    loop {
+                        let mut job = match job_receiver.lock().unwrap().recv() {
+                            Ok(job) => job,
+                            Err(_) => break, // Pool dropped
+                        };
+                        let start = Instant::now();
+                        let inflated = inflate(&mut decompress, &job.data, job.uncompressed_size, &mut job.output);
+                        let _ = job.result.send(inflated.then(|| (job.output, start.elapsed())));
+                    }
+                })
+            })
+            .collect();
+        Self { jobs: Some(jobs), workers }
+    }
+
+    fn submit(&self, data: ObjectData, uncompressed_size: usize, output: Vec<u8>) -> Receiver<InflateResult> {
+        let (result, receiver) = mpsc::channel();
+        let job = InflateJob { data, uncompressed_size, output, result };
+        // The workers only stop when the pool is dropped, if one panicked the receiver reports it
+        if let Some(jobs) = &self.jobs {
+            let _ = jobs.send(job);
+        }
+        receiver
+    }
+}
+
+impl Drop for InflatePool {
+    fn drop(&mut self) {
+        drop(self.jobs.take());
+        for worker in self.workers.drain(..) {
+            let _ = worker.join();
+        }
+    }
+}
+
+/// Inflate zlib data into `output`, reusing the decompressor and the allocation of the output.
+/// False for corrupt data, a truncated stream keeps what could be inflated.
+fn inflate(decompress: &mut Decompress, data: &[u8], uncompressed_size: usize, output: &mut Vec<u8>) -> bool {
+    decompress.reset(true);
+    output.clear();
+    output.reserve(uncompressed_size.min(MAX_PREALLOCATED_SIZE));
+    loop {
+        let input = &data[decompress.total_in() as usize..];
+        match decompress.decompress_vec(input, output, FlushDecompress::Finish) {
+            Ok(Status::StreamEnd) => return true,
+            // Out of input with room left in the output
+            Ok(_) if output.len() < output.capacity() => return true,
+            // The size from the container header was too small
+            Ok(_) => output.reserve(output.capacity().max(1 << 16)),
+            Err(_) => return false,
+        }
+    }
+}
+
+/// Iterates over the CAN messages of all containers. Containers are read ahead and inflated by
+/// the decompression threads, parsing (and the stitching of objects across containers) stays in
+/// container order on the iterating thread.
 pub struct MessageIterator<'a, R: Read + Seek> {
     reader: &'a mut BlfReader<R>,
     current_container_messages: Vec<CanMessage>,
     current_message_index: usize,
     finished: bool,
+    pending: VecDeque<PendingContainer>,
+    pool: Option<InflatePool>,
+    max_pending: usize,
+    /// Decompressor of the iterating thread, used without decompression threads
+    decompress: Decompress,
+    /// Buffers of parsed containers, the next containers are inflated into them
+    spare_buffers: Vec<Vec<u8>>,
 }
 
 impl<'a, R: Read + Seek> MessageIterator<'a, R> {
     fn new(reader: &'a mut BlfReader<R>) -> Self {
+        let threads = reader.decompression_threads;
         Self {
             reader,
             current_container_messages: Vec::new(),
             current_message_index: 0,
             finished: false,
+            pending: VecDeque::new(),
+            pool: (threads > 1).then(|| InflatePool::new(threads)),
+            // Enough containers in flight to keep every thread busy while the oldest one is parsed
+            max_pending: if threads > 1 { 2 * threads } else { 1 },
+            decompress: Decompress::new(true),
+            spare_buffers: Vec::new(),
         }
     }
     
-    fn read_next_container(&mut self) -> Result<bool> {
-        if self.finished {
-            return Ok(false);
-        }
-        
+    /// Read the next LOG_CONTAINER, skipping other objects. None at the end of the file.
+    fn read_raw_container(&mut self) -> Result<Option<PendingContainer>> {
         loop {
-            // Read object header base (16 bytes) - OBJ_HEADER_BASE_STRUCT
-            let mut obj_header_data = [0u8; 16];
-            match self.reader.reader.read_exact(&mut obj_header_data) {
-                Ok(_) => {},
-                Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => {
-                    self.finished = true;
-                    return Ok(false);
-                },
-                Err(e) => return Err(e.into()),
+            let Some((obj_type, obj_data)) = self.reader.read_object()? else {
+                return Ok(None);
+            };
+
+            // Only process LOG_CONTAINER objects
+            if obj_type != LOG_CONTAINER || obj_data.len() < 16 {
+                continue;
             }
-            
-            // Parse object header base
-            let signature = &obj_header_data[0..4];
-            if signature != b"LOBJ" {
-                return Err(anyhow!("Invalid object signature: {:?}", signature));
+
+            // Parse LOG_CONTAINER_STRUCT, the container data follows the 16-byte LOG_CONTAINER header
+            let compression_method = u16::from_le_bytes([obj_data[0], obj_data[1]]);
+            let uncompressed_size = u32::from_le_bytes([obj_data[8], obj_data[9], obj_data[10], obj_data[11]]) as usize;
+            let container_data = obj_data.skip(16);
+
+            // Decompress based on method
+            match compression_method {
+                NO_COMPRESSION => return Ok(Some(PendingContainer::Ready(container_data))),
+                ZLIB_DEFLATE => {
+                    let mut output = self.spare_buffers.pop().unwrap_or_default();
+                    if let Some(pool) = &self.pool {
+                        return Ok(Some(PendingContainer::Inflating(pool.submit(container_data, uncompressed_size, output))));
+                    }
+                    let start = Instant::now();
+                    let inflated = inflate(&mut self.decompress, &container_data, uncompressed_size, &mut output);
+                    self.reader.stats.decompress_time += start.elapsed();
+                    if inflated {
+                        return Ok(Some(PendingContainer::Ready(ObjectData::owned(output))));
+                    }
+                    self.spare_buffers.push(output);
+                },
+                _ => continue,
             }
-            
-            let obj_size = u32::from_le_bytes([obj_header_data[8], obj_header_data[9], obj_header_data[10], obj_header_data[11]]);
-            let obj_type = u32::from_le_bytes([obj_header_data[12], obj_header_data[13], obj_header_data[14], obj_header_data[15]]);
-                        
-            // Read the object data (size - 16 bytes we already read)
-            let obj_data_size = obj_size - 16;
-            let mut obj_data = vec![0u8; obj_data_size as usize];
-            self.reader.reader.read_exact(&mut obj_data)?;
-            
-            // Read padding bytes
-            let padding = obj_size % 4;
-            if padding > 0 {
-                let mut pad_buf = vec![0u8; padding as usize];
-                self.reader.reader.read_exact(&mut pad_buf)?;
+        }
+    }
+
+    /// Read containers until enough are in flight or the file ends
+    fn fill_pending(&mut self) {
+        while !self.finished && self.pending.len() < self.max_pending {
+            match self.read_raw_container() {
+                Ok(Some(container)) => self.pending.push_back(container),
+                Ok(None) => self.finished = true,
+                Err(e) => {
+                    // Reported after the containers before it are parsed
+                    self.pending.push_back(PendingContainer::Failed(e));
+                    self.finished = true;
+                },
             }
-            
-            // Only process LOG_CONTAINER objects
-            if obj_type == LOG_CONTAINER {
-                // Parse LOG_CONTAINER_STRUCT
-                if obj_data.len() < 16 {
-                    continue;
-                }
-                
-                let compression_method = u16::from_le_bytes([obj_data[0], obj_data[1]]);
-                                
-                // Get container data (skip the 16-byte LOG_CONTAINER header)
-                let container_data = &obj_data[16..];
-                
-                // Decompress based on method
-                let decompressed_data = match compression_method {
-                    NO_COMPRESSION => {
-                        container_data.to_vec()
-                    },
-                    ZLIB_DEFLATE => {
-                        let mut decoder = ZlibDecoder::new(container_data);
-                        let mut decompressed = Vec::new();
-                        match decoder.read_to_end(&mut decompressed) {
-                            Ok(_) => decompressed,
-                            Err(_) => continue,
-                        }
+        }
+    }
+
+    fn read_next_container(&mut self) -> Result<bool> {
+        loop {
+            let wait_start = Instant::now();
+            self.fill_pending();
+            let decompressed_data = match self.pending.pop_front() {
+                None => return Ok(false),
+                Some(PendingContainer::Ready(data)) => Some(data),
+                Some(PendingContainer::Inflating(receiver)) => match receiver.recv() {
+                    Ok(Some((data, inflate_time))) => {
+                        self.reader.stats.decompress_time += inflate_time;
+                        Some(ObjectData::owned(data))
                     },
-                    _ => continue,
-                };
+                    // Corrupt zlib data, the container is skipped
+                    Ok(None) => None,
+                    Err(_) => return Err(anyhow!("Decompression thread failed")),
+                },
+                Some(PendingContainer::Failed(e)) => return Err(e),
+            };
+            self.reader.stats.wait_time += wait_start.elapsed();
+
+            let Some(decompressed_data) = decompressed_data else {
+                continue;
+            };
+            self.reader.stats.containers += 1;
                 
-                // Parse the decompressed container data
-                let messages = self.reader.parse_container_data(&decompressed_data)?;
-                if !messages.is_empty() {
-                    self.current_container_messages = messages;
-                    self.current_message_index = 0;
-                    return Ok(true);
-                }
+            // Parse the decompressed container data, reusing the message buffer of the last container
+            let parse_start = Instant::now();
+            self.current_container_messages.clear();
+            self.current_message_index = 0;
+            self.reader.parse_container_data_into(&decompressed_data, &mut self.current_container_messages)?;
+            self.reader.stats.parse_time += parse_start.elapsed();
+            self.reader.stats.frames += self.current_container_messages.len() as u64;
+
+            // One spare buffer for every container in flight and the one being inflated inline
+            if self.spare_buffers.len() <= self.max_pending {
+                self.spare_buffers.extend(decompressed_data.into_buffer());
+            }
+            if !self.current_container_messages.is_empty() {
+                return Ok(true);
             }
         }
     }
@@ -378,7 +713,7 @@ impl<'a, R: Read + Seek> Iterator for MessageIterator<'a, R> {
     fn next(&mut self) -> Option<Self::Item> {
         // If we have messages from current container, return the next one
         if self.current_message_index < self.current_container_messages.len() {
-            let message = self.current_container_messages[self.current_message_index].clone();
+            let message = self.current_container_messages[self.current_message_index];
             self.current_message_index += 1;
             return Some(Ok(message));
         }
@@ -388,7 +723,7 @@ impl<'a, R: Read + Seek> Iterator for MessageIterator<'a, R> {
             Ok(true) => {
                 // Successfully read a new container with messages
                 if self.current_message_index < self.current_container_messages.len() {
-                    let message = self.current_container_messages[self.current_message_index].clone();
+                    let message = self.current_container_messages[self.current_message_index];
                     self.current_message_index += 1;
                     Some(Ok(message))
                 } else {
@@ -413,6 +748,59 @@ impl<'a, R: Read + Seek> MessageIterator<'a, R> {
     }
 }
 
+/// Length the tail needs for parse_objects to get past its first object
+fn stitch_length(tail: &[u8]) -> usize {
+    if tail.len() < 16 {
+        return 16;
+    }
+    match find_pattern(&tail[..8], b"LOBJ") {
+        Some(offset) if tail.len() >= offset + 16 => {
+            let obj_size = u32::from_le_bytes([tail[offset + 8], tail[offset + 9], tail[offset + 10], tail[offset + 11]]);
+            offset + (obj_size as usize).max(16)
+        },
+        Some(offset) => offset + 16,
+        None => tail.len() + 1,
+    }
+}
+
+/// Size of the file header from the first 8 bytes of the file
+fn header_size(header_start: &[u8]) -> Result<usize> {
+    // Check signature
+    if &header_start[0..4] != b"LOGG" {
+        return Err(anyhow!("Unexpected file format"));
+    }
+    Ok(u32::from_le_bytes([header_start[4], header_start[5], header_start[6], header_start[7]]) as usize)
+}
+
+/// Size and type of an object from its base header (OBJ_HEADER_BASE_STRUCT)
+fn parse_object_header(obj_header_data: &[u8]) -> Result<(usize, u32)> {
+    let signature = &obj_header_data[0..4];
+    if signature != b"LOBJ" {
+        return Err(anyhow!("Invalid object signature: {:?}", signature));
+    }
+
+    let obj_size = u32::from_le_bytes([obj_header_data[8], obj_header_data[9], obj_header_data[10], obj_header_data[11]]) as usize;
+    let obj_type = u32::from_le_bytes([obj_header_data[12], obj_header_data[13], obj_header_data[14], obj_header_data[15]]);
+    if obj_size < 16 {
+        return Err(anyhow!("Invalid object size: {}", obj_size));
+    }
+    Ok((obj_size, obj_type))
+}
+
+/// Drop the mapped pages well behind the read position from the process, so converting a large
+/// file doesn't add the whole file to its RSS. Released pages are read from the file again if needed.
+#[cfg(unix)]
+fn release_pages(map: &Mmap, released: &mut usize, pos: usize) {
+    while pos - *released >= 2 * RELEASE_SIZE {
+        // Safety: the map is read only, so dropping its pages doesn't change the data
+        let _ = unsafe { map.unchecked_advise_range(UncheckedAdvice::DontNeed, *released, RELEASE_SIZE) };
+        *released += RELEASE_SIZE;
+    }
+}
+
+#[cfg(not(unix))]
+fn release_pages(_map: &Mmap, _released: &mut usize, _pos: usize) {}
+
 fn find_pattern(data: &[u8], pattern: &[u8]) -> Option<usize> {
     data.windows(pattern.len()).position(|window| window == pattern)
 }
@@ -443,3 +831,52 @@ fn systemtime_to_timestamp(data: &[u8]) -> f64 {
     
     timestamp
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::Cursor;
+    use crate::synthetic::{self, BlfWriter};
+
+    /// BLF file with `frames` frames of all object types, every frame with its own id and payload
+    fn blf_file(frames: u32, compression: Option<u32>, container_size: usize, split_objects: bool) -> Vec<u8> {
+        let mut file = Cursor::new(Vec::new());
+        let mut blf_writer = BlfWriter::new(&mut file, compression, container_size, split_objects).unwrap();
+        for frame_idx in 0..frames {
+            let object_type = [synthetic::CAN_MESSAGE, synthetic::CAN_MESSAGE2, synthetic::CAN_ERROR_EXT][frame_idx as usize % 3];
+            let data = (frame_idx as u64).to_le_bytes();
+            blf_writer.write_can_object(object_type, frame_idx as u64 * 1000, 1 + (frame_idx % 2) as u16, frame_idx, &data).unwrap();
+        }
+        blf_writer.finish().unwrap();
+        file.into_inner()
+    }
+
+    #[test]
+    fn split_objects_are_read_once() {
+        // Containers smaller than an object split it over up to 9 containers
+        let frames = 200;
+        for compression in [None, Some(1)] {
+            for container_size in [7, 16, 30, 48, 61, 100, 1000, 1 << 16] {
+                for threads in [1, 3] {
+                    let blf = blf_file(frames, compression, container_size, true);
+                    let mut reader = BlfReader::from_reader(Cursor::new(blf)).unwrap();
+                    reader.set_decompression_threads(threads);
+                    let messages = reader.messages().collect().unwrap();
+
+                    // Only the id and payload of CAN messages are compared, every third frame is an error frame
+                    let read: Vec<(bool, u8, Option<(u32, u64)>)> = messages
+                        .iter()
+                        .map(|msg| {
+                            let frame = (!msg.is_error_frame).then(|| (msg.arbitration_id, u64::from_le_bytes(msg.data)));
+                            (msg.is_error_frame, msg.channel, frame)
+                        })
+                        .collect();
+                    let written: Vec<(bool, u8, Option<(u32, u64)>)> = (0..frames)
+                        .map(|idx| (idx % 3 == 2, (idx % 2) as u8, (idx % 3 != 2).then_some((idx, idx as u64))))
+                        .collect();
+                    assert_eq!(read, written, "compression {:?}, container size {}, {} threads", compression, container_size, threads);
+                }
+            }
+        }
+    }
+}
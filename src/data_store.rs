@@ -1,193 +1,463 @@
+use std::cmp::Ordering;
 use std::collections::HashMap;
-use std::any::Any;
 use std::io::{BufWriter, Write};
 
+/// Dense index of a signal in the data store, see DataStore::register
+pub type SignalId = u32;
+
+/// CAN message a signal is decoded from
+#[derive(Debug, Clone, PartialEq, Eq, PartialOrd, Ord, Hash)]
+pub struct SignalSource {
+    pub bus: u8,
+    pub message_id: u32,
+    pub message_name: String,
+}
+
+/// Value column of a signal, the type is set by the first push
 #[derive(Debug, Clone)]
-pub struct DataPoint<T> {
-    pub timestamp: f64,
-    pub value: T,
+enum Values {
+    Empty,
+    Int(Vec<i64>),
+    UInt(Vec<u64>),
+    Float(Vec<f64>),
+    String(Vec<String>),
 }
 
-impl<T> DataPoint<T> {
-    pub fn new(timestamp: f64, value: T) -> Self {
-        Self { timestamp, value }
-    }
+/// One signal: its metadata and the timestamp and value columns
+#[derive(Debug, Clone)]
+struct Column {
+    name: String,
+    unit: String,
+    source: Option<SignalSource>,
+    value_table: Option<HashMap<i64, String>>,
+    timestamps: Vec<f64>,
+    values: Values,
+    /// Start of every run appended by merge after the first, each run is in the order it was decoded
+    run_starts: Vec<usize>,
+    /// Index of the frame of every value, only recorded for signals registered with track_frame_order
+    frame_indices: Option<Vec<u64>>,
 }
 
-#[derive(Debug)]
+/// Signals of one source message that share the same timestamps
+struct SignalGroup<'a> {
+    source: Option<&'a SignalSource>,
+    timestamps: &'a [f64],
+    columns: Vec<&'a Column>,
+}
+
+/// Decoded signals, stored as typed columns indexed by SignalId.
+/// Signals are registered by source message and name once before decoding, the pushes of the decode loop
+/// only index the columns.
+#[derive(Debug, Clone)]
 pub struct DataStore {
-    data: HashMap<String, Box<dyn Any>>,
-    units: HashMap<String, String>,
-    value_tables: HashMap<String, HashMap<i64, String>>
+    columns: Vec<Column>,
+    ids: HashMap<(Option<SignalSource>, String), SignalId>,
+    sorted: bool,
+    frame_index: u64,
 }
 
 impl DataStore {
     pub fn new() -> Self {
         Self {
-            data: HashMap::new(),
-            units: HashMap::new(),
-            value_tables: HashMap::new()
+            columns: Vec::new(),
+            ids: HashMap::new(),
+            sorted: true,
+            frame_index: 0,
         }
     }
-    
-    pub fn set_unit(&mut self, signal_name: &String, unit: &String) {
-        self.units.insert(signal_name.clone(), unit.clone());
+
+    /// Id of the signal of a source message, registering it if it isn't known yet.
+    /// A signal name used by several messages gets a column per message, written in the group of that message.
+    pub fn register(&mut self, signal_name: &str, source: Option<&SignalSource>) -> SignalId {
+        let key = (source.cloned(), signal_name.to_string());
+        if let Some(id) = self.ids.get(&key) {
+            return *id;
+        }
+        let id = self.columns.len() as SignalId;
+        self.columns.push(Column {
+            name: signal_name.to_string(),
+            unit: String::new(),
+            source: source.cloned(),
+            value_table: None,
+            timestamps: Vec::new(),
+            values: Values::Empty,
+            run_starts: Vec::new(),
+            frame_indices: None,
+        });
+        self.ids.insert(key, id);
+        id
     }
 
-    pub fn set_value_table(&mut self, signal_name: &String, value_table: HashMap<i64, String>) {
-        self.value_tables.insert(signal_name.clone(), value_table);
+    pub fn signal_id(&self, signal_name: &str, source: Option<&SignalSource>) -> Option<SignalId> {
+        self.ids.get(&(source.cloned(), signal_name.to_string())).copied()
     }
 
-    pub fn push<T: 'static>(&mut self, key: &str, timestamp: f64, value: T) {
-        let entry = self.data.entry(key.to_string()).or_insert_with(|| {
-            Box::new(Vec::<DataPoint<T>>::new())
-        });
-        
-        if let Some(vec) = entry.downcast_mut::<Vec<DataPoint<T>>>() {
-            vec.push(DataPoint::new(timestamp, value));
-        } else {
-            panic!("Type mismatch for key: {}", key);
+    pub fn set_unit(&mut self, id: SignalId, unit: &str) {
+        self.columns[id as usize].unit = unit.to_string();
+    }
+
+    pub fn set_value_table(&mut self, id: SignalId, value_table: HashMap<i64, String>) {
+        self.columns[id as usize].value_table = Some(value_table);
+    }
+
+    /// Record the frame index (see set_frame_index) of every value of a signal. Values with equal timestamps
+    /// are sorted by it, so a column fed by messages decoded on different threads keeps the order of the file.
+    pub fn track_frame_order(&mut self, id: SignalId) {
+        let column = &mut self.columns[id as usize];
+        if column.frame_indices.is_none() {
+            column.frame_indices = Some(Vec::with_capacity(column.timestamps.capacity()));
         }
     }
-    
+
+    /// Index in the file of the frame the following values are decoded from
+    pub fn set_frame_index(&mut self, frame_index: u64) {
+        self.frame_index = frame_index;
+    }
+
+    /// Number of signals with values
     pub fn signal_count(&self) -> usize {
-        self.data.len()
+        self.columns.iter().filter(|column| !column.timestamps.is_empty()).count()
+    }
+
+    /// Number of values of all signals
+    pub fn sample_count(&self) -> usize {
+        self.columns.iter().map(|column| column.timestamps.len()).sum()
     }
-    
-    // Convenience methods for common types
-    pub fn push_int(&mut self, key: &str, timestamp: f64, value: i64) {
-        self.push(key, timestamp, value);
+
+    pub fn push_int(&mut self, id: SignalId, timestamp: f64, value: i64) {
+        let column = &mut self.columns[id as usize];
+        match &mut column.values {
+            Values::Int(values) => values.push(value),
+            Values::Empty => column.values = Values::Int(vec![value]),
+            _ => panic!("Type mismatch for signal: {}", column.name),
+        }
+        column.timestamps.push(timestamp);
+        if let Some(frame_indices) = &mut column.frame_indices {
+            frame_indices.push(self.frame_index);
+        }
+        self.sorted = false;
     }
 
-    pub fn push_uint(&mut self, key: &str, timestamp: f64, value: u64) {
-        self.push(key, timestamp, value);
+    pub fn push_uint(&mut self, id: SignalId, timestamp: f64, value: u64) {
+        let column = &mut self.columns[id as usize];
+        match &mut column.values {
+            Values::UInt(values) => values.push(value),
+            Values::Empty => column.values = Values::UInt(vec![value]),
+            _ => panic!("Type mismatch for signal: {}", column.name),
+        }
+        column.timestamps.push(timestamp);
+        if let Some(frame_indices) = &mut column.frame_indices {
+            frame_indices.push(self.frame_index);
+        }
+        self.sorted = false;
     }
-    
-    #[allow(dead_code)]
-    pub fn push_float(&mut self, key: &str, timestamp: f64, value: f64) {
-        self.push(key, timestamp, value);
+
+    pub fn push_float(&mut self, id: SignalId, timestamp: f64, value: f64) {
+        let column = &mut self.columns[id as usize];
+        match &mut column.values {
+            Values::Float(values) => values.push(value),
+            Values::Empty => column.values = Values::Float(vec![value]),
+            _ => panic!("Type mismatch for signal: {}", column.name),
+        }
+        column.timestamps.push(timestamp);
+        if let Some(frame_indices) = &mut column.frame_indices {
+            frame_indices.push(self.frame_index);
+        }
+        self.sorted = false;
     }
 
     #[allow(dead_code)]
-    pub fn push_string(&mut self, key: &str, timestamp: f64, value: String) {
-        self.push(key, timestamp, value);
-    }
-
-    fn sort_by_timestamp(&mut self) {
-        // Sort all vectors by timestamp in ascending order
-        for (_, data) in &mut self.data {
-            if let Some(vec) = data.downcast_mut::<Vec<DataPoint<i64>>>() {
-                vec.sort_by(|a, b| a.timestamp.partial_cmp(&b.timestamp).unwrap_or(std::cmp::Ordering::Equal));
-            } else if let Some(vec) = data.downcast_mut::<Vec<DataPoint<u64>>>() {
-                vec.sort_by(|a, b| a.timestamp.partial_cmp(&b.timestamp).unwrap_or(std::cmp::Ordering::Equal));
-            } else if let Some(vec) = data.downcast_mut::<Vec<DataPoint<f64>>>() {
-                vec.sort_by(|a, b| a.timestamp.partial_cmp(&b.timestamp).unwrap_or(std::cmp::Ordering::Equal));
-            } else if let Some(vec) = data.downcast_mut::<Vec<DataPoint<String>>>() {
-                vec.sort_by(|a, b| a.timestamp.partial_cmp(&b.timestamp).unwrap_or(std::cmp::Ordering::Equal));
-            }
+    pub fn push_string(&mut self, id: SignalId, timestamp: f64, value: String) {
+        let column = &mut self.columns[id as usize];
+        match &mut column.values {
+            Values::String(values) => values.push(value),
+            Values::Empty => column.values = Values::String(vec![value]),
+            _ => panic!("Type mismatch for signal: {}", column.name),
+        }
+        column.timestamps.push(timestamp);
+        if let Some(frame_indices) = &mut column.frame_indices {
+            frame_indices.push(self.frame_index);
         }
+        self.sorted = false;
     }
 
-    pub fn write_to_stream<W: Write>(&mut self, writer: W) -> Result<(), Box<dyn std::error::Error>> {
-        self.sort_by_timestamp();
-        
-        // Use a large buffer for batched writes (1MB buffer)
-        let mut buf_writer = BufWriter::with_capacity(1024 * 1024, writer);
-        
-        // Write magic header to identify binary format
-        buf_writer.write_all(b"BLF2MDF\x03")?; // 8 bytes: magic + version (v3 includes units and value_tables)
-        
-        // Write signal count as 4-byte little-endian
-        buf_writer.write_all(&(self.data.len() as u32).to_le_bytes())?;
-        
-        for (key, data) in &self.data {
-            // Write signal name length and name
-            let key_bytes = key.as_bytes();
-            buf_writer.write_all(&(key_bytes.len() as u16).to_le_bytes())?;
-            buf_writer.write_all(key_bytes)?;
-            
-            // Write unit information
-            let unit = match self.units.get(key) {
-                Some(u) => u,
-                None => "",
+    /// Move the values of another store with the same registered signals into this one,
+    /// e.g. of another decode thread. Signals with values in both stores get all values, sort_by_timestamp merges them.
+    pub fn merge(&mut self, other: DataStore) {
+        assert_eq!(self.columns.len(), other.columns.len(), "Merged data stores must have the same signals");
+        for (column, other_column) in self.columns.iter_mut().zip(other.columns) {
+            if other_column.timestamps.is_empty() {
+                continue;
+            }
+            if column.timestamps.is_empty() {
+                column.timestamps = other_column.timestamps;
+                column.values = other_column.values;
+                column.run_starts = other_column.run_starts;
+                column.frame_indices = other_column.frame_indices;
+                continue;
+            }
+
+            // Keep the runs apart, so sorting can merge them instead of sorting all values
+            let offset = column.timestamps.len();
+            column.run_starts.push(offset);
+            column.run_starts.extend(other_column.run_starts.iter().map(|start| start + offset));
+            column.timestamps.extend(other_column.timestamps);
+            column.frame_indices = match (column.frame_indices.take(), other_column.frame_indices) {
+                (Some(mut frame_indices), Some(other_frame_indices)) => {
+                    frame_indices.extend(other_frame_indices);
+                    Some(frame_indices)
+                },
+                _ => None,
             };
-            let unit_bytes = unit.as_bytes();
-            buf_writer.write_all(&(unit_bytes.len() as u16).to_le_bytes())?;
-            buf_writer.write_all(unit_bytes)?;
-            
-            // Write value table information
-            let value_table = self.value_tables.get(key);
-            match value_table {
-                Some(table) => {
-                    // Write value table count
-                    buf_writer.write_all(&(table.len() as u16).to_le_bytes())?;
-                    
-                    // Write each value table entry
-                    for (value, description) in table {
-                        buf_writer.write_all(&value.to_le_bytes())?; // 8 bytes for i64 value
-                        let desc_bytes = description.as_bytes();
-                        buf_writer.write_all(&(desc_bytes.len() as u16).to_le_bytes())?; // 2 bytes for description length
-                        buf_writer.write_all(desc_bytes)?; // variable length description
-                    }
-                }
-                None => {
-                    // No value table for this signal
-                    buf_writer.write_all(&(0u16).to_le_bytes())?;
+            match (&mut column.values, other_column.values) {
+                (Values::Int(values), Values::Int(other_values)) => values.extend(other_values),
+                (Values::UInt(values), Values::UInt(other_values)) => values.extend(other_values),
+                (Values::Float(values), Values::Float(other_values)) => values.extend(other_values),
+                (Values::String(values), Values::String(other_values)) => values.extend(other_values),
+                _ => panic!("Type mismatch for signal: {}", column.name),
+            }
+        }
+        self.sorted = false;
+    }
+
+    /// Sort the values of every signal by timestamp. write_to_stream sorts if this wasn't done
+    /// after the last push, calling it first allows timing the sort on its own.
+    pub fn sort_by_timestamp(&mut self) {
+        if self.sorted {
+            return;
+        }
+
+        // Sort all columns by timestamp in ascending order
+        for column in &mut self.columns {
+            let run_starts = std::mem::take(&mut column.run_starts);
+            let frame_indices = column.frame_indices.as_mut();
+            match &mut column.values {
+                Values::Empty => {},
+                Values::Int(values) => Self::sort_column(&mut column.timestamps, values, frame_indices, &run_starts),
+                Values::UInt(values) => Self::sort_column(&mut column.timestamps, values, frame_indices, &run_starts),
+                Values::Float(values) => Self::sort_column(&mut column.timestamps, values, frame_indices, &run_starts),
+                Values::String(values) => Self::sort_column(&mut column.timestamps, values, frame_indices, &run_starts),
+            }
+        }
+        self.sorted = true;
+    }
+
+    /// Sort the values of a column by timestamp. Equal timestamps are ordered by frame index if it was recorded,
+    /// otherwise they keep their order (within a run and across runs).
+    fn sort_column<T>(timestamps: &mut Vec<f64>, values: &mut Vec<T>, mut frame_indices: Option<&mut Vec<u64>>, run_starts: &[usize]) {
+        // Columns are usually sorted already, as are runs appended one after another
+        let sorted = match frame_indices.as_deref() {
+            Some(frame_indices) if !run_starts.is_empty() => (1..timestamps.len()).all(|i| {
+                timestamps[i - 1] < timestamps[i] || (timestamps[i - 1] == timestamps[i] && frame_indices[i - 1] < frame_indices[i])
+            }),
+            _ => timestamps.is_sorted(),
+        };
+        if sorted {
+            return;
+        }
+
+        // Fix up every run on its own, the stable sort then finds the sorted runs and merges them.
+        // A run too far out of order is sorted with the others in one go.
+        let mut run_end = timestamps.len();
+        let mut runs_sorted = true;
+        for &run_start in run_starts.iter().rev().chain(&[0]) {
+            let run_frame_indices = frame_indices.as_deref_mut().map(|frame_indices| &mut frame_indices[run_start..run_end]);
+            if !Self::fix_up_run(&mut timestamps[run_start..run_end], &mut values[run_start..run_end], run_frame_indices) {
+                runs_sorted = false;
+                break;
+            }
+            run_end = run_start;
+        }
+        if !runs_sorted || !run_starts.is_empty() {
+            Self::sort_values(timestamps, values, frame_indices);
+        }
+    }
+
+    /// Insertion sort for a run with a few values slightly out of order, e.g. frames logged late.
+    /// Gives up once it would move more values than a quarter of the run, returns whether the run is sorted.
+    fn fix_up_run<T>(timestamps: &mut [f64], values: &mut [T], mut frame_indices: Option<&mut [u64]>) -> bool {
+        let mut move_budget = timestamps.len() / 4;
+        for i in 1..timestamps.len() {
+            let timestamp = timestamps[i];
+            let mut j = i;
+            while j > 0 && timestamps[j - 1] > timestamp {
+                j -= 1;
+            }
+            if i - j > move_budget {
+                return false;
+            }
+            move_budget -= i - j;
+            timestamps[j..=i].rotate_right(1);
+            values[j..=i].rotate_right(1);
+            if let Some(frame_indices) = frame_indices.as_deref_mut() {
+                frame_indices[j..=i].rotate_right(1);
+            }
+        }
+        timestamps.is_sorted()
+    }
+
+    /// Stable sort by timestamp, equal timestamps are ordered by frame index if it was recorded
+    fn sort_values<T>(timestamps: &mut Vec<f64>, values: &mut Vec<T>, frame_indices: Option<&mut Vec<u64>>) {
+        let Some(frame_indices) = frame_indices else {
+            // Stable sort of the (timestamp, value) pairs, equal timestamps keep their order
+            let mut points: Vec<(f64, T)> = timestamps.drain(..).zip(values.drain(..)).collect();
+            points.sort_by(|a, b| a.0.partial_cmp(&b.0).unwrap_or(Ordering::Equal));
+            for (timestamp, value) in points {
+                timestamps.push(timestamp);
+                values.push(value);
+            }
+            return;
+        };
+
+        let mut points: Vec<(f64, u64, T)> = timestamps.drain(..)
+            .zip(frame_indices.drain(..))
+            .zip(values.drain(..))
+            .map(|((timestamp, frame_index), value)| (timestamp, frame_index, value))
+            .collect();
+        points.sort_by(|a, b| a.0.partial_cmp(&b.0).unwrap_or(Ordering::Equal).then(a.1.cmp(&b.1)));
+        for (timestamp, frame_index, value) in points {
+            timestamps.push(timestamp);
+            frame_indices.push(frame_index);
+            values.push(value);
+        }
+    }
+
+    fn signal_groups(&self) -> Vec<SignalGroup<'_>> {
+        // Order signals by source message so all candidates for a group are adjacent
+        let mut columns: Vec<&Column> = self.columns.iter().filter(|column| !column.timestamps.is_empty()).collect();
+        columns.sort_by(|a, b| a.source.cmp(&b.source).then(a.name.cmp(&b.name)));
+
+        // Signals of the same message only share a group if their timestamps are identical
+        // (e.g. multiplexed signals are only present in some frames of their message)
+        let mut groups: Vec<SignalGroup> = Vec::new();
+        for column in columns {
+            let source = column.source.as_ref();
+            let existing = groups.iter_mut()
+                .rev()
+                .take_while(|group| source.is_some() && group.source == source)
+                .find(|group| group.timestamps == column.timestamps.as_slice());
+            match existing {
+                Some(group) => group.columns.push(column),
+                None => groups.push(SignalGroup { source, timestamps: &column.timestamps, columns: vec![column] }),
+            }
+        }
+        groups
+    }
+
+    fn write_signal_info<W: Write>(buf_writer: &mut W, column: &Column) -> Result<(), Box<dyn std::error::Error>> {
+        // Write signal name length and name
+        let name_bytes = column.name.as_bytes();
+        buf_writer.write_all(&(name_bytes.len() as u16).to_le_bytes())?;
+        buf_writer.write_all(name_bytes)?;
+
+        // Write unit information
+        let unit_bytes = column.unit.as_bytes();
+        buf_writer.write_all(&(unit_bytes.len() as u16).to_le_bytes())?;
+        buf_writer.write_all(unit_bytes)?;
+
+        // Write value table information
+        match &column.value_table {
+            Some(table) => {
+                // Write value table count
+                buf_writer.write_all(&(table.len() as u16).to_le_bytes())?;
+
+                // Write each value table entry
+                for (value, description) in table {
+                    buf_writer.write_all(&value.to_le_bytes())?; // 8 bytes for i64 value
+                    let desc_bytes = description.as_bytes();
+                    buf_writer.write_all(&(desc_bytes.len() as u16).to_le_bytes())?; // 2 bytes for description length
+                    buf_writer.write_all(desc_bytes)?; // variable length description
                 }
             }
-            
-            // Determine type and write data
-            if let Some(vec) = data.downcast_ref::<Vec<DataPoint<i64>>>() {
+            None => {
+                // No value table for this signal
+                buf_writer.write_all(&(0u16).to_le_bytes())?;
+            }
+        }
+        Ok(())
+    }
+
+    fn write_values<W: Write>(buf_writer: &mut W, values: &Values) -> Result<(), Box<dyn std::error::Error>> {
+        // Write type marker and the value column
+        match values {
+            Values::Int(values) => {
                 buf_writer.write_all(&[1u8])?; // Type marker: 1 = i64
-                buf_writer.write_all(&(vec.len() as u32).to_le_bytes())?;
-                
-                // Batch write all data points for this signal
-                let mut batch = Vec::with_capacity(vec.len() * 16); // 16 bytes per point
-                for point in vec {
-                    batch.extend_from_slice(&point.timestamp.to_le_bytes()); // 8 bytes
-                    batch.extend_from_slice(&point.value.to_le_bytes());     // 8 bytes
-                }
-                buf_writer.write_all(&batch)?;
-                
-            } else if let Some(vec) = data.downcast_ref::<Vec<DataPoint<u64>>>() {
+                Self::write_words(buf_writer, values.iter().map(|value| value.to_le_bytes()), values.len())?;
+            },
+            Values::UInt(values) => {
                 buf_writer.write_all(&[2u8])?; // Type marker: 2 = u64
-                buf_writer.write_all(&(vec.len() as u32).to_le_bytes())?;
-                
-                // Batch write all data points for this signal
-                let mut batch = Vec::with_capacity(vec.len() * 16); // 16 bytes per point
-                for point in vec {
-                    batch.extend_from_slice(&point.timestamp.to_le_bytes()); // 8 bytes
-                    batch.extend_from_slice(&point.value.to_le_bytes());     // 8 bytes
-                }
-                buf_writer.write_all(&batch)?;
-                
-            } else if let Some(vec) = data.downcast_ref::<Vec<DataPoint<f64>>>() {
+                Self::write_words(buf_writer, values.iter().map(|value| value.to_le_bytes()), values.len())?;
+            },
+            Values::Float(values) => {
                 buf_writer.write_all(&[3u8])?; // Type marker: 3 = f64
-                buf_writer.write_all(&(vec.len() as u32).to_le_bytes())?;
-                
-                // Batch write all data points for this signal
-                let mut batch = Vec::with_capacity(vec.len() * 16); // 16 bytes per point
-                for point in vec {
-                    batch.extend_from_slice(&point.timestamp.to_le_bytes()); // 8 bytes
-                    batch.extend_from_slice(&point.value.to_le_bytes());     // 8 bytes
+                Self::write_words(buf_writer, values.iter().map(|value| value.to_le_bytes()), values.len())?;
+            },
+            Values::String(values) => {
+                buf_writer.write_all(&[4u8])?; // Type marker: 4 = string
+
+                // Columnar layout so the reader can parse the block in bulk:
+                // all byte lengths, then all utf-8 bytes back to back
+                let mut batch = Vec::with_capacity(values.len() * 2);
+                for value in values {
+                    batch.extend_from_slice(&(value.len() as u16).to_le_bytes()); // 2 bytes
                 }
                 buf_writer.write_all(&batch)?;
-                
-            } else if let Some(vec) = data.downcast_ref::<Vec<DataPoint<String>>>() {
-                buf_writer.write_all(&[4u8])?; // Type marker: 4 = string
-                buf_writer.write_all(&(vec.len() as u32).to_le_bytes())?;
-                
-                // Strings can't be batched as easily due to variable length
-                // But we can still use the buffered writer for better performance
-                for point in vec {
-                    buf_writer.write_all(&point.timestamp.to_le_bytes())?; // 8 bytes
-                    let value_bytes = point.value.as_bytes();
-                    buf_writer.write_all(&(value_bytes.len() as u16).to_le_bytes())?; // 2 bytes
-                    buf_writer.write_all(value_bytes)?;
+
+                for value in values {
+                    buf_writer.write_all(value.as_bytes())?;
                 }
+            },
+            Values::Empty => {},
+        }
+        Ok(())
+    }
+
+    /// Batch write a column of 8 byte values
+    fn write_words<W: Write>(buf_writer: &mut W, words: impl Iterator<Item = [u8; 8]>, count: usize) -> std::io::Result<()> {
+        let mut batch = Vec::with_capacity(count * 8);
+        for word in words {
+            batch.extend_from_slice(&word);
+        }
+        buf_writer.write_all(&batch)
+    }
+
+    pub fn write_to_stream<W: Write>(&mut self, writer: W) -> Result<(), Box<dyn std::error::Error>> {
+        self.sort_by_timestamp();
+
+        // Use a large buffer for batched writes (1MB buffer)
+        let mut buf_writer = BufWriter::with_capacity(1024 * 1024, writer);
+
+        // Write magic header to identify binary format
+        buf_writer.write_all(b"BLF2MDF\x05")?; // 8 bytes: magic + version (v5 groups signals by source message)
+
+        // Write group count as 4-byte little-endian
+        let groups = self.signal_groups();
+        buf_writer.write_all(&(groups.len() as u32).to_le_bytes())?;
+
+        for group in &groups {
+            // Write source message, signals without a known source get bus 0xFF
+            let (bus, message_id, message_name) = match group.source {
+                Some(source) => (source.bus, source.message_id, source.message_name.as_str()),
+                None => (u8::MAX, u32::MAX, ""),
+            };
+            buf_writer.write_all(&[bus])?;
+            buf_writer.write_all(&message_id.to_le_bytes())?;
+            buf_writer.write_all(&(message_name.len() as u16).to_le_bytes())?;
+            buf_writer.write_all(message_name.as_bytes())?;
+
+            // Write the shared timestamps once for the whole group
+            buf_writer.write_all(&(group.timestamps.len() as u32).to_le_bytes())?;
+            let timestamps = group.timestamps.iter().map(|timestamp| timestamp.to_le_bytes());
+            Self::write_words(&mut buf_writer, timestamps, group.timestamps.len())?;
+
+            // Write the value columns of all signals in the group
+            buf_writer.write_all(&(group.columns.len() as u16).to_le_bytes())?;
+            for column in &group.columns {
+                Self::write_signal_info(&mut buf_writer, column)?;
+                Self::write_values(&mut buf_writer, &column.values)?;
             }
         }
-        
+
         buf_writer.flush()?;
         Ok(())
     }
@@ -197,4 +467,253 @@ impl Default for DataStore {
     fn default() -> Self {
         Self::new()
     }
-}
\ No newline at end of file
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::synthetic::Rng;
+
+    fn int_values(data_store: &DataStore, id: SignalId) -> &[i64] {
+        column_ints(&data_store.columns[id as usize])
+    }
+
+    fn column_ints(column: &Column) -> &[i64] {
+        match &column.values {
+            Values::Int(values) => values,
+            values => panic!("Unexpected values {:?}", values),
+        }
+    }
+
+    #[test]
+    fn register_signal_twice() {
+        let mut data_store = DataStore::new();
+        let speed = data_store.register("Speed", None);
+        let gear = data_store.register("Gear", None);
+        assert_eq!((speed, gear), (0, 1));
+        assert_eq!(data_store.register("Speed", None), speed);
+        assert_eq!(data_store.signal_id("Speed", None), Some(speed));
+        assert_eq!(data_store.signal_id("Rpm", None), None);
+        assert_eq!(data_store.columns.len(), 2);
+
+        data_store.set_unit(speed, "km/h");
+        assert_eq!(data_store.columns[speed as usize].unit, "km/h");
+        assert_eq!(data_store.columns[gear as usize].unit, "");
+    }
+
+    fn source(message_id: u32, message_name: &str) -> SignalSource {
+        SignalSource { bus: 0, message_id, message_name: message_name.to_string() }
+    }
+
+    #[test]
+    fn signal_name_of_two_messages() {
+        let engine = source(0x100, "Engine");
+        let brake = source(0x200, "Brake");
+        let mut data_store = DataStore::new();
+        let engine_counter = data_store.register("Counter", Some(&engine));
+        let engine_speed = data_store.register("Speed", Some(&engine));
+        let brake_counter = data_store.register("Counter", Some(&brake));
+        assert_ne!(engine_counter, brake_counter);
+        assert_eq!(data_store.register("Counter", Some(&brake)), brake_counter);
+        assert_eq!(data_store.signal_id("Counter", Some(&engine)), Some(engine_counter));
+        assert_eq!(data_store.signal_id("Counter", None), None);
+
+        for step in 0..4 {
+            data_store.push_int(engine_counter, step as f64, step);
+            data_store.push_int(engine_speed, step as f64, 100 + step);
+            data_store.push_int(brake_counter, step as f64 + 0.5, 10 + step);
+        }
+        data_store.sort_by_timestamp();
+
+        // Every message group has its own Counter with the values of its frames
+        let groups = data_store.signal_groups();
+        assert_eq!(groups.len(), 2);
+        assert_eq!(groups[0].source, Some(&engine));
+        assert_eq!(groups[0].timestamps, [0.0, 1.0, 2.0, 3.0]);
+        assert_eq!(groups[0].columns.iter().map(|column| column.name.as_str()).collect::<Vec<_>>(), ["Counter", "Speed"]);
+        assert_eq!(column_ints(groups[0].columns[0]), [0, 1, 2, 3]);
+        assert_eq!(groups[1].source, Some(&brake));
+        assert_eq!(groups[1].timestamps, [0.5, 1.5, 2.5, 3.5]);
+        assert_eq!(groups[1].columns.len(), 1);
+        assert_eq!(groups[1].columns[0].name, "Counter");
+        assert_eq!(column_ints(groups[1].columns[0]), [10, 11, 12, 13]);
+    }
+
+    #[test]
+    fn push_typed_values() {
+        let mut data_store = DataStore::new();
+        let ids: Vec<SignalId> = ["Int", "UInt", "Float", "String", "Unused"].iter().map(|name| data_store.register(name, None)).collect();
+        for step in 0..3 {
+            let timestamp = step as f64;
+            data_store.push_int(ids[0], timestamp, -step);
+            data_store.push_uint(ids[1], timestamp, u64::MAX - step as u64);
+            data_store.push_float(ids[2], timestamp, step as f64 * 0.5);
+            data_store.push_string(ids[3], timestamp, step.to_string());
+        }
+        assert_eq!(data_store.signal_count(), 4);
+        assert_eq!(data_store.sample_count(), 12);
+        assert_eq!(int_values(&data_store, ids[0]), [0, -1, -2]);
+        assert!(matches!(&data_store.columns[1].values, Values::UInt(values) if values == &[u64::MAX, u64::MAX - 1, u64::MAX - 2]));
+        assert!(matches!(&data_store.columns[2].values, Values::Float(values) if values == &[0.0, 0.5, 1.0]));
+        assert!(matches!(&data_store.columns[3].values, Values::String(values) if values == &["0", "1", "2"]));
+        assert!(matches!(data_store.columns[4].values, Values::Empty));
+    }
+
+    #[test]
+    #[should_panic(expected = "Type mismatch for signal: Speed")]
+    fn push_other_type() {
+        let mut data_store = DataStore::new();
+        let id = data_store.register("Speed", None);
+        data_store.push_int(id, 0.0, 1);
+        data_store.push_float(id, 1.0, 1.5);
+    }
+
+    #[test]
+    fn merge_overlapping_and_disjoint_signals() {
+        let mut template = DataStore::new();
+        let ids: Vec<SignalId> = ["A", "B", "C", "D"].iter().map(|name| template.register(name, None)).collect();
+
+        // A only has values in the first store, C only in the second, B in both and D in neither
+        let mut first = template.clone();
+        let mut second = template.clone();
+        for step in 0..4 {
+            first.push_int(ids[0], step as f64, step);
+            first.push_int(ids[1], (2 * step) as f64, 10 + step);
+            second.push_int(ids[1], (2 * step + 1) as f64, 20 + step);
+            second.push_int(ids[2], step as f64, 30 + step);
+        }
+
+        let mut data_store = template;
+        data_store.merge(first);
+        data_store.merge(second);
+        data_store.sort_by_timestamp();
+        assert_eq!(data_store.signal_count(), 3);
+        assert_eq!(data_store.sample_count(), 16);
+        assert_eq!(int_values(&data_store, ids[0]), [0, 1, 2, 3]);
+        assert_eq!(int_values(&data_store, ids[1]), [10, 20, 11, 21, 12, 22, 13, 23]);
+        assert_eq!(data_store.columns[1].timestamps, [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]);
+        assert_eq!(int_values(&data_store, ids[2]), [30, 31, 32, 33]);
+        assert!(matches!(data_store.columns[3].values, Values::Empty));
+    }
+
+    #[test]
+    #[should_panic(expected = "Merged data stores must have the same signals")]
+    fn merge_other_signals() {
+        let mut data_store = DataStore::new();
+        data_store.register("A", None);
+        let mut other = data_store.clone();
+        other.register("B", None);
+        data_store.merge(other);
+    }
+
+    #[test]
+    #[should_panic(expected = "Type mismatch for signal: A")]
+    fn merge_other_type() {
+        let mut data_store = DataStore::new();
+        let id = data_store.register("A", None);
+        let mut other = data_store.clone();
+        data_store.push_int(id, 0.0, 1);
+        other.push_uint(id, 1.0, 1);
+        data_store.merge(other);
+    }
+
+    /// Decode (timestamp, frame index) frames of one signal on `shards` threads like ShardedDecoder, the frame index
+    /// is pushed as value. Returns the merged and sorted store.
+    fn sharded_store(frames: &[(f64, u64)], shards: usize, track_frame_order: bool) -> DataStore {
+        let mut template = DataStore::new();
+        let id = template.register("Signal", None);
+        if track_frame_order {
+            template.track_frame_order(id);
+        }
+        let mut shard_stores = vec![template.clone(); shards];
+        for &(timestamp, frame_index) in frames {
+            let shard_store = &mut shard_stores[frame_index as usize % shards];
+            shard_store.set_frame_index(frame_index);
+            shard_store.push_int(id, timestamp, frame_index as i64);
+        }
+
+        let mut data_store = template;
+        for shard_store in shard_stores {
+            data_store.merge(shard_store);
+        }
+        data_store.sort_by_timestamp();
+        data_store
+    }
+
+    /// Stable sort by (timestamp, frame index)
+    fn sorted_frames(frames: &[(f64, u64)]) -> Vec<(f64, u64)> {
+        let mut sorted = frames.to_vec();
+        sorted.sort_by(|a, b| a.0.partial_cmp(&b.0).unwrap().then(a.1.cmp(&b.1)));
+        sorted
+    }
+
+    fn assert_column(data_store: &DataStore, expected: &[(f64, u64)]) {
+        let column = &data_store.columns[0];
+        let timestamps: Vec<f64> = expected.iter().map(|frame| frame.0).collect();
+        let frame_indices: Vec<i64> = expected.iter().map(|frame| frame.1 as i64).collect();
+        assert_eq!(column.timestamps, timestamps);
+        match &column.values {
+            Values::Int(values) => assert_eq!(values, &frame_indices),
+            Values::Empty => assert!(expected.is_empty()),
+            values => panic!("Unexpected values {:?}", values),
+        }
+        if let Some(recorded) = &column.frame_indices {
+            assert!(recorded.iter().map(|index| *index as i64).eq(frame_indices));
+        }
+    }
+
+    /// Check the sort of `frames` decoded on 1 to 4 threads against a stable sort by (timestamp, frame index)
+    fn assert_sorts_like_stable_sort(frames: &[(f64, u64)]) {
+        let expected = sorted_frames(frames);
+        for shards in 1..=4 {
+            assert_column(&sharded_store(frames, shards, true), &expected);
+        }
+        // Without frame indices on one thread, equal timestamps keep the order of the pushes
+        assert_column(&sharded_store(frames, 1, false), &expected);
+    }
+
+    #[test]
+    fn sort_sorted_values() {
+        let frames: Vec<(f64, u64)> = (0..1000).map(|i| (i as f64 * 0.01, i)).collect();
+        assert_sorts_like_stable_sort(&frames);
+        assert_sorts_like_stable_sort(&[]);
+        assert_sorts_like_stable_sort(&[(1.0, 0)]);
+    }
+
+    #[test]
+    fn sort_late_values() {
+        // Every 50th frame is logged up to 5 frames late, within the fix-up budget of every run
+        let frames: Vec<(f64, u64)> = (0..1000).map(|i| (i as f64 * 0.01 - if i % 50 == 7 { 0.05 } else { 0.0 }, i)).collect();
+        assert_sorts_like_stable_sort(&frames);
+
+        let (mut timestamps, mut values): (Vec<f64>, Vec<u64>) = frames.iter().copied().unzip();
+        assert!(DataStore::fix_up_run(&mut timestamps, &mut values, None));
+        assert_eq!(timestamps.iter().copied().zip(values).collect::<Vec<_>>(), sorted_frames(&frames));
+    }
+
+    #[test]
+    fn sort_equal_timestamps_of_different_threads() {
+        // 8 frames per timestamp, spread over the threads, a few logged late
+        let frames: Vec<(f64, u64)> = (0..2000).map(|i| ((i / 8) as f64 * 0.01 - if i % 97 == 0 { 0.03 } else { 0.0 }, i)).collect();
+        assert_sorts_like_stable_sort(&frames);
+
+        // Without frame indices the runs of the threads are kept in merge order
+        let data_store = sharded_store(&frames, 3, false);
+        let mut merge_order: Vec<(f64, u64)> = (0..3).flat_map(|shard| frames.iter().copied().filter(move |frame| frame.1 % 3 == shard)).collect();
+        merge_order.sort_by(|a, b| a.0.partial_cmp(&b.0).unwrap());
+        assert_column(&data_store, &merge_order);
+    }
+
+    #[test]
+    fn sort_values_beyond_fix_up_budget() {
+        // Random timestamps with many ties, and a reversed series
+        let mut rng = Rng::new(3);
+        let random: Vec<(f64, u64)> = (0..3000).map(|i| ((rng.next_u64() % 500) as f64 * 0.001, i)).collect();
+        assert_sorts_like_stable_sort(&random);
+        let reversed: Vec<(f64, u64)> = (0..1000).map(|i| ((1000 - i / 2) as f64 * 0.01, i)).collect();
+        assert_sorts_like_stable_sort(&reversed);
+
+        let (mut timestamps, mut values): (Vec<f64>, Vec<u64>) = reversed.iter().copied().unzip();
+        assert!(!DataStore::fix_up_run(&mut timestamps, &mut values, None));
+    }
+}
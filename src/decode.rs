@@ -0,0 +1,559 @@
+use can_dbc::{Message, DBC, SignalExtendedValueType, ValueType, ByteOrder, MultiplexIndicator};
+use std::collections::HashMap;
+use std::mem;
+use std::sync::mpsc::{self, SyncSender};
+use std::thread::{Scope, ScopedJoinHandle};
+
+use crate::blf_reader::MAX_DATA_LEN;
+use crate::data_store::{DataStore, SignalId, SignalSource};
+
+/// Precomputed position of a signal in the payload: the payload is read as one little endian integer,
+/// shifted down to the lowest bit of the signal and masked.
+/// Motorola signals start at their MSB and cover the bit_count bits below it in that integer, the MSB
+/// ends up as bit 0 of the raw value, so their bits are reversed after masking.
+#[derive(Debug, Clone, Copy)]
+pub struct BitField {
+    pub start_bit: u32,
+    pub bit_count: u32,
+    pub is_big_endian: bool,
+    low_bit: u32,
+    mask: u64,
+}
+
+impl BitField {
+    /// None if the layout can't be extracted from any payload
+    pub fn new(start_bit: i64, bit_count: i64, is_big_endian: bool) -> Option<Self> {
+        if bit_count == 0 || bit_count > 64 || start_bit < 0 || start_bit > u32::MAX as i64 {
+            return None;
+        }
+        let low_bit = if is_big_endian {
+            // Motorola byte order (MSB first), the start bit is the MSB of the signal
+            if start_bit < bit_count - 1 {
+                return None;
+            }
+            start_bit - (bit_count - 1)
+        } else {
+            // Intel byte order (LSB first), the start bit is the LSB of the signal
+            start_bit
+        };
+        Some(Self {
+            start_bit: start_bit as u32,
+            bit_count: bit_count as u32,
+            is_big_endian,
+            low_bit: low_bit as u32,
+            mask: u64::MAX >> (64 - bit_count),
+        })
+    }
+
+    /// Raw value of the field, None if the payload doesn't contain the start bit.
+    /// Intel signals that run past the end of the payload are filled up with zeros.
+    #[inline]
+    pub fn extract(&self, data: &[u8]) -> Option<u64> {
+        if self.start_bit as usize >= data.len() * 8 {
+            return None;
+        }
+
+        let bits = match <&[u8; 8]>::try_from(data) {
+            // Classic CAN payload, low_bit < 64 since it isn't above the start bit
+            Ok(payload) => u64::from_le_bytes(*payload) >> self.low_bit,
+            Err(_) => {
+                // The field starts in byte low_bit / 8 and covers up to 9 bytes with the shift
+                let first_byte = self.low_bit as usize / 8;
+                let available = (data.len() - first_byte).min(9);
+                let mut bytes = [0u8; 16];
+                bytes[..available].copy_from_slice(&data[first_byte..first_byte + available]);
+                (u128::from_le_bytes(bytes) >> (self.low_bit % 8)) as u64
+            },
+        };
+
+        let raw_value = bits & self.mask;
+        if self.is_big_endian {
+            Some(raw_value.reverse_bits() >> (64 - self.bit_count))
+        } else {
+            Some(raw_value)
+        }
+    }
+}
+
+pub fn extract_signal_raw(
+        data: &[u8], 
+        start_bit: i64, 
+        bit_count: i64, 
+        is_big_endian: bool) -> Option<u64> {
+    BitField::new(start_bit, bit_count, is_big_endian)?.extract(data)
+}
+
+pub fn process_signal(
+    msg_data: &[u8],
+    start_bit: i64,
+    bit_count: i64,
+    is_big_endian: bool,
+    is_signed: bool,
+    store_as_float: bool,
+    factor: f64,
+    offset: f64,
+    signal_id: SignalId,
+    msg_timestamp: f64,
+    data_store: &mut DataStore,
+) {
+    let raw_value = match extract_signal_raw(msg_data, start_bit, bit_count, is_big_endian) {
+        Some(v) => v,
+        None => {
+            // println!("Failed to extract signal {} from message ID {}", signal_id, msg.arbitration_id);
+            return;
+        }
+    };
+
+    push_value(raw_value, bit_count, is_signed, store_as_float, factor, offset, signal_id, msg_timestamp, data_store);
+}
+
+/// Scale a raw value and push it to the data store
+#[inline]
+fn push_value(
+    raw_value: u64,
+    bit_count: i64,
+    is_signed: bool,
+    store_as_float: bool,
+    factor: f64,
+    offset: f64,
+    signal_id: SignalId,
+    msg_timestamp: f64,
+    data_store: &mut DataStore,
+) {
+    if is_signed {
+        // Convert raw value to signed using two's complement
+        let signed_value = if bit_count < 64 {
+            // Create mask for the number of bits
+            let mask = (1u64 << bit_count) - 1;
+            let masked_value = raw_value & mask;
+
+            // Check if sign bit is set
+            let sign_bit = 1u64 << (bit_count - 1);
+            if masked_value & sign_bit != 0 {
+                // Negative value - extend sign bits
+                let sign_extension = !((1u64 << bit_count) - 1);
+                (masked_value | sign_extension) as i64
+            } else {
+                // Positive value
+                masked_value as i64
+            }
+        } else {
+            raw_value as i64
+        };
+
+        if store_as_float {
+            let physical_value = (signed_value as f64) * factor + offset;
+            data_store.push_float(signal_id, msg_timestamp, physical_value);
+        } else {
+            let physical_value = (factor as i64) * signed_value + (offset as i64);
+            data_store.push_int(signal_id, msg_timestamp, physical_value);
+        }
+    } else {
+        if store_as_float {
+            let physical_value = (raw_value as f64) * factor + offset;
+            data_store.push_float(signal_id, msg_timestamp, physical_value);
+        } else {
+            let physical_value = (factor as u64) * raw_value + (offset as u64);
+            data_store.push_uint(signal_id, msg_timestamp, physical_value);
+        }
+    }
+}
+
+/// Precompiled decoding of one signal: bit layout, sign, scaling and output column
+#[derive(Debug, Clone)]
+pub struct SignalPlan {
+    pub id: SignalId,
+    pub field: BitField,
+    pub is_signed: bool,
+    pub store_as_float: bool,
+    pub factor: f64,
+    pub offset: f64,
+    /// Multiplexor value that selects the signal, None for signals in every frame
+    pub mux_value: Option<u64>,
+}
+
+/// Signals of one DBC message on one bus, in DBC order
+#[derive(Debug, Clone)]
+pub struct MessagePlan {
+    /// Bit field of the multiplexor signal
+    pub mux: Option<BitField>,
+    pub signals: Vec<SignalPlan>,
+}
+
+impl MessagePlan {
+    /// Compile the signals of a DBC message on a bus. Signals whose name was first registered on another bus
+    /// are left out, as are float signals and signals that can't be extracted from any payload.
+    /// Returns None if the message has more than one multiplexor or its multiplexor can't be extracted.
+    /// The output columns of the signals are registered in the data store, with the message as their source.
+    pub fn new(
+        bus_idx: usize,
+        dbc_msg: &Message,
+        dbc: &DBC,
+        bus_dbcs: &[DBC],
+        signal_bus_map: &HashMap<String, u32>,
+        data_store: &mut DataStore,
+    ) -> Option<Self> {
+        let mux = match dbc.message_multiplexor_switch(*dbc_msg.message_id()) {
+            Ok(Some(mux_signal)) => Some(BitField::new(
+                *mux_signal.start_bit() as i64,
+                *mux_signal.signal_size() as i64,
+                *mux_signal.byte_order() == ByteOrder::BigEndian,
+            )?),
+            Ok(None) => None,
+            Err(_) => return None,
+        };
+
+        let source = SignalSource {
+            bus: bus_idx as u8,
+            message_id: dbc_msg.message_id().raw(),
+            message_name: dbc_msg.message_name().clone(),
+        };
+
+        let mut signals = Vec::new();
+        'signal_loop: for signal in dbc_msg.signals() {
+            // Check if we want to skip because signal name already found on another bus
+            if let Some(signal_bus_idx) = signal_bus_map.get(signal.name()) {
+                if bus_idx != *signal_bus_idx as usize {
+                    continue 'signal_loop;
+                }
+            }
+
+            // Skip if float
+            for bus_dbc in bus_dbcs {
+                if let Some(v) = bus_dbc.extended_value_type_for_signal(*dbc_msg.message_id(), signal.name()) {
+                    if *v != SignalExtendedValueType::SignedOrUnsignedInteger {
+                        continue 'signal_loop;
+                    }
+                }
+            }
+
+            let mux_value = match signal.multiplexer_indicator() {
+                MultiplexIndicator::Plain | MultiplexIndicator::Multiplexor => None,
+                MultiplexIndicator::MultiplexedSignal(mux_idx) => Some(*mux_idx),
+                mux_ind => {
+                    println!("Can't handle MultiplexIndicator {:?} of signal {}", mux_ind, signal.name());
+                    continue 'signal_loop;
+                }
+            };
+
+            let Some(field) = BitField::new(
+                    *signal.start_bit() as i64,
+                    *signal.signal_size() as i64,
+                    *signal.byte_order() == ByteOrder::BigEndian) else {
+                continue 'signal_loop;
+            };
+
+            let factor = *signal.factor();
+            let offset = *signal.offset();
+            signals.push(SignalPlan {
+                id: data_store.register(signal.name(), Some(&source)),
+                field,
+                is_signed: *signal.value_type() == ValueType::Signed,
+                store_as_float: (factor.fract() != 0.0) || (offset.fract() != 0.0),
+                factor,
+                offset,
+                mux_value,
+            });
+        }
+
+        Some(Self { mux, signals })
+    }
+}
+
+/// Message plans of all busses, keyed by (bus, arbitration id), built once before reading a BLF file
+#[derive(Debug, Clone, Default)]
+pub struct DecodeTable {
+    messages: HashMap<(usize, u32), MessagePlan>,
+}
+
+impl DecodeTable {
+    /// Compile all messages of the DBCs of every bus. If several DBCs of a bus define the same
+    /// message id, the last one wins.
+    pub fn new(dbcs: &[Vec<DBC>], signal_bus_map: &HashMap<String, u32>, data_store: &mut DataStore) -> Self {
+        let mut messages = HashMap::new();
+        for (bus_idx, bus_dbcs) in dbcs.iter().enumerate() {
+            for dbc in bus_dbcs {
+                for dbc_msg in dbc.messages() {
+                    let key = (bus_idx, dbc_msg.message_id().raw());
+                    match MessagePlan::new(bus_idx, dbc_msg, dbc, bus_dbcs, signal_bus_map, data_store) {
+                        Some(plan) => messages.insert(key, plan),
+                        None => messages.remove(&key),
+                    };
+                }
+            }
+        }
+        Self { messages }
+    }
+
+    pub fn get(&self, bus_idx: usize, message_id: u32) -> Option<&MessagePlan> {
+        self.messages.get(&(bus_idx, message_id))
+    }
+
+    /// All compiled messages with their (bus, message id)
+    pub fn iter(&self) -> impl Iterator<Item = ((usize, u32), &MessagePlan)> {
+        self.messages.iter().map(|(key, plan)| (*key, plan))
+    }
+}
+
+/// Decode all signals of one CAN frame into the data store.
+/// Multiplexed signals are only decoded if the multiplexor value of the frame selects them.
+pub fn decode_message(msg_data: &[u8], msg_timestamp: f64, plan: &MessagePlan, data_store: &mut DataStore) {
+    let current_mux_value = match &plan.mux {
+        Some(mux) => match mux.extract(msg_data) {
+            Some(v) => v,
+            None => return,
+        },
+        None => 0,
+    };
+
+    for signal in &plan.signals {
+        if signal.mux_value.is_some_and(|mux_value| mux_value != current_mux_value) {
+            continue;
+        }
+        if let Some(raw_value) = signal.field.extract(msg_data) {
+            push_value(
+                raw_value, signal.field.bit_count as i64, signal.is_signed, signal.store_as_float,
+                signal.factor, signal.offset, signal.id, msg_timestamp, data_store);
+        }
+    }
+}
+
+// Frames sent to a decode thread at once, and batches queued per thread before the reader waits
+const SHARD_BATCH_SIZE: usize = 4096;
+const SHARD_QUEUE_LENGTH: usize = 4;
+
+/// Frame handed to a decode thread with its plan and relative timestamp
+struct ShardFrame<'scope> {
+    plan: &'scope MessagePlan,
+    index: u64,
+    timestamp: f64,
+    data: [u8; MAX_DATA_LEN],
+    data_len: u8,
+}
+
+/// Decodes frames on several threads. The frames are partitioned by (bus, arbitration id), so all frames of a
+/// message are decoded in file order by the same thread. Every thread decodes into its own copy of the data store,
+/// the copies are merged by finish. Signals of messages on different threads record the index of their frames,
+/// so their values are sorted in the same order as with a single thread.
+pub struct ShardedDecoder<'scope> {
+    senders: Vec<SyncSender<Vec<ShardFrame<'scope>>>>,
+    batches: Vec<Vec<ShardFrame<'scope>>>,
+    workers: Vec<ScopedJoinHandle<'scope, DataStore>>,
+    next_frame_index: u64,
+}
+
+/// Decode thread of a message, spreading the message keys evenly over the threads
+fn shard_of(bus_idx: usize, message_id: u32, shards: usize) -> usize {
+    let key = ((bus_idx as u64) << 32 | message_id as u64).wrapping_mul(0x9E37_79B9_7F4A_7C15);
+    (key >> 32) as usize % shards
+}
+
+impl<'scope> ShardedDecoder<'scope> {
+    /// Start `shards` decode threads in `scope`, each with a copy of the registered signals of `data_store`
+    pub fn new(scope: &'scope Scope<'scope, '_>, shards: usize, data_store: &DataStore, decode_table: &DecodeTable) -> Self {
+        // Columns fed by messages on more than one thread
+        let mut signal_shards: HashMap<SignalId, usize> = HashMap::new();
+        let mut shared_signals = Vec::new();
+        for ((bus_idx, message_id), plan) in decode_table.iter() {
+            let shard = shard_of(bus_idx, message_id, shards);
+            for signal in &plan.signals {
+                if *signal_shards.entry(signal.id).or_insert(shard) != shard {
+                    shared_signals.push(signal.id);
+                }
+            }
+        }
+        let mut template = data_store.clone();
+        for id in shared_signals {
+            template.track_frame_order(id);
+        }
+
+        let mut senders = Vec::with_capacity(shards);
+        let mut workers = Vec::with_capacity(shards);
+        for _ in 0..shards {
+            let (sender, receiver) = mpsc::sync_channel::<Vec<ShardFrame>>(SHARD_QUEUE_LENGTH);
+            let mut shard_store = template.clone();
+            workers.push(scope.spawn(move || {
+                for batch in receiver {
+                    for frame in &batch {
+                        shard_store.set_frame_index(frame.index);
+                        decode_message(&frame.data[..frame.data_len as usize], frame.timestamp, frame.plan, &mut shard_store);
+                    }
+                }
+                shard_store
+            }));
+            senders.push(sender);
+        }
+        let batches = (0..shards).map(|_| Vec::with_capacity(SHARD_BATCH_SIZE)).collect();
+        Self { senders, batches, workers, next_frame_index: 0 }
+    }
+
+    /// Queue a frame for the decode thread of its message
+    pub fn decode(&mut self, bus_idx: usize, message_id: u32, msg_data: &[u8], msg_timestamp: f64, plan: &'scope MessagePlan) {
+        let shard = shard_of(bus_idx, message_id, self.senders.len());
+        let index = self.next_frame_index;
+        self.next_frame_index += 1;
+
+        let data_len = msg_data.len().min(MAX_DATA_LEN);
+        let mut data = [0u8; MAX_DATA_LEN];
+        data[..data_len].copy_from_slice(&msg_data[..data_len]);
+
+        let batch = &mut self.batches[shard];
+        batch.push(ShardFrame { plan, index, timestamp: msg_timestamp, data, data_len: data_len as u8 });
+        if batch.len() == SHARD_BATCH_SIZE {
+            let full_batch = mem::replace(batch, Vec::with_capacity(SHARD_BATCH_SIZE));
+            // A decode thread only stops early if it panicked, finish reports that
+            let _ = self.senders[shard].send(full_batch);
+        }
+    }
+
+    /// Decode the queued frames, wait for the threads and merge their signals into `data_store`
+    pub fn finish(self, data_store: &mut DataStore) {
+        for (sender, batch) in self.senders.into_iter().zip(self.batches) {
+            if !batch.is_empty() {
+                let _ = sender.send(batch);
+            }
+        }
+        for worker in self.workers {
+            match worker.join() {
+                Ok(shard_store) => data_store.merge(shard_store),
+                Err(panic) => std::panic::resume_unwind(panic),
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::fmt::Write as _;
+    use std::thread;
+    use crate::synthetic::Rng;
+
+    /// Bit by bit extraction that BitField replaced, the reference for its results
+    fn extract_signal_raw_per_bit(data: &[u8], start_bit: i64, bit_count: i64, is_big_endian: bool) -> Option<u64> {
+        if bit_count == 0 || bit_count > 64 {
+            return None;
+        }
+
+        let total_bits = data.len() as i64 * 8;
+        if start_bit >= total_bits {
+            return None;
+        }
+
+        let mut result = 0u64;
+        if is_big_endian {
+            if start_bit < bit_count - 1 {
+                return None;
+            }
+            for bit_index in 0..bit_count {
+                let absolute_bit = start_bit - bit_index;
+                if (data[(absolute_bit / 8) as usize] >> (absolute_bit % 8)) & 1 != 0 {
+                    result |= 1u64 << bit_index;
+                }
+            }
+        } else {
+            for bit_index in 0..bit_count {
+                let absolute_bit = start_bit + bit_index;
+                if absolute_bit >= total_bits {
+                    break;
+                }
+                if (data[(absolute_bit / 8) as usize] >> (absolute_bit % 8)) & 1 != 0 {
+                    result |= 1u64 << bit_index;
+                }
+            }
+        }
+        Some(result)
+    }
+
+    fn payloads(len: usize) -> Vec<Vec<u8>> {
+        // Random bytes from a fixed xorshift seed, plus all ones and alternating bits
+        let mut state = 0x2545_F491_4F6C_DD1Du64 ^ len as u64;
+        let random = (0..len)
+            .map(|_| {
+                state ^= state << 13;
+                state ^= state >> 7;
+                state ^= state << 17;
+                state as u8
+            })
+            .collect();
+        vec![random, vec![0xFF; len], vec![0xA5; len], (0..len as u8).collect()]
+    }
+
+    #[test]
+    fn extract_matches_per_bit_extraction() {
+        // Every start bit and length on classic and CAN FD payloads (and a few other lengths),
+        // including layouts that don't fit and run past the end of the payload
+        for len in [8, 64, 0, 1, 3, 12] {
+            for data in payloads(len) {
+                for is_big_endian in [false, true] {
+                    for start_bit in 0..(len as i64 * 8 + 8) {
+                        for bit_count in 0..=65 {
+                            assert_eq!(
+                                extract_signal_raw(&data, start_bit, bit_count, is_big_endian),
+                                extract_signal_raw_per_bit(&data, start_bit, bit_count, is_big_endian),
+                                "payload length {}, start bit {}, bit count {}, big endian {}",
+                                len, start_bit, bit_count, is_big_endian,
+                            );
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    /// Sorted signal stream of a data store, to compare the decoded signals
+    fn signal_stream(mut data_store: DataStore) -> Vec<u8> {
+        let mut stream = Vec::new();
+        data_store.write_to_stream(&mut stream).unwrap();
+        stream
+    }
+
+    #[test]
+    fn sharded_decoding_matches_single_thread() {
+        // Every message has its own signal and a Counter and Checksum signal named like those of the other messages
+        let messages = 12u32;
+        let mut dbc_source = String::from("VERSION \"\"\n\nNS_ :\n\nBS_:\n\nBU_: ECU\n\n");
+        for message_idx in 0..messages {
+            writeln!(dbc_source, "BO_ {} Message{}: 8 ECU", 0x100 + message_idx, message_idx).unwrap();
+            writeln!(dbc_source, " SG_ Value{} : 0|16@1+ (1,0) [0|65535] \"\" ECU", message_idx).unwrap();
+            writeln!(dbc_source, " SG_ Counter : 16|8@1+ (1,0) [0|255] \"\" ECU").unwrap();
+            writeln!(dbc_source, " SG_ Checksum : 24|8@1+ (0.5,0) [0|127.5] \"\" ECU\n").unwrap();
+        }
+        let dbcs = vec![vec![DBC::from_slice(dbc_source.as_bytes()).unwrap()]];
+        let mut template = DataStore::new();
+        let decode_table = DecodeTable::new(&dbcs, &HashMap::new(), &mut template);
+
+        // Every message decodes its Counter into its own column
+        let counters: Vec<SignalId> = (0..messages).map(|message_idx| decode_table.get(0, 0x100 + message_idx).unwrap().signals[1].id).collect();
+        assert!((1..counters.len()).all(|i| !counters[..i].contains(&counters[i])));
+
+        // Frames of all messages arrive together, so the shared signals have many equal timestamps,
+        // and a few frames are logged late
+        let mut rng = Rng::new(7);
+        let frames: Vec<(u32, f64, [u8; 8])> = (0..20_000u64)
+            .map(|frame_idx| {
+                let message_id = 0x100 + rng.next_u64() as u32 % messages;
+                let late = if rng.next_u64() % 50 == 0 { 0.02 } else { 0.0 };
+                (message_id, (frame_idx / 8) as f64 * 0.01 - late, rng.next_u64().to_le_bytes())
+            })
+            .collect();
+
+        let mut single_thread = template.clone();
+        for (message_id, timestamp, data) in &frames {
+            decode_message(data, *timestamp, decode_table.get(0, *message_id).unwrap(), &mut single_thread);
+        }
+        let expected = signal_stream(single_thread);
+
+        for shards in [2, 3, 5] {
+            let mut sharded = template.clone();
+            thread::scope(|scope| {
+                let mut decoder = ShardedDecoder::new(scope, shards, &sharded, &decode_table);
+                for (message_id, timestamp, data) in &frames {
+                    decoder.decode(0, *message_id, data, *timestamp, decode_table.get(0, *message_id).unwrap());
+                }
+                decoder.finish(&mut sharded);
+            });
+            assert!(signal_stream(sharded) == expected, "{} decode threads", shards);
+        }
+    }
+}
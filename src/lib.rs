@@ -0,0 +1,10 @@
+//! BLF to MF4 conversion: reading BLF files, decoding CAN signals with DBC definitions
+//! and handing them to the Python MF4 writer. Used by the blf2mdf binary and the benchmarks.
+
+pub mod batch;
+pub mod blf_reader;
+pub mod data_store;
+pub mod decode;
+pub mod mdf_writer;
+pub mod report;
+pub mod synthetic;
@@ -1,20 +1,21 @@
-use can_dbc::{Message, DBC, SignalExtendedValueType, ValueType, ByteOrder};
-use std::fs::File;
+use anyhow::{anyhow, Result};
+use can_dbc::DBC;
+use std::fs::{self, File};
 use std::io::{self, Read};
 use std::path::PathBuf;
-use std::process::Stdio;
 use tqdm::tqdm;
 use std::collections::HashMap;
 use rfd::FileDialog;
 use std::env;
+use std::thread;
+use std::time::Instant;
 
-mod blf_reader;
-use blf_reader::BlfReader;
-
-mod data_store;
-use data_store::DataStore;
-
-const PYTHON_CODE: &str = include_str!("../script/write_mdf.py");
+use blf2mdf::batch::{self, BatchScheduler};
+use blf2mdf::blf_reader::BlfReader;
+use blf2mdf::data_store::{DataStore, SignalSource};
+use blf2mdf::decode::{decode_message, DecodeTable, ShardedDecoder};
+use blf2mdf::mdf_writer::MdfWriter;
+use blf2mdf::report::{self, ConversionReport};
 
 fn load_dbc(path_str: &str) -> Result<DBC, Box<dyn std::error::Error>> {
     // Read file
@@ -32,161 +33,42 @@ fn load_dbc(path_str: &str) -> Result<DBC, Box<dyn std::error::Error>> {
     Ok(dbc)
 }
 
-fn extract_signal_raw(
-        data: &[u8], 
-        start_bit: i64, 
-        bit_count: i64, 
-        is_big_endian: bool) -> Option<u64> {
-    if bit_count == 0 || bit_count > 64 {
-        return None;
-    }
-    
-    let total_bits = data.len() as i64 * 8;
-    if start_bit >= total_bits {
-        return None;
-    }
-    
-    let mut result = 0u64;
-    
-    if is_big_endian {
-        // Motorola byte order (MSB first)
-        // Start bit is the MSB of the signal
-        if start_bit < bit_count - 1 {
-            return None;
-        }
-        
-        for bit_index in 0..bit_count {
-            let absolute_bit = start_bit - bit_index;
-            if absolute_bit >= total_bits {
-                continue;
-            }
-            
-            let byte_index = (absolute_bit / 8) as usize;
-            let bit_in_byte = absolute_bit % 8;
-            
-            if byte_index < data.len() {
-                let bit_value = (data[byte_index] >> bit_in_byte) & 1;
-                if bit_value != 0 {
-                    result |= 1u64 << bit_index;
-                }
-            }
-        }
-    } else {
-        // Intel byte order (LSB first)
-        // Start bit is the LSB of the signal
-        for bit_index in 0..bit_count {
-            let absolute_bit = start_bit + bit_index;
-            if absolute_bit >= total_bits {
-                break;
-            }
-            
-            let byte_index = (absolute_bit / 8) as usize;
-            let bit_in_byte = absolute_bit % 8;
-            
-            if byte_index < data.len() {
-                let bit_value = (data[byte_index] >> bit_in_byte) & 1;
-                if bit_value != 0 {
-                    result |= 1u64 << bit_index;
-                }
-            }
-        }
-    }
-    
-    Some(result)
+/// DBC definitions compiled once per run, shared read-only by all conversion threads
+struct CompiledDbcs {
+    bus_count: usize,
+    /// Units, sources, value tables and ids of all signals, every file starts with a copy
+    data_store: DataStore,
+    decode_table: DecodeTable,
 }
 
-fn process_signal(
-    msg_data: &[u8],
-    start_bit: i64,
-    bit_count: i64,
-    is_big_endian: bool,
-    is_signed: bool,
-    store_as_float: bool,
-    factor: f64,
-    offset: f64,
-    signal_name: &str,
-    msg_timestamp: f64,
-    data_store: &mut DataStore,
-) {
-    let raw_value = match extract_signal_raw(msg_data, start_bit, bit_count, is_big_endian) {
-        Some(v) => v,
-        None => {
-            // println!("Failed to extract signal {} from message ID {}", signal_name, msg.arbitration_id);
-            return;
-        }
-    };
-
-    if is_signed {
-        // Convert raw value to signed using two's complement
-        let signed_value = if bit_count < 64 {
-            // Create mask for the number of bits
-            let mask = (1u64 << bit_count) - 1;
-            let masked_value = raw_value & mask;
-
-            // Check if sign bit is set
-            let sign_bit = 1u64 << (bit_count - 1);
-            if masked_value & sign_bit != 0 {
-                // Negative value - extend sign bits
-                let sign_extension = !((1u64 << bit_count) - 1);
-                (masked_value | sign_extension) as i64
-            } else {
-                // Positive value
-                masked_value as i64
-            }
-        } else {
-            raw_value as i64
-        };
-
-        if store_as_float {
-            let physical_value = (signed_value as f64) * factor + offset;
-            data_store.push_float(signal_name, msg_timestamp, physical_value);
-        } else {
-            let physical_value = (factor as i64) * signed_value + (offset as i64);
-            data_store.push_int(signal_name, msg_timestamp, physical_value);
-        }
-    } else {
-        if store_as_float {
-            let physical_value = (raw_value as f64) * factor + offset;
-            data_store.push_float(signal_name, msg_timestamp, physical_value);
-        } else {
-            let physical_value = (factor as u64) * raw_value + (offset as u64);
-            data_store.push_uint(signal_name, msg_timestamp, physical_value);
-        }
-    }
-}
+impl CompiledDbcs {
+    fn new(dbcs: &[Vec<DBC>]) -> Self {
+        // Init data store
+        let mut data_store = DataStore::new();
 
-fn process_file(file_path: &str, dbcs: &[Vec<DBC>]) {
-    // File names
-    let blf_file = file_path.to_owned() + ".blf";
-    let output_file = file_path.to_owned() + ".mf4";
+        // Register the signals of every message with their units and value tables.
+        // A signal name is only decoded on the first bus it is found on, to avoid duplicates.
+        let mut signal_bus_map: HashMap<String, u32> = HashMap::new();
+        for (bus_idx, bus_dbcs) in dbcs.iter().enumerate() {
+            // Iterate over all dbcs for this bus
+            for dbc in bus_dbcs {
+                // Iterate over all messages in dbc
+                for msg in dbc.messages() {
+                    let source = SignalSource {
+                        bus: bus_idx as u8,
+                        message_id: msg.message_id().raw(),
+                        message_name: msg.message_name().clone(),
+                    };
+
+                    // Iterate over all signals in this message
+                    for sig in msg.signals() {
+                        if *signal_bus_map.entry(sig.name().clone()).or_insert(bus_idx as u32) != bus_idx as u32 {
+                            continue;
+                        }
 
-    // Init data store
-    let mut data_store = DataStore::new();
-
-    // Create message ID to DBC message map for each bus
-    // Create message ID to DBC map for each bus
-    // Add all signal units to data store
-    let mut dbc_messages_maps = Vec::<HashMap<u32, &can_dbc::Message>>::new();
-    let mut dbc_map: Vec<HashMap<u32, &DBC>> = Vec::<HashMap<u32, &DBC>>::new();
-    let mut signal_bus_map: HashMap<String, u32> = HashMap::new();
-    for (bus_idx, bus_dbcs) in dbcs.iter().enumerate() {
-        let mut bus_dbc_messages_map = HashMap::<u32, &can_dbc::Message>::new();
-        let mut bus_dbc_map = HashMap::<u32, &DBC>::new();
-
-        // Iterate over all dbcs for this bus
-        for dbc in bus_dbcs {
-            // Iterate over all messages in dbc
-            for msg in dbc.messages() {
-                let msg_id = msg.message_id().raw();
-                bus_dbc_messages_map.insert(msg_id, msg);
-                bus_dbc_map.insert(msg_id, dbc);
-
-                // Iterate over all signals in this message
-                for sig in msg.signals() {
-                    data_store.set_unit(sig.name(), sig.unit());
-                    
-                    if !signal_bus_map.contains_key(sig.name()) {
-                        signal_bus_map.insert(sig.name().clone(), bus_idx as u32);
+                        // A signal name used by several messages gets a column per message
+                        let id = data_store.register(sig.name(), Some(&source));
+                        data_store.set_unit(id, sig.unit());
 
                         match dbc.value_descriptions_for_signal(*msg.message_id(), sig.name()) {
                             Some(value_table) => {
@@ -194,7 +76,7 @@ fn process_file(file_path: &str, dbcs: &[Vec<DBC>]) {
                                 for val_desc in value_table {
                                     table.insert(*val_desc.a() as i64, val_desc.b().clone());
                                 }
-                                data_store.set_value_table(sig.name(), table);
+                                data_store.set_value_table(id, table);
                             },
                             None => {}
                         }
@@ -202,154 +84,136 @@ fn process_file(file_path: &str, dbcs: &[Vec<DBC>]) {
                 }
             }
         }
-        
-        dbc_messages_maps.push(bus_dbc_messages_map);
-        dbc_map.push(bus_dbc_map);
+
+        // Compile the decode plans of all messages once, the frames only look up their plan
+        let decode_table = DecodeTable::new(dbcs, &signal_bus_map, &mut data_store);
+
+        Self { bus_count: dbcs.len(), data_store, decode_table }
     }
+}
 
-    // Init signal to bus map to avoid duplicates
+/// Estimated peak memory of converting a BLF file. The decoded samples take about twice the
+/// uncompressed size of the file, if the header doesn't have it a compression ratio of 4 is assumed.
+fn estimate_memory(blf_file: &str) -> u64 {
+    let uncompressed_size = BlfReader::new(blf_file).map_or(0, |reader| reader.uncompressed_size());
+    if uncompressed_size > 0 {
+        return 2 * uncompressed_size;
+    }
+    fs::metadata(blf_file).map_or(0, |metadata| 8 * metadata.len())
+}
+
+/// Convert one BLF file, returns the number of messages that couldn't be read
+fn process_file(
+    file_path: &str,
+    compiled: &CompiledDbcs,
+    decompression_threads: usize,
+    decode_threads: usize,
+    mdf_writer: &mut MdfWriter,
+) -> Result<u64> {
+    // File names
+    let blf_file = file_path.to_owned() + ".blf";
+    let output_file = file_path.to_owned() + ".mf4";
+    let start = Instant::now();
+
+    // Every file decodes into its own copy of the registered signals
+    let mut data_store = compiled.data_store.clone();
+    let decode_table = &compiled.decode_table;
 
     // Start reading BLF file
-    let mut reader = match BlfReader::new(&blf_file) {
-        Ok(reader) => reader,
-        Err(e) => {
-            eprintln!("Error opening BLF file {file_path}: {}", e);
-            return;
-        }
-    };
+    let mut reader = BlfReader::new(&blf_file).map_err(|e| anyhow!("Error opening BLF file {file_path}: {}", e))?;
+    reader.set_decompression_threads(decompression_threads);
 
     // Init first timestamp
     let mut first_timestamp = f64::MAX;
+    let mut decoded_frames = 0u64;
+    let mut read_errors = 0u64;
 
     // Iterate over all messages in blf file
     println!("Reading BLF file: {}", &blf_file);
-    'message_loop: for msg_result in tqdm(reader.messages()) {
-        // Get raw can message
-        let msg = match msg_result {
-            Ok(msg) => msg,
-            Err(e) => {
-                eprintln!("Error reading message: {}", e);
-                continue 'message_loop;
-            }
-        };
-
-        // Get bus DBCs
-        let bus_idx = msg.channel as usize;
-        if bus_idx >= dbcs.len() {
-            continue 'message_loop;
-        }
-        let bus_dbcs = &dbcs[bus_idx];
-        let msg_id = msg.arbitration_id;
-
-        // Get timestamp
-        let mut msg_timestamp = msg.timestamp;
-        if first_timestamp == f64::MAX {
-            first_timestamp = msg_timestamp;
-        }
-        msg_timestamp -= first_timestamp;
-
-        // Get dbc for message
-        let dbc_msg: &Message = match dbc_messages_maps[bus_idx].get(&msg_id) {
-            Some(msg) => msg,
-            None => continue 'message_loop
-        };
-
-        // Get message raw data
-        let msg_data = msg.data;
-
-        // Get mux signal
-        let dbc = dbc_map[bus_idx].get(&msg_id).unwrap();
-        let mux_signal = dbc.message_multiplexor_switch(*dbc_msg.message_id());
-        let current_mux_value = match mux_signal {
-            Ok(Some(mux_signal)) => {
-                let start_bit = *mux_signal.start_bit() as i64;
-                let bit_count = *mux_signal.signal_size() as i64;
-                let is_big_endian = *mux_signal.byte_order() == ByteOrder::BigEndian;
-                match extract_signal_raw(
-                        &msg_data, start_bit, bit_count, is_big_endian) {
-                    Some(v) => v,
-                    None => {
-                        continue 'message_loop;
-                    }
+    let read_start = Instant::now();
+    thread::scope(|scope| {
+        // With several decode threads the messages are partitioned over them by arbitration id
+        let mut sharded_decoder = (decode_threads > 1).then(|| ShardedDecoder::new(scope, decode_threads, &data_store, decode_table));
+
+        'message_loop: for msg_result in tqdm(reader.messages()) {
+            // Get raw can message
+            let msg = match msg_result {
+                Ok(msg) => msg,
+                Err(e) => {
+                    eprintln!("Error reading message of {}: {}", blf_file, e);
+                    read_errors += 1;
+                    continue 'message_loop;
                 }
-            },
-            Ok(None) => 0,
-            Err(_) => {
+            };
+
+            // Skip busses without DBCs
+            let bus_idx = msg.channel as usize;
+            if bus_idx >= compiled.bus_count {
                 continue 'message_loop;
             }
-        };
 
-        // Iterate over all signals in message
-        'signal_loop: for signal in dbc_msg.signals() {
-            // Check if we want to skip because signal name already found on another bus
-            if let Some(signal_bus_idx) = signal_bus_map.get(signal.name()) {
-                if bus_idx != *signal_bus_idx as usize {
-                    continue 'signal_loop;
-                }
+            // Get timestamp
+            let mut msg_timestamp = msg.timestamp;
+            if first_timestamp == f64::MAX {
+                first_timestamp = msg_timestamp;
             }
-            
-            // Check if float or signed
-            let mut is_float = false;
-            for dbc in bus_dbcs {
-                if let Some(v) = dbc.extended_value_type_for_signal(
-                        *dbc_msg.message_id(), signal.name()) {
-                    if *v != SignalExtendedValueType::SignedOrUnsignedInteger {
-                        is_float = true;
-                        break;
-                    }
-                }
-            }
-            let is_signed = *signal.value_type() == ValueType::Signed;
-
-            // Skip if float
-            if is_float {
-                continue 'signal_loop;
+            msg_timestamp -= first_timestamp;
+
+            // Get decode plan for message
+            let plan = match decode_table.get(bus_idx, msg.arbitration_id) {
+                Some(plan) => plan,
+                None => continue 'message_loop
+            };
+
+            // Decode all signals of the message
+            match &mut sharded_decoder {
+                Some(sharded_decoder) => sharded_decoder.decode(bus_idx, msg.arbitration_id, msg.payload(), msg_timestamp, plan),
+                None => decode_message(msg.payload(), msg_timestamp, plan, &mut data_store),
             }
+            decoded_frames += 1;
+        }
 
-            // Get signal info
-            let start_bit = *signal.start_bit() as i64;
-            let bit_count = *signal.signal_size() as i64;
-            let is_big_endian = *signal.byte_order() == ByteOrder::BigEndian;
-
-            let factor = *signal.factor();
-            let offset = *signal.offset();
-            let store_as_float = is_float || (factor.fract() != 0.0) || (offset.fract() != 0.0);
-
-            match signal.multiplexer_indicator() {
-                can_dbc::MultiplexIndicator::Plain | can_dbc::MultiplexIndicator::Multiplexor => {
-                    process_signal(
-                        &msg_data, start_bit, bit_count, is_big_endian, is_signed, store_as_float, 
-                        factor, offset, signal.name(), msg_timestamp, &mut data_store);
-                },
-                can_dbc::MultiplexIndicator::MultiplexedSignal(mux_idx) => {
-                    if *mux_idx == current_mux_value {
-                        process_signal(
-                            &msg_data, start_bit, bit_count, is_big_endian, is_signed, store_as_float, 
-                            factor, offset, signal.name(), msg_timestamp, &mut data_store);
-                    }
-                },
-                mux_ind => {
-                    println!("Can't handle MultiplexIndicator {:?}", mux_ind);
-                    continue 'signal_loop;
-                }
-            }
+        if let Some(sharded_decoder) = sharded_decoder {
+            sharded_decoder.finish(&mut data_store);
+        }
+    });
+    let read_time = read_start.elapsed();
+
+    println!("{} signals found in {}", data_store.signal_count(), blf_file);
+
+    let sort_start = Instant::now();
+    data_store.sort_by_timestamp();
+    let sort_time = sort_start.elapsed();
+
+    let write_start = Instant::now();
+    mdf_writer.write(&output_file, &mut data_store).map_err(|e| anyhow!("Failed to write {}: {}", output_file, e))?;
+    let stream_write_time = write_start.elapsed();
+
+    if mdf_writer.reports() {
+        // Decoding is the loop time the reader didn't spend waiting for containers and parsing them
+        let stats = reader.stats();
+        let report = ConversionReport {
+            blf_file,
+            blf_bytes: stats.bytes_read,
+            containers: stats.containers,
+            frames: stats.frames,
+            decoded_frames,
+            signals: data_store.signal_count(),
+            samples: data_store.sample_count(),
+            decompress_time: stats.decompress_time,
+            read_wait_time: stats.wait_time,
+            parse_time: stats.parse_time,
+            decode_time: read_time.saturating_sub(stats.wait_time + stats.parse_time),
+            sort_time,
+            stream_write_time,
+            total_time: start.elapsed(),
+            peak_rss_bytes: report::peak_rss_bytes(),
         };
+        if let Err(e) = mdf_writer.send_report(&report) {
+            println!("Failed to send the conversion report of {}: {}", output_file, e);
+        }
     }
-
-    println!("{} signals found", data_store.signal_count());
-
-    let mut child = std::process::Command::new("python")
-        .arg("-c")
-        .arg(PYTHON_CODE)
-        .arg(&output_file)
-        .stdin(Stdio::piped())
-        .spawn()
-        .expect("Failed to spawn python process");
-
-    if let Some(stdin) = child.stdin.take() {
-        data_store.write_to_stream(stdin).unwrap();
-    }
-    child.wait().expect("Failed to wait on child process");
+    Ok(read_errors)
 }
 
 fn main() {
@@ -405,8 +269,92 @@ fn main() {
         return;
     }
 
-    for entry in blf_files {
-        let path = entry.as_path();
-        process_file(path.with_extension("").to_str().unwrap(), &dbcs);
+    // Number of files converted at the same time, and the memory they may take together
+    let jobs = match env::var("BLF2MDF_JOBS") {
+        Ok(jobs) => jobs.parse::<usize>().ok().filter(|jobs| *jobs > 0).unwrap_or_else(|| {
+            println!("Invalid BLF2MDF_JOBS {}, expected a number greater than 0", jobs);
+            std::process::exit(1);
+        }),
+        Err(_) => 1,
+    }.min(blf_files.len());
+    let memory_budget = match env::var("BLF2MDF_MEMORY_BUDGET") {
+        Ok(budget) => batch::parse_size(&budget).unwrap_or_else(|| {
+            println!("Invalid BLF2MDF_MEMORY_BUDGET {}, expected a size like 8G", budget);
+            std::process::exit(1);
+        }),
+        Err(_) => u64::MAX,
+    };
+    // Threads decoding the signals of one file
+    let decode_threads = match env::var("BLF2MDF_DECODE_THREADS") {
+        Ok(threads) => threads.parse::<usize>().ok().filter(|threads| *threads > 0).unwrap_or_else(|| {
+            println!("Invalid BLF2MDF_DECODE_THREADS {}, expected a number greater than 0", threads);
+            std::process::exit(1);
+        }),
+        Err(_) => 1,
+    };
+
+    // The cores are shared by all files, the cores of a file not taken by its decode threads decompress
+    let cores = thread::available_parallelism().map_or(1, |cores| cores.get());
+    let sharded_decode_threads = if decode_threads > 1 { decode_threads } else { 0 };
+    let decompression_threads = (cores / jobs).saturating_sub(sharded_decode_threads).max(1);
+
+    let compiled = CompiledDbcs::new(&dbcs);
+    let file_paths: Vec<String> = blf_files
+        .iter()
+        .map(|entry| entry.as_path().with_extension("").to_str().unwrap().to_owned())
+        .collect();
+    let memory_estimates: Vec<u64> = file_paths.iter().map(|path| estimate_memory(&(path.to_owned() + ".blf"))).collect();
+    let scheduler = BatchScheduler::new(&memory_estimates, memory_budget);
+
+    // Start one MF4 writer per conversion thread, it converts all files of the thread
+    let mdf_writers: Vec<MdfWriter> = (0..jobs)
+        .map(|_| MdfWriter::spawn().unwrap_or_else(|e| {
+            println!("{}", e);
+            std::process::exit(1);
+        }))
+        .collect();
+
+    let mut results: Vec<(usize, Result<u64>)> = thread::scope(|scope| {
+        let threads: Vec<_> = mdf_writers
+            .into_iter()
+            .map(|mut mdf_writer| {
+                let (compiled, scheduler, file_paths) = (&compiled, &scheduler, &file_paths);
+                scope.spawn(move || {
+                    let mut results = Vec::new();
+                    // Index in results of every file sent to the writer, in the order they were sent
+                    let mut written = Vec::new();
+                    while let Some(file) = scheduler.next_file() {
+                        let result = process_file(&file_paths[file.index], compiled, decompression_threads, decode_threads, &mut mdf_writer);
+                        match &result {
+                            Ok(_) => written.push(results.len()),
+                            Err(e) => println!("{}", e),
+                        }
+                        results.push((file.index, result));
+                    }
+
+                    // A file is only converted once the writer wrote its MF4 file
+                    for (result_idx, job_result) in written.into_iter().zip(mdf_writer.finish()) {
+                        if let Err(e) = job_result {
+                            println!("{}", e);
+                            results[result_idx].1 = Err(e);
+                        }
+                    }
+                    results
+                })
+            })
+            .collect();
+        threads.into_iter().flat_map(|thread| thread.join().unwrap()).collect()
+    });
+
+    // Outcome of every file, in the order they were selected
+    results.sort_by_key(|(index, _)| *index);
+    let converted = results.iter().filter(|(_, result)| result.is_ok()).count();
+    println!("Converted {} of {} files", converted, results.len());
+    for (index, result) in &results {
+        match result {
+            Ok(0) => {},
+            Ok(read_errors) => println!("  {}.blf: {} messages couldn't be read", file_paths[*index], read_errors),
+            Err(e) => println!("  {}", e),
+        }
     }
 }
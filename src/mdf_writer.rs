@@ -0,0 +1,274 @@
+use std::collections::VecDeque;
+use std::env;
+use std::fs::{self, File};
+use std::io::{Read, Write};
+use std::path::PathBuf;
+use std::process::{Child, ChildStdin, ChildStdout, Command, ExitStatus, Stdio};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::mpsc::{self, Receiver, Sender};
+use std::thread;
+use anyhow::{anyhow, Result};
+
+use crate::data_store::DataStore;
+use crate::report::ConversionReport;
+
+const PYTHON_CODE: &str = include_str!("../script/write_mdf.py");
+
+/// Python MF4 writer, started once per conversion thread (see BLF2MDF_JOBS) to convert all files of that thread.
+/// Every job is framed as a u16 length prefixed output path followed by the binary signal stream.
+/// With BLF2MDF_TRANSPORT=shm the stream is written to a shared memory file instead and only a
+/// manifest with its path is sent, the writer maps the file and removes it. If the job fails before,
+/// the file is removed once the job is answered or the writer exited.
+/// With BLF2MDF_KEEP_STREAM=1 the stream is kept next to the output file (.blf2mdf) and sent the same way,
+/// so the MF4 stage can be run again with `write_mdf.py <output> --input <stream>`.
+/// With BLF2MDF_REPORT=1 every job ends with a u32 length prefixed JSON conversion report,
+/// the writer completes it with its own stages and writes it to `<output>.report.json`.
+/// The writer answers every job on its stdout with a status byte (0 = written, 1 = failed) and a u32 length
+/// prefixed error message. A failed job doesn't stop the writer, a writer that exited is started again
+/// for the next job and its unanswered jobs count as failed.
+pub struct MdfWriter {
+    child: Child,
+    stdin: Option<ChildStdin>,
+    statuses: Receiver<JobStatus>,
+    // Jobs sent to the running writer without a status yet, oldest first
+    pending: VecDeque<PendingJob>,
+    // Outcome of every answered job, in the order they were written
+    results: Vec<Result<()>>,
+    writer_args: Vec<String>,
+    shm_dir: Option<PathBuf>,
+    keep_stream: bool,
+    report: bool,
+}
+
+// Outcome of a job as sent by the writer, the error message if it failed
+type JobStatus = std::result::Result<(), String>;
+
+/// Job sent to the writer, its shared memory stream file is removed when the job is dropped
+struct PendingJob {
+    output_file: String,
+    _stream_file: Option<StreamFile>,
+}
+
+/// Shared memory stream file, removed on drop. The writer removes it as soon as it is mapped,
+/// this only removes it if the writer didn't get that far.
+struct StreamFile(PathBuf);
+
+impl Drop for StreamFile {
+    fn drop(&mut self) {
+        let _ = fs::remove_file(&self.0);
+    }
+}
+
+// Manifest flag: the writer removes the stream file once it is mapped
+const MANIFEST_REMOVE_FILE: u8 = 0x01;
+
+// Number of the next shared memory stream file, counted over all writers of the process
+static NEXT_STREAM_FILE: AtomicUsize = AtomicUsize::new(1);
+
+impl MdfWriter {
+    pub fn spawn() -> Result<Self> {
+        // Transport of the signal streams, shared memory files avoid copying every sample through the pipe
+        let shm_dir = match env::var("BLF2MDF_TRANSPORT").as_deref() {
+            Ok("shm") => {
+                let dev_shm = PathBuf::from("/dev/shm");
+                Some(if dev_shm.is_dir() { dev_shm } else { env::temp_dir() })
+            },
+            Ok("pipe") | Err(_) => None,
+            Ok(transport) => return Err(anyhow!("Unknown BLF2MDF_TRANSPORT {}, expected pipe or shm", transport)),
+        };
+
+        // Extra writer options, e.g. BLF2MDF_WRITER_ARGS="--stream"
+        let writer_args: Vec<String> = env::var("BLF2MDF_WRITER_ARGS")
+            .map(|args| args.split_whitespace().map(String::from).collect())
+            .unwrap_or_default();
+
+        let report = env::var("BLF2MDF_REPORT").is_ok_and(|report| report == "1");
+        let keep_stream = env::var("BLF2MDF_KEEP_STREAM").is_ok_and(|keep| keep == "1");
+
+        let (child, stdin, statuses) = Self::start_process(&writer_args, report)?;
+        Ok(Self {
+            child,
+            stdin: Some(stdin),
+            statuses,
+            pending: VecDeque::new(),
+            results: Vec::new(),
+            writer_args,
+            shm_dir,
+            keep_stream,
+            report,
+        })
+    }
+
+    fn start_process(writer_args: &[String], report: bool) -> Result<(Child, ChildStdin, Receiver<JobStatus>)> {
+        let mut child = Command::new("python")
+            .arg("-c")
+            .arg(PYTHON_CODE)
+            .arg("--worker")
+            .args(report.then_some("--report"))
+            .args(writer_args)
+            .stdin(Stdio::piped())
+            .stdout(Stdio::piped())
+            .spawn()
+            .map_err(|e| anyhow!("Failed to spawn python process: {}", e))?;
+        let stdin = child.stdin.take().ok_or_else(|| anyhow!("Failed to open the stdin of the MDF writer"))?;
+        let stdout = child.stdout.take().ok_or_else(|| anyhow!("Failed to open the stdout of the MDF writer"))?;
+
+        // The statuses are read in the background, so sending the next job doesn't wait for the MF4 file
+        let (sender, statuses) = mpsc::channel();
+        thread::spawn(move || read_statuses(stdout, sender));
+        Ok((child, stdin, statuses))
+    }
+
+    /// Replace a writer that exited, failing the jobs it didn't answer
+    fn restart(&mut self) -> Result<()> {
+        drop(self.stdin.take());
+        let exit_status = self.child.wait();
+        self.close_jobs(exit_status);
+
+        let (child, stdin, statuses) = Self::start_process(&self.writer_args, self.report)?;
+        self.child = child;
+        self.stdin = Some(stdin);
+        self.statuses = statuses;
+        Ok(())
+    }
+
+    fn answer_job(&mut self, status: JobStatus) {
+        if let Some(job) = self.pending.pop_front() {
+            self.results.push(status.map_err(|e| anyhow!("Failed to write {}: {}", job.output_file, e)));
+        }
+    }
+
+    /// Take the statuses of the exited writer and fail its remaining jobs
+    fn close_jobs(&mut self, exit_status: std::io::Result<ExitStatus>) {
+        // The status reader ends once the writer closed its stdout
+        while let Ok(status) = self.statuses.recv() {
+            self.answer_job(status);
+        }
+        let exit_status = match exit_status {
+            Ok(exit_status) => exit_status.to_string(),
+            Err(e) => e.to_string(),
+        };
+        for job in self.pending.drain(..) {
+            self.results.push(Err(anyhow!("Failed to write {}: MDF writer exited with {}", job.output_file, exit_status)));
+        }
+    }
+
+    pub fn write(&mut self, output_file: &str, data_store: &mut DataStore) -> Result<()> {
+        while let Ok(status) = self.statuses.try_recv() {
+            self.answer_job(status);
+        }
+        if self.stdin.is_none() || self.child.try_wait()?.is_some() {
+            self.restart()?;
+        }
+
+        // Write the stream to a file first, so a failure doesn't leave a half sent job
+        let stream_file = if self.keep_stream {
+            Some((PathBuf::from(output_file).with_extension("blf2mdf"), 0))
+        } else {
+            self.shm_dir.as_ref().map(|shm_dir| {
+                let stream_number = NEXT_STREAM_FILE.fetch_add(1, Ordering::Relaxed);
+                let shm_path = shm_dir.join(format!("blf2mdf-{}-{}.bin", std::process::id(), stream_number));
+                (shm_path, MANIFEST_REMOVE_FILE)
+            })
+        };
+        let shm_file = match &stream_file {
+            Some((stream_path, MANIFEST_REMOVE_FILE)) => Some(StreamFile(stream_path.clone())),
+            _ => None,
+        };
+        if let Some((stream_path, _)) = &stream_file {
+            let stream_result = File::create(stream_path)
+                .map_err(|e| anyhow!("Failed to create {}: {}", stream_path.display(), e))
+                .and_then(|file| data_store.write_to_stream(file).map_err(|e| anyhow!("Failed to write signal stream: {}", e)));
+            if let Err(e) = stream_result {
+                let _ = fs::remove_file(stream_path);
+                return Err(e);
+            }
+        }
+
+        let Some(stdin) = self.stdin.as_mut() else {
+            return Err(anyhow!("MDF writer is already finished"));
+        };
+        let sent = Self::send_job(stdin, output_file, data_store, &stream_file);
+        if let Err(e) = sent {
+            // The job is incomplete, the writer can't read the following jobs anymore and is replaced
+            self.stdin = None;
+            return Err(e);
+        }
+        self.pending.push_back(PendingJob { output_file: output_file.to_owned(), _stream_file: shm_file });
+        Ok(())
+    }
+
+    fn send_job(stdin: &mut ChildStdin, output_file: &str, data_store: &mut DataStore, stream_file: &Option<(PathBuf, u8)>) -> Result<()> {
+        // Write job header
+        let path_bytes = output_file.as_bytes();
+        stdin.write_all(&(path_bytes.len() as u16).to_le_bytes())?;
+        stdin.write_all(path_bytes)?;
+
+        let Some((stream_path, flags)) = stream_file else {
+            return data_store.write_to_stream(&mut *stdin).map_err(|e| anyhow!("Failed to write signal stream: {}", e));
+        };
+
+        // Write manifest
+        let stream_path_str = stream_path.to_string_lossy();
+        let stream_path_bytes = stream_path_str.as_bytes();
+        stdin.write_all(b"BLF2MDFM")?;
+        stdin.write_all(&[*flags])?;
+        stdin.write_all(&(stream_path_bytes.len() as u16).to_le_bytes())?;
+        stdin.write_all(stream_path_bytes)?;
+        stdin.flush()?;
+        Ok(())
+    }
+
+    /// Whether the jobs end with a conversion report, see send_report
+    pub fn reports(&self) -> bool {
+        self.report
+    }
+
+    /// Complete the last written job with its conversion report, does nothing without BLF2MDF_REPORT=1
+    pub fn send_report(&mut self, report: &ConversionReport) -> Result<()> {
+        if !self.report {
+            return Ok(());
+        }
+        let stdin = self.stdin.as_mut().ok_or_else(|| anyhow!("MDF writer is already finished"))?;
+        let json = report.to_json();
+        let sent = stdin.write_all(&(json.len() as u32).to_le_bytes())
+            .and_then(|_| stdin.write_all(json.as_bytes()))
+            .and_then(|_| stdin.flush());
+        if let Err(e) = sent {
+            // The job is incomplete, see write
+            self.stdin = None;
+            return Err(e.into());
+        }
+        Ok(())
+    }
+
+    /// Close the job pipe, wait until the writer has finished all files and return the outcome
+    /// of every job, in the order they were written.
+    pub fn finish(mut self) -> Vec<Result<()>> {
+        drop(self.stdin.take());
+        let exit_status = self.child.wait();
+        self.close_jobs(exit_status);
+        self.results
+    }
+}
+
+/// Read the job statuses of a writer until it closes its stdout
+fn read_statuses(mut stdout: ChildStdout, sender: Sender<JobStatus>) {
+    loop {
+        let mut header = [0u8; 5];
+        if stdout.read_exact(&mut header).is_err() {
+            return;
+        }
+        let mut message = vec![0u8; u32::from_le_bytes(header[1..5].try_into().unwrap()) as usize];
+        if stdout.read_exact(&mut message).is_err() {
+            return;
+        }
+        let status = match header[0] {
+            0 => Ok(()),
+            _ => Err(String::from_utf8_lossy(&message).into_owned()),
+        };
+        if sender.send(status).is_err() {
+            return;
+        }
+    }
+}
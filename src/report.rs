@@ -0,0 +1,95 @@
+use std::fmt::Write;
+use std::fs;
+use std::time::Duration;
+
+/// Converter side of the per-file conversion report (BLF2MDF_REPORT=1).
+/// It is sent to the MF4 writer after the job's stream, the writer adds its own stages and
+/// writes both to `<output>.report.json`.
+#[derive(Debug, Clone, Default)]
+pub struct ConversionReport {
+    pub blf_file: String,
+    pub blf_bytes: u64,
+    pub containers: u64,
+    /// CAN frames read from the BLF file
+    pub frames: u64,
+    /// Frames with a DBC message on their bus
+    pub decoded_frames: u64,
+    pub signals: usize,
+    pub samples: usize,
+    /// Summed over the decompression threads
+    pub decompress_time: Duration,
+    /// Time the decode loop waited for containers to be read and inflated
+    pub read_wait_time: Duration,
+    pub parse_time: Duration,
+    pub decode_time: Duration,
+    pub sort_time: Duration,
+    pub stream_write_time: Duration,
+    pub total_time: Duration,
+    pub peak_rss_bytes: Option<u64>,
+}
+
+impl ConversionReport {
+    pub fn to_json(&self) -> String {
+        let total = self.total_time.as_secs_f64();
+        let per_second = |count: f64| if total > 0.0 { count / total } else { 0.0 };
+
+        let mut json = String::new();
+        json.push('{');
+        write!(json, "\"blf_file\": {}, ", json_string(&self.blf_file)).unwrap();
+        write!(json, "\"blf_bytes\": {}, ", self.blf_bytes).unwrap();
+        write!(json, "\"containers\": {}, ", self.containers).unwrap();
+        write!(json, "\"frames\": {}, ", self.frames).unwrap();
+        write!(json, "\"decoded_frames\": {}, ", self.decoded_frames).unwrap();
+        write!(json, "\"signals\": {}, ", self.signals).unwrap();
+        write!(json, "\"samples\": {}, ", self.samples).unwrap();
+
+        json.push_str("\"stages\": {");
+        let stages = [
+            ("decompress", self.decompress_time),
+            ("read_wait", self.read_wait_time),
+            ("container_parse", self.parse_time),
+            ("signal_decode", self.decode_time),
+            ("sort", self.sort_time),
+            ("stream_write", self.stream_write_time),
+        ];
+        for (idx, (stage, time)) in stages.iter().enumerate() {
+            let separator = if idx + 1 < stages.len() { ", " } else { "" };
+            write!(json, "\"{}\": {{\"seconds\": {}}}{}", stage, time.as_secs_f64(), separator).unwrap();
+        }
+        json.push_str("}, ");
+
+        write!(json, "\"total_seconds\": {}, ", total).unwrap();
+        write!(json, "\"blf_mb_per_s\": {}, ", per_second(self.blf_bytes as f64 / 1e6)).unwrap();
+        write!(json, "\"frames_per_s\": {}, ", per_second(self.frames as f64)).unwrap();
+        write!(json, "\"samples_per_s\": {}, ", per_second(self.samples as f64)).unwrap();
+        match self.peak_rss_bytes {
+            Some(bytes) => write!(json, "\"peak_rss_bytes\": {}", bytes).unwrap(),
+            None => json.push_str("\"peak_rss_bytes\": null"),
+        }
+        json.push('}');
+        json
+    }
+}
+
+fn json_string(value: &str) -> String {
+    let mut json = String::with_capacity(value.len() + 2);
+    json.push('"');
+    for c in value.chars() {
+        match c {
+            '"' => json.push_str("\\\""),
+            '\\' => json.push_str("\\\\"),
+            c if (c as u32) < 0x20 => write!(json, "\\u{:04x}", c as u32).unwrap(),
+            c => json.push(c),
+        }
+    }
+    json.push('"');
+    json
+}
+
+/// Peak resident set size of this process so far (VmHWM, Linux only)
+pub fn peak_rss_bytes() -> Option<u64> {
+    let status = fs::read_to_string("/proc/self/status").ok()?;
+    let line = status.lines().find(|line| line.starts_with("VmHWM:"))?;
+    let kilobytes: u64 = line.split_whitespace().nth(1)?.parse().ok()?;
+    Some(kilobytes * 1024)
+}
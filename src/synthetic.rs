@@ -0,0 +1,419 @@
+//! Synthetic CAN data for benchmarks and load tests: DBC definitions, frame payloads, BLF objects
+//! and whole BLF files (see the blf_gen binary).
+//! Everything is deterministic, the same arguments always give the same bytes.
+
+use std::cmp::Reverse;
+use std::collections::BinaryHeap;
+use std::fmt::Write as _;
+use std::io::{self, Seek, SeekFrom, Write};
+use flate2::Compression;
+use flate2::write::ZlibEncoder;
+
+// Object types and flags written by the generator, see blf_reader
+pub const CAN_MESSAGE: u32 = 1;
+pub const CAN_MESSAGE2: u32 = 86;
+pub const CAN_ERROR_EXT: u32 = 73;
+const LOG_CONTAINER: u32 = 10;
+
+const OBJ_HEADER_BASE_SIZE: u16 = 16;
+const OBJ_HEADER_V1_SIZE: u16 = 32;
+const TIME_ONE_NANS: u32 = 0x00000002;
+
+const NO_COMPRESSION: u16 = 0;
+const ZLIB_DEFLATE: u16 = 2;
+
+pub const FILE_HEADER_SIZE: usize = 144;
+
+/// Signal layouts of the generated messages, message i uses LAYOUTS[i % LAYOUTS.len()]
+pub const LAYOUTS: [&str; 4] = ["intel", "motorola", "multiplexed", "wide"];
+
+/// Number of multiplexor values used by the multiplexed layout
+pub const MUX_VALUES: u64 = 3;
+
+pub fn message_id(message_idx: usize) -> u32 {
+    0x100 + message_idx as u32
+}
+
+pub fn message_layout(message_idx: usize) -> &'static str {
+    LAYOUTS[message_idx % LAYOUTS.len()]
+}
+
+/// Signal lines (name, multiplexer indicator, start bit, size, byte order, sign, factor, offset, unit) of a layout
+fn layout_signals(layout: &str) -> &'static [(&'static str, &'static str, u32, u32, u8, char, f64, f64, &'static str)] {
+    match layout {
+        "intel" => &[
+            ("IntelU16", "", 0, 16, 1, '+', 0.01, 0.0, "km/h"),
+            ("IntelS12", "", 16, 12, 1, '-', 1.0, -40.0, "degC"),
+            ("IntelU4", "", 28, 4, 1, '+', 1.0, 0.0, ""),
+            ("IntelU1", "", 32, 1, 1, '+', 1.0, 0.0, ""),
+            ("IntelS16", "", 40, 16, 1, '-', 0.5, 0.0, "Nm"),
+            ("IntelU8", "", 56, 8, 1, '+', 1.0, 0.0, ""),
+        ],
+        "motorola" => &[
+            ("MotorolaU16", "", 23, 16, 0, '+', 1.0, 0.0, "rpm"),
+            ("MotorolaS12", "", 35, 12, 0, '-', 0.1, 0.0, "bar"),
+            ("MotorolaU4", "", 43, 4, 0, '+', 1.0, 0.0, ""),
+            ("MotorolaU16B", "", 63, 16, 0, '+', 1.0, 0.0, ""),
+        ],
+        "multiplexed" => &[
+            ("Mux", "M", 0, 8, 1, '+', 1.0, 0.0, ""),
+            ("Mux0U16", "m0", 8, 16, 1, '+', 1.0, 0.0, ""),
+            ("Mux0S16", "m0", 24, 16, 1, '-', 1.0, 0.0, ""),
+            ("Mux1U32", "m1", 8, 32, 1, '+', 1.0, 0.0, ""),
+            ("Mux2U24", "m2", 31, 24, 0, '+', 1.0, 0.0, ""),
+            ("MuxCounter", "", 56, 8, 1, '+', 1.0, 0.0, ""),
+        ],
+        "wide" => &[
+            ("IntelU64", "", 0, 64, 1, '+', 1.0, 0.0, ""),
+        ],
+        _ => &[],
+    }
+}
+
+/// Prefix of the message and signal names, signal names have to be unique over all busses
+fn name_prefix(bus: usize, message_idx: usize) -> String {
+    format!("B{}_M{}", bus, message_idx)
+}
+
+/// Signal names of a generated message, in DBC order
+pub fn signal_names(bus: usize, message_idx: usize) -> Vec<String> {
+    layout_signals(message_layout(message_idx))
+        .iter()
+        .map(|signal| format!("{}_{}", name_prefix(bus, message_idx), signal.0))
+        .collect()
+}
+
+/// DBC file content for one bus with `messages` messages, cycling through LAYOUTS.
+/// Counters (U4 and U8 signals) get a value table.
+pub fn dbc_source(bus: usize, messages: usize) -> String {
+    let mut dbc = String::new();
+    dbc.push_str("VERSION \"\"\n\nNS_ :\n\nBS_:\n\nBU_: ECU\n\n");
+
+    let mut value_tables = String::new();
+    for message_idx in 0..messages {
+        let id = message_id(message_idx);
+        let prefix = name_prefix(bus, message_idx);
+        writeln!(dbc, "BO_ {} {}_{}: 8 ECU", id, prefix, message_layout(message_idx)).unwrap();
+        for (name, mux, start_bit, size, byte_order, sign, factor, offset, unit) in layout_signals(message_layout(message_idx)) {
+            let mux = if mux.is_empty() { String::new() } else { format!(" {}", mux) };
+            let (min, max) = signal_range(*size, *sign, *factor, *offset);
+            writeln!(dbc, " SG_ {}_{}{} : {}|{}@{}{} ({},{}) [{}|{}] \"{}\" ECU",
+                prefix, name, mux, start_bit, size, byte_order, sign, factor, offset, min, max, unit).unwrap();
+
+            if name.ends_with("U4") || name.ends_with("U8") {
+                writeln!(value_tables, "VAL_ {} {}_{} 0 \"Off\" 1 \"On\" 2 \"Error\" ;", id, prefix, name).unwrap();
+            }
+        }
+        dbc.push('\n');
+    }
+    dbc.push_str(&value_tables);
+    dbc
+}
+
+fn signal_range(size: u32, sign: char, factor: f64, offset: f64) -> (f64, f64) {
+    let (raw_min, raw_max) = if sign == '-' {
+        (-(2f64.powi(size as i32 - 1)), 2f64.powi(size as i32 - 1) - 1.0)
+    } else {
+        (0.0, 2f64.powi(size as i32) - 1.0)
+    };
+    // Rounded to keep the DBC free of float noise like 204.70000000000002
+    let round = |value: f64| (value * 1e6).round() / 1e6;
+    let (a, b) = (round(raw_min * factor + offset), round(raw_max * factor + offset));
+    (a.min(b), a.max(b))
+}
+
+/// Small deterministic random generator (xorshift64*)
+#[derive(Debug, Clone)]
+pub struct Rng(u64);
+
+impl Rng {
+    pub fn new(seed: u64) -> Self {
+        Self(seed.wrapping_mul(0x9E3779B97F4A7C15) | 1)
+    }
+
+    pub fn next_u64(&mut self) -> u64 {
+        self.0 ^= self.0 >> 12;
+        self.0 ^= self.0 << 25;
+        self.0 ^= self.0 >> 27;
+        self.0.wrapping_mul(0x2545F4914F6CDD1D)
+    }
+}
+
+/// Payload of the `frame_idx`-th frame of a message: random bytes, with the multiplexor
+/// of multiplexed messages cycling through its values
+pub fn frame_data(message_idx: usize, frame_idx: u64, rng: &mut Rng) -> [u8; 8] {
+    let mut data = rng.next_u64().to_le_bytes();
+    if message_layout(message_idx) == "multiplexed" {
+        data[0] = (frame_idx % MUX_VALUES) as u8;
+    }
+    data
+}
+
+/// One LOBJ object with a version 1 header (timestamp in nanoseconds) holding a CAN_MESSAGE,
+/// CAN_MESSAGE2 or CAN_ERROR_EXT record. `channel` is 1 based as in BLF files.
+pub fn can_object(object_type: u32, timestamp_ns: u64, channel: u16, id: u32, data: &[u8; 8]) -> Vec<u8> {
+    let mut object = Vec::with_capacity(64);
+    push_can_object(&mut object, object_type, timestamp_ns, channel, id, data);
+    object
+}
+
+/// Append a CAN object (see can_object) to a buffer
+pub fn push_can_object(buffer: &mut Vec<u8>, object_type: u32, timestamp_ns: u64, channel: u16, id: u32, data: &[u8; 8]) {
+    let body_size = match object_type {
+        CAN_ERROR_EXT => 32,
+        CAN_MESSAGE2 => 24,
+        _ => 16,
+    };
+    let object_size = OBJ_HEADER_V1_SIZE as u32 + body_size;
+    buffer.extend_from_slice(b"LOBJ");
+    buffer.extend_from_slice(&OBJ_HEADER_V1_SIZE.to_le_bytes());
+    buffer.extend_from_slice(&1u16.to_le_bytes()); // header version
+    buffer.extend_from_slice(&object_size.to_le_bytes());
+    buffer.extend_from_slice(&object_type.to_le_bytes());
+    buffer.extend_from_slice(&TIME_ONE_NANS.to_le_bytes());
+    buffer.extend_from_slice(&0u16.to_le_bytes()); // client index
+    buffer.extend_from_slice(&0u16.to_le_bytes()); // object version
+    buffer.extend_from_slice(&timestamp_ns.to_le_bytes());
+
+    match object_type {
+        CAN_ERROR_EXT => {
+            // channel, length, flags, ecc, position, dlc, reserved, frame_length, id, flags_ext, reserved, data
+            buffer.extend_from_slice(&channel.to_le_bytes());
+            buffer.extend_from_slice(&0u16.to_le_bytes());
+            buffer.extend_from_slice(&0u32.to_le_bytes());
+            buffer.extend_from_slice(&[0, 0, 8, 0]);
+            buffer.extend_from_slice(&0u32.to_le_bytes());
+            buffer.extend_from_slice(&id.to_le_bytes());
+            buffer.extend_from_slice(&0u16.to_le_bytes());
+            buffer.extend_from_slice(&[0, 0]);
+            buffer.extend_from_slice(data);
+        },
+        _ => {
+            // channel, flags, dlc, id, data
+            buffer.extend_from_slice(&channel.to_le_bytes());
+            buffer.push(0);
+            buffer.push(8);
+            buffer.extend_from_slice(&id.to_le_bytes());
+            buffer.extend_from_slice(data);
+            if object_type == CAN_MESSAGE2 {
+                // frame_length, bit_count, reserved
+                buffer.extend_from_slice(&0u32.to_le_bytes());
+                buffer.extend_from_slice(&[111, 0, 0, 0]);
+            }
+        },
+    }
+}
+
+/// Uncompressed content of a LOG_CONTAINER: `frames` CAN_MESSAGE and CAN_MESSAGE2 objects of
+/// `messages` messages on channel 1, 1 ms apart
+pub fn container_data(messages: usize, frames: u64, seed: u64) -> Vec<u8> {
+    let mut rng = Rng::new(seed);
+    let mut data = Vec::new();
+    for frame_idx in 0..frames {
+        let message_idx = (frame_idx % messages as u64) as usize;
+        let object_type = if frame_idx % 2 == 0 { CAN_MESSAGE } else { CAN_MESSAGE2 };
+        let payload = frame_data(message_idx, frame_idx / messages as u64, &mut rng);
+        push_can_object(&mut data, object_type, frame_idx * 1_000_000, 1, message_id(message_idx), &payload);
+    }
+    data
+}
+
+/// BLF file header (LOGG) with the measurement start 2024-01-01 00:00:00
+pub fn file_header(file_size: u64, uncompressed_size: u64, object_count: u32) -> Vec<u8> {
+    let mut header = Vec::with_capacity(FILE_HEADER_SIZE);
+    header.extend_from_slice(b"LOGG");
+    header.extend_from_slice(&(FILE_HEADER_SIZE as u32).to_le_bytes());
+    header.extend_from_slice(&[0; 8]); // application and binlog versions
+    header.extend_from_slice(&file_size.to_le_bytes());
+    header.extend_from_slice(&uncompressed_size.to_le_bytes());
+    header.extend_from_slice(&object_count.to_le_bytes());
+    header.extend_from_slice(&0u32.to_le_bytes()); // objects read
+    for _ in 0..2 {
+        // Start and stop as SYSTEMTIME: year, month, day of week, day, hour, minute, second, milliseconds
+        for value in [2024u16, 1, 1, 1, 0, 0, 0, 0] {
+            header.extend_from_slice(&value.to_le_bytes());
+        }
+    }
+    header.resize(FILE_HEADER_SIZE, 0);
+    header
+}
+
+/// Options of a generated BLF file
+#[derive(Debug, Clone)]
+pub struct BlfOptions {
+    /// Number of CAN busses (BLF channels 1..=busses), every bus has its own DBC
+    pub busses: usize,
+    /// Messages per bus, cycling through LAYOUTS
+    pub messages: usize,
+    /// Cycle time of the fastest message, message i is sent every (1 + i % 4) cycle times
+    pub cycle_time_us: u64,
+    /// Stop once the file reaches this size in bytes
+    pub target_size: u64,
+    /// Zlib level of the containers, None writes uncompressed containers
+    pub compression: Option<u32>,
+    /// Uncompressed size of a LOG_CONTAINER
+    pub container_size: usize,
+    /// Split objects over container boundaries (like CANoe and python-can do), otherwise
+    /// containers only end between objects
+    pub split_objects: bool,
+    /// Share of frames written as CAN_ERROR_EXT
+    pub error_frame_rate: f64,
+    pub seed: u64,
+}
+
+impl Default for BlfOptions {
+    fn default() -> Self {
+        Self {
+            busses: 2,
+            messages: 16,
+            cycle_time_us: 10_000,
+            target_size: 100 << 20,
+            compression: Some(1),
+            container_size: 128 << 10,
+            split_objects: true,
+            error_frame_rate: 0.0,
+            seed: 0,
+        }
+    }
+}
+
+/// Summary of a generated BLF file
+#[derive(Debug, Clone, Default)]
+pub struct BlfSummary {
+    pub frames: u64,
+    pub containers: u64,
+    pub file_size: u64,
+    pub uncompressed_size: u64,
+    pub duration_s: f64,
+}
+
+/// Writes CAN objects into LOG_CONTAINERs of a BLF file, the header is completed by finish()
+pub struct BlfWriter<W: Write + Seek> {
+    writer: W,
+    compression: Option<u32>,
+    container_size: usize,
+    split_objects: bool,
+    buffer: Vec<u8>,
+    summary: BlfSummary,
+}
+
+impl<W: Write + Seek> BlfWriter<W> {
+    pub fn new(mut writer: W, compression: Option<u32>, container_size: usize, split_objects: bool) -> io::Result<Self> {
+        writer.write_all(&file_header(0, 0, 0))?;
+        Ok(Self {
+            writer,
+            compression,
+            container_size: container_size.max(1),
+            split_objects,
+            buffer: Vec::with_capacity(container_size + 64),
+            summary: BlfSummary { file_size: FILE_HEADER_SIZE as u64, ..Default::default() },
+        })
+    }
+
+    pub fn write_can_object(&mut self, object_type: u32, timestamp_ns: u64, channel: u16, id: u32, data: &[u8; 8]) -> io::Result<()> {
+        let len = self.buffer.len();
+        push_can_object(&mut self.buffer, object_type, timestamp_ns, channel, id, data);
+        self.summary.frames += 1;
+        self.summary.duration_s = timestamp_ns as f64 * 1e-9;
+
+        if self.split_objects {
+            while self.buffer.len() >= self.container_size {
+                self.write_container(self.container_size)?;
+            }
+        } else if self.buffer.len() > self.container_size && len > 0 {
+            // The new object doesn't fit anymore, it starts the next container
+            self.write_container(len)?;
+        }
+        Ok(())
+    }
+
+    /// Bytes written to the file so far (without the buffered container)
+    pub fn file_size(&self) -> u64 {
+        self.summary.file_size
+    }
+
+    fn write_container(&mut self, size: usize) -> io::Result<()> {
+        let (method, data) = match self.compression {
+            Some(level) => {
+                let mut encoder = ZlibEncoder::new(Vec::with_capacity(size / 2), Compression::new(level));
+                encoder.write_all(&self.buffer[..size])?;
+                (ZLIB_DEFLATE, encoder.finish()?)
+            },
+            None => (NO_COMPRESSION, self.buffer[..size].to_vec()),
+        };
+
+        let object_size = OBJ_HEADER_BASE_SIZE as u32 + 16 + data.len() as u32;
+        let mut header = Vec::with_capacity(32);
+        header.extend_from_slice(b"LOBJ");
+        header.extend_from_slice(&OBJ_HEADER_BASE_SIZE.to_le_bytes());
+        header.extend_from_slice(&1u16.to_le_bytes()); // header version
+        header.extend_from_slice(&object_size.to_le_bytes());
+        header.extend_from_slice(&LOG_CONTAINER.to_le_bytes());
+        // compression method, reserved, uncompressed size, reserved
+        header.extend_from_slice(&method.to_le_bytes());
+        header.extend_from_slice(&[0; 6]);
+        header.extend_from_slice(&(size as u32).to_le_bytes());
+        header.extend_from_slice(&[0; 4]);
+        self.writer.write_all(&header)?;
+        self.writer.write_all(&data)?;
+        let padding = (object_size % 4) as usize;
+        self.writer.write_all(&[0; 4][..padding])?;
+
+        self.buffer.drain(..size);
+        self.summary.containers += 1;
+        self.summary.file_size += (object_size as usize + padding) as u64;
+        self.summary.uncompressed_size += size as u64;
+        Ok(())
+    }
+
+    /// Write the last container and complete the file header
+    pub fn finish(mut self) -> io::Result<BlfSummary> {
+        if !self.buffer.is_empty() {
+            self.write_container(self.buffer.len())?;
+        }
+        let object_count = u32::try_from(self.summary.frames).unwrap_or(u32::MAX);
+        self.writer.seek(SeekFrom::Start(0))?;
+        self.writer.write_all(&file_header(self.summary.file_size, self.summary.uncompressed_size, object_count))?;
+        self.writer.flush()?;
+        Ok(self.summary)
+    }
+}
+
+/// Write a BLF file with periodic frames of all messages of all busses until it reaches the target size.
+/// The matching DBC of bus b is dbc_source(b, options.messages).
+pub fn generate_blf<W: Write + Seek>(writer: W, options: &BlfOptions) -> io::Result<BlfSummary> {
+    let mut blf_writer = BlfWriter::new(writer, options.compression, options.container_size, options.split_objects)?;
+    let mut rng = Rng::new(options.seed);
+
+    // Next send time of every (bus, message), the earliest is sent next
+    let mut schedule = BinaryHeap::new();
+    for bus in 0..options.busses {
+        for message_idx in 0..options.messages {
+            // Spread the first frames over one cycle so the messages don't all arrive together
+            let offset_us = (message_idx as u64 * options.cycle_time_us) / options.messages.max(1) as u64;
+            schedule.push(Reverse((offset_us * 1000, bus, message_idx, 0u64)));
+        }
+    }
+
+    while blf_writer.file_size() < options.target_size {
+        let Some(Reverse((timestamp_ns, bus, message_idx, frame_idx))) = schedule.pop() else {
+            break;
+        };
+        let data = frame_data(message_idx, frame_idx, &mut rng);
+        let is_error = options.error_frame_rate > 0.0
+            && (rng.next_u64() as f64 / u64::MAX as f64) < options.error_frame_rate;
+        let object_type = if is_error {
+            CAN_ERROR_EXT
+        } else if frame_idx % 2 == 0 {
+            CAN_MESSAGE
+        } else {
+            CAN_MESSAGE2
+        };
+        blf_writer.write_can_object(object_type, timestamp_ns, bus as u16 + 1, message_id(message_idx), &data)?;
+
+        let cycle_time_ns = options.cycle_time_us * 1000 * (1 + message_idx as u64 % 4);
+        schedule.push(Reverse((timestamp_ns + cycle_time_ns, bus, message_idx, frame_idx + 1)));
+    }
+
+    blf_writer.finish()
+}